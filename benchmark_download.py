@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+import click
+import collections
+import json
+import math
+import sys
+import tempfile
+import time
+
+from download_vk_packs import (
+    download_files,
+    get_siq_urls,
+)
+
+from sigame_tools.fake_vk import (
+    POSTS_PER_PAGE,
+    run_fake_vk_server,
+)
+
+from sigame_tools.instrumentation import (
+    instrumented,
+)
+
+from sigame_tools.manifest import (
+    Manifest,
+)
+
+from sigame_tools.session import (
+    make_session,
+)
+
+
+@click.command()
+@click.option('--packages', type=int, default=100, show_default=True)
+@click.option('--package_size', type=int, default=256 * 1024, show_default=True,
+              help='Size of media file inside each package in bytes.')
+@click.option('--latency', type=float, default=0.05, show_default=True,
+              help='Seconds before server starts to respond to each request.')
+@click.option('--bandwidth', type=float, default=None,
+              help='Bytes per second server sends for each response. Unlimited by default.')
+@click.option('--error_rate', type=float, default=0, show_default=True,
+              help='Fraction of requests server responds with 503 Service Unavailable.')
+@click.option('--speed_limit', type=float, default=None)
+@click.option('--concurrency', type=int, default=4, show_default=True)
+@click.option('--page_concurrency', type=int, default=4, show_default=True)
+@click.option('--page_ttl', type=float, default=None)
+@click.option('--runs', type=int, default=2, show_default=True,
+              help='Number of runs over the same cache, the first one starts with empty cache.')
+@click.option('--random_seed', type=int, default=None)
+@click.option('--output', type=click.Path(dir_okay=False), default=None,
+              help='Path to write JSON report. Standard output is used by default.')
+@instrumented
+def main(packages, package_size, latency, bandwidth, error_rate, speed_limit, concurrency, page_concurrency,
+         page_ttl, runs, random_seed, output):
+    parameters = dict(
+        packages=packages,
+        package_size=package_size,
+        latency=latency,
+        bandwidth=bandwidth,
+        error_rate=error_rate,
+        speed_limit=speed_limit,
+        concurrency=concurrency,
+        page_concurrency=page_concurrency,
+        page_ttl=page_ttl,
+    )
+    with run_fake_vk_server(packages=packages, package_size=package_size, latency=latency, bandwidth=bandwidth,
+                            error_rate=error_rate, random_seed=random_seed) as server, \
+            tempfile.TemporaryDirectory() as cache_dir:
+        results = [
+            run_benchmark(
+                server=server,
+                cache_dir=cache_dir,
+                speed_limit=speed_limit,
+                concurrency=concurrency,
+                page_concurrency=page_concurrency,
+                page_ttl=page_ttl,
+            )
+            for _ in range(runs)
+        ]
+    report = dict(parameters=parameters, runs=results)
+    if output:
+        with open(output, 'w') as stream:
+            json.dump(report, stream, indent=4)
+    else:
+        json.dump(report, sys.stdout, indent=4)
+        sys.stdout.write('\n')
+
+
+def run_benchmark(server, cache_dir, speed_limit, concurrency, page_concurrency, page_ttl):
+    pages = math.ceil(server.packages / POSTS_PER_PAGE)
+    sent_bytes = server.sent_bytes
+    requests = server.requests
+    start = time.monotonic()
+    stats = collections.Counter()
+    with Manifest(cache_dir) as manifest, \
+            make_session(user_agent='benchmark', max_connections_per_host=concurrency + page_concurrency) as session:
+        stats = download_files(
+            urls=get_siq_urls(
+                offset=0,
+                pages=pages,
+                vk_group_url=server.topic_url,
+                manifest=manifest,
+                session=session,
+                page_ttl=page_ttl,
+                page_concurrency=page_concurrency,
+                stats=stats,
+            ),
+            session=session,
+            manifest=manifest,
+            speed_limit=speed_limit,
+            concurrency=concurrency,
+            stats=stats,
+        )
+    duration = time.monotonic() - start
+    throughput = stats.downloaded_bytes / duration
+    return dict(
+        duration=duration,
+        files=stats.files,
+        errors=stats.errors,
+        page_errors=stats.page_errors,
+        requests=server.requests - requests,
+        downloaded_bytes=stats.downloaded_bytes,
+        sent_bytes=server.sent_bytes - sent_bytes,
+        throughput=throughput,
+        rate_limit_accuracy=throughput / speed_limit if speed_limit else None,
+        cache_hit_ratio=stats.cached / stats.files if stats.files else None,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+import click
+import json
+import os.path
+import shlex
+import statistics
+import subprocess
+import sys
+import time
+
+SCRIPTS = (
+    'benchmark_download.py',
+    'benchmark_suite.py',
+    'crop_image.py',
+    'download_vk_packs.py',
+    'generate_answer_media_pack.py',
+    'generate_index.py',
+    'generate_random_pack.py',
+    'index_stats.py',
+    'merge_index.py',
+    'search_index.py',
+    'serve_packs.py',
+    'split_index.py',
+    'update_index.py',
+)
+
+ENTRY_POINT = 'sigame-tools'
+
+TOP_IMPORTS = 10
+
+
+@click.command()
+@click.option('--runs', type=int, default=10, show_default=True,
+              help='Number of times each command is started.')
+@click.option('--command', type=str, multiple=True,
+              help='Command line relative to repository directory to run with Python interpreter.'
+                   ' By default --help of each script and of each entry point subcommand is used.')
+@click.option('--output', type=click.Path(dir_okay=False), default=None,
+              help='Path to write JSON report to. Report is written to stdout by default.')
+def main(runs, command, output):
+    assert runs > 0
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    commands = [shlex.split(v) for v in command] or list(get_default_commands())
+    results = [measure(base_dir=base_dir, args=v, runs=runs) for v in commands]
+    report = dict(python=sys.version, runs=runs, results=results)
+    if output:
+        with open(output, 'w') as stream:
+            json.dump(report, stream, indent=4)
+    else:
+        json.dump(report, sys.stdout, indent=4)
+        sys.stdout.write('\n')
+
+
+def get_default_commands():
+    for script in SCRIPTS:
+        yield [script, '--help']
+    yield [ENTRY_POINT, '--help']
+    for script in SCRIPTS:
+        yield [ENTRY_POINT, script[:-len('.py')].replace('_', '-'), '--help']
+
+
+def measure(base_dir, args, runs):
+    durations = list()
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + args, cwd=base_dir, check=True, stdout=subprocess.DEVNULL)
+        durations.append(time.perf_counter() - start)
+    return dict(
+        command=' '.join(args),
+        min=min(durations),
+        median=statistics.median(durations),
+        top_imports=get_top_imports(base_dir=base_dir, args=args),
+    )
+
+
+def get_top_imports(base_dir, args):
+    result = subprocess.run([sys.executable, '-X', 'importtime'] + args, cwd=base_dir, check=True,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    imports = list()
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if cumulative.strip().isdigit() and not name.startswith('   '):
+            imports.append(dict(module=name.strip(), cumulative_us=int(cumulative)))
+    return sorted(imports, key=lambda v: v['cumulative_us'], reverse=True)[:TOP_IMPORTS]
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+
+import click
+import json
+import os.path
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from generate_random_pack import (
+    generate_content_xml,
+    generate_rounds,
+    write_package,
+)
+
+from sigame_tools.common import (
+    THEME_METADATA_FIELDS,
+    build_themes_index,
+    read_index,
+    write_index,
+)
+
+from sigame_tools.filters import (
+    make_filter,
+    make_preferred_filter,
+)
+
+from sigame_tools.instrumentation import (
+    instrumented,
+)
+
+from sigame_tools.synthetic import (
+    CorpusParameters,
+    generate_corpus,
+)
+
+from sigame_tools.weighted import (
+    make_get_weight,
+)
+
+FILTERS = (
+    ('include', 'questions_num', '5'),
+    ('exclude', 'theme_name', '^[a-c]'),
+    ('prefer', 'authors', '^[A-F]'),
+)
+
+WEIGHTS = (
+    ('theme_name', '^[a-m]', 2.0),
+    ('images_num', '1', 0.5),
+)
+
+
+@click.command()
+@click.option('--scale', type=int, multiple=True, default=(10, 100), show_default=True,
+              help='Number of packages in a synthetic corpus. Benchmarks run for each scale.')
+@click.option('--rounds', type=int, default=3, show_default=True)
+@click.option('--themes_per_round', type=int, default=6, show_default=True)
+@click.option('--questions_per_theme', type=int, default=5, show_default=True)
+@click.option('--answers_per_question', type=int, default=2, show_default=True)
+@click.option('--media_per_theme', type=int, default=1, show_default=True)
+@click.option('--media_size', type=int, default=16 * 1024, show_default=True)
+@click.option('--final_themes', type=int, default=3, show_default=True)
+@click.option('--repeat', type=int, default=3, show_default=True,
+              help='Number of times each benchmark runs for each scale.')
+@click.option('--random_seed', type=int, default=42, show_default=True)
+@click.option('--output', type=click.Path(dir_okay=False), default=None,
+              help='Path to write JSON report to. Report is written to stdout by default.')
+@instrumented
+def main(scale, rounds, themes_per_round, questions_per_theme, answers_per_question, media_per_theme, media_size,
+         final_themes, repeat, random_seed, output):
+    assert repeat > 0
+    results = list()
+    for packages in scale:
+        parameters = CorpusParameters(
+            packages=packages,
+            rounds=rounds,
+            themes_per_round=themes_per_round,
+            questions_per_theme=questions_per_theme,
+            answers_per_question=answers_per_question,
+            media_per_theme=media_per_theme,
+            media_size=media_size,
+            final_themes=final_themes,
+        )
+        with tempfile.TemporaryDirectory() as work_dir:
+            results.append(run_scale(
+                work_dir=work_dir,
+                parameters=parameters,
+                repeat=repeat,
+                random_seed=random_seed,
+            ))
+    report = dict(
+        environment=dict(
+            python=platform.python_version(),
+            implementation=platform.python_implementation(),
+            platform=platform.platform(),
+            cpu_count=os.cpu_count(),
+        ),
+        repeat=repeat,
+        random_seed=random_seed,
+        results=results,
+    )
+    if output:
+        with open(output, 'w') as stream:
+            json.dump(report, stream, indent=4)
+    else:
+        json.dump(report, sys.stdout, indent=4)
+        sys.stdout.write('\n')
+
+
+def run_scale(work_dir, parameters, repeat, random_seed):
+    corpus_dir = os.path.join(work_dir, 'corpus')
+    index_path = os.path.join(work_dir, 'index.json')
+    package_path = os.path.join(work_dir, 'pack.siq')
+    generate_corpus(output_dir=corpus_dir, parameters=parameters, random_seed=random_seed)
+    themes = tuple(build_themes_index([corpus_dir]))
+    write_index(themes=themes, output=index_path)
+    filter_f = make_filter(args=FILTERS, types=THEME_METADATA_FIELDS)
+    is_preferred = make_preferred_filter(args=FILTERS, types=THEME_METADATA_FIELDS)
+
+    def sample():
+        random.seed(random_seed)
+        return generate_rounds(
+            metadata=themes,
+            rounds_number=parameters.rounds,
+            themes_per_round=min(parameters.themes_per_round, parameters.packages),
+            min_questions_per_theme=parameters.questions_per_theme,
+            max_questions_per_theme=parameters.questions_per_theme,
+            filter_f=filter_f,
+            is_preferred=is_preferred,
+            use_unique_theme_names=True,
+            use_unique_right_answers=True,
+            shuffle=True,
+            check_right_answers_similarity=True,
+            get_weight=make_get_weight(args=WEIGHTS, types=THEME_METADATA_FIELDS),
+            final_themes=min(parameters.final_themes, parameters.packages),
+        )
+
+    def filter_themes():
+        f = make_filter(args=FILTERS, types=THEME_METADATA_FIELDS)
+        return sum(1 for v in themes if f(v))
+
+    def weight_themes():
+        get_weight = make_get_weight(args=WEIGHTS, types=THEME_METADATA_FIELDS)
+        return sum(get_weight(v) for v in themes)
+
+    rounds = sample()
+    content_xml, files = generate_content_xml(name='Benchmark', rounds=rounds, use_obfuscation=False,
+                                              use_unified_price=True)
+    benchmarks = (
+        ('build_themes_index', lambda: tuple(build_themes_index([corpus_dir]))),
+        ('write_index', lambda: write_index(themes=themes, output=index_path)),
+        ('read_index', lambda: read_index(index_path)),
+        ('make_filter', filter_themes),
+        ('make_get_weight', weight_themes),
+        ('generate_rounds', sample),
+        ('generate_content_xml', lambda: generate_content_xml(name='Benchmark', rounds=rounds,
+                                                              use_obfuscation=False, use_unified_price=True)),
+        ('write_package', lambda: write_package(content_xml=content_xml, files=files, output=package_path)),
+    )
+    results = {name: measure(f, repeat) for name, f in benchmarks}
+    return dict(
+        corpus=parameters._asdict(),
+        themes=len(themes),
+        index_bytes=os.path.getsize(index_path),
+        package_bytes=os.path.getsize(package_path),
+        benchmarks=results,
+    )
+
+
+def measure(f, repeat):
+    durations = list()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        durations.append(time.perf_counter() - start)
+    return dict(
+        min=min(durations),
+        median=statistics.median(durations),
+        mean=statistics.mean(durations),
+        runs=durations,
+    )
+
+
+if __name__ == "__main__":
+    main()
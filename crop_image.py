@@ -2,7 +2,22 @@
 
 import PIL.Image
 import click
+import collections
+import concurrent.futures
+import functools
+import glob
+import logging
+import numpy
 import os.path
+import re
+
+from sigame_tools.instrumentation import (
+    count,
+    instrumented,
+    span,
+)
+
+log = logging.getLogger('crop_image')
 
 
 @click.command()
@@ -11,14 +26,65 @@ import os.path
 @click.option('--max_border_height', type=int, default=10)
 @click.option('--min_border_length', type=int, default=150)
 @click.option('--min_boder_gray', type=int, default=40)
-@click.argument('path', default='', type=click.Path())
-def main(path, base_x, base_y, max_border_height, min_border_length, min_boder_gray):
+@click.option('--jobs', type=int, default=os.cpu_count(), show_default=True,
+              help='Number of images processed in parallel.')
+@click.option('--skip_cropped', type=click.Choice(('true', 'false')), default='true', show_default=True,
+              help='Skip images with all crops newer than the image.')
+@click.option('--strip_height', type=int, default=None,
+              help='Scan image by strips of given height and write each crop as soon as it is found.'
+                   ' Raw encoded images (BMP, PPM, TGA, uncompressed TIFF) are read from file by strips.')
+@click.argument('paths', nargs=-1, type=str, required=True)
+@instrumented
+def main(paths, base_x, base_y, max_border_height, min_border_length, min_boder_gray, jobs, skip_cropped,
+         strip_height):
+    assert jobs > 0
+    assert strip_height is None or strip_height > 0
+    with span('find_images'):
+        image_paths = tuple(find_images(paths))
+    if skip_cropped == 'true':
+        crops_mtimes = get_crops_mtimes(image_paths)
+        image_paths = tuple(v for v in image_paths if not is_cropped(path=v, crops_mtimes=crops_mtimes))
+    crop = functools.partial(
+        try_crop,
+        crop=functools.partial(
+            crop_image if strip_height is None else functools.partial(crop_image_by_strips, strip_height=strip_height),
+            base_x=base_x,
+            base_y=base_y,
+            max_border_height=max_border_height,
+            min_border_length=min_border_length,
+            min_boder_gray=min_boder_gray,
+        ),
+    )
+    with span('crop'):
+        if jobs == 1 or len(image_paths) <= 1:
+            log_crops(paths=image_paths, crops_nums=map(crop, image_paths))
+            return
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            log_crops(paths=image_paths, crops_nums=executor.map(crop, image_paths))
+
+
+def log_crops(paths, crops_nums):
+    for path, (crops_num, error) in zip(paths, crops_nums):
+        if error is not None:
+            log.error('Failed to crop %s: %s', path, error)
+            count('failed_images')
+            continue
+        log.info('Cropped %s into %s images', path, crops_num)
+
+
+def try_crop(path, crop):
+    try:
+        return crop(path), None
+    except Exception as e:
+        return None, f'{type(e).__name__}: {e}'
+
+
+def crop_image(path, base_x, base_y, max_border_height, min_border_length, min_boder_gray):
     basename, extension = os.path.basename(path).rsplit('.', 1)
     out_path = os.path.dirname(path)
     with PIL.Image.open(path) as image:
         borders = tuple(get_borders(
-            pixels=image.load(),
-            height=image.height,
+            image=image,
             base_x=base_x,
             base_y=base_y,
             max_border_height=max_border_height,
@@ -31,10 +97,149 @@ def main(path, base_x, base_y, max_border_height, min_border_length, min_boder_g
             top, bottom = border
             crop = image.crop((0, top + 5, image.width, bottom - 5))
             crop.save(os.path.join(out_path, f'{basename}.{str(number).zfill(num_size)}.{extension}'))
+    return len(crops)
+
+
+def crop_image_by_strips(path, strip_height, base_x, base_y, max_border_height, min_border_length, min_boder_gray):
+    basename, extension = os.path.basename(path).rsplit('.', 1)
+    out_path = os.path.dirname(path)
+    crop_paths = list()
+    with PIL.Image.open(path) as image:
+        strips = StripBuffer(image)
+
+        def get_rows():
+            for strip_top, strip in read_strips(path=path, image=image, strip_height=strip_height):
+                strips.append(top=strip_top, strip=strip)
+                check_border_band(image=strip, base_x=base_x, min_border_length=min_border_length)
+                is_border = get_border_mask(
+                    pixels=numpy.asarray(strip.crop((base_x, 0, base_x + min_border_length, strip.height))),
+                    min_gray=min_boder_gray,
+                )
+                yield from enumerate(is_border, strip_top)
+
+        def save_crop(top, bottom):
+            crop_path = os.path.join(out_path, f'.{basename}.{len(crop_paths)}.{extension}')
+            strips.crop(top=top + 5, bottom=bottom - 5).save(crop_path)
+            crop_paths.append(crop_path)
+
+        borders = list()
+        top = None
+        for border in find_borders(rows=get_rows(), base_y=base_y, max_border_height=max_border_height):
+            borders.append(border)
+            if len(borders) == 1:
+                top = max(border - 20, 0)
+            elif len(borders) >= 4 and len(borders) % 2 == 0:
+                bottom = int((borders[-3] + borders[-2]) / 2)
+                save_crop(top=top, bottom=bottom)
+                top = bottom
+                strips.discard(top)
+        if borders:
+            save_crop(top=top, bottom=borders[-1] + 20)
+    num_size = len(crop_paths) // 10 + 1
+    for number, crop_path in enumerate(crop_paths):
+        os.replace(crop_path, os.path.join(out_path, f'{basename}.{str(number).zfill(num_size)}.{extension}'))
+    return len(crop_paths)
+
+
+class StripBuffer:
+    def __init__(self, image):
+        self.__mode = image.mode
+        self.__width = image.width
+        self.__info = image.info
+        self.__strips = collections.deque()
+
+    def append(self, top, strip):
+        self.__strips.append((top, strip))
+
+    def discard(self, top):
+        while self.__strips and self.__strips[0][0] + self.__strips[0][1].height <= top:
+            self.__strips.popleft()
+
+    def crop(self, top, bottom):
+        result = PIL.Image.new(self.__mode, (self.__width, bottom - top))
+        result.info.update(self.__info)
+        for strip_top, strip in self.__strips:
+            if strip_top + strip.height <= top or strip_top >= bottom:
+                continue
+            part = strip.crop((0, max(top - strip_top, 0), self.__width, min(bottom - strip_top, strip.height)))
+            result.paste(part, (0, max(strip_top - top, 0)))
+        return result
+
+
+def read_strips(path, image, strip_height):
+    if len(image.tile) == 1:
+        decoder, extents, offset, args = image.tile[0]
+        if decoder == 'raw' and tuple(extents) == (0, 0, image.width, image.height) and isinstance(args, tuple):
+            rawmode, stride, orientation = args
+            yield from read_raw_strips(path=path, image=image, offset=offset, rawmode=rawmode, stride=stride,
+                                       orientation=orientation, strip_height=strip_height)
+            return
+    for top in range(0, image.height, strip_height):
+        yield top, image.crop((0, top, image.width, min(top + strip_height, image.height)))
+
+
+def read_raw_strips(path, image, offset, rawmode, stride, orientation, strip_height):
+    if not stride:
+        stride = len(PIL.Image.new(image.mode, (image.width, 1)).tobytes('raw', rawmode))
+    with open(path, 'rb') as stream:
+        for top in range(0, image.height, strip_height):
+            height = min(strip_height, image.height - top)
+            stream.seek(offset + (top if orientation > 0 else image.height - top - height) * stride)
+            data = stream.read(height * stride)
+            yield top, PIL.Image.frombytes(image.mode, (image.width, height), data, 'raw', rawmode, stride, orientation)
+
+
+def find_images(paths):
+    result = list()
+    for path in paths:
+        if os.path.isdir(path):
+            extensions = PIL.Image.registered_extensions()
+            result.extend(sorted(
+                os.path.join(path, v.name) for v in os.scandir(path)
+                if v.is_file() and os.path.splitext(v.name)[1].lower() in extensions
+            ))
+        elif glob.has_magic(path):
+            result.extend(sorted(glob.glob(path)))
+        else:
+            result.append(path)
+    present = set(result)
+    for path in result:
+        if get_crop_source(path) not in present:
+            yield path
+
+
+def get_crop_source(path):
+    match = re.fullmatch(r'(.+)\.(\d+)\.([^.]+)', path)
+    if match and is_crop_number(match.group(2)):
+        return f'{match.group(1)}.{match.group(3)}'
+
+
+def is_crop_number(value):
+    # Crop numbers are padded to len(crops) // 10 + 1 digits
+    return int(value) <= 10 * len(value) - 2
+
+
+def get_crops_mtimes(paths):
+    result = dict()
+    for out_path in sorted({os.path.dirname(v) or '.' for v in paths}):
+        for entry in os.scandir(out_path):
+            source = get_crop_source(entry.name)
+            if source is None or not entry.is_file():
+                continue
+            key = os.path.join(out_path, source)
+            mtime = entry.stat().st_mtime
+            result[key] = min(result.get(key, mtime), mtime)
+    return result
+
+
+def is_cropped(path, crops_mtimes):
+    mtime = crops_mtimes.get(os.path.join(os.path.dirname(path) or '.', os.path.basename(path)))
+    return mtime is not None and mtime >= os.path.getmtime(path)
 
 
 def get_crops(borders):
-    border = 0
+    if not borders:
+        return
     top = max(borders[0] - 20, 0)
     for i in range(1, len(borders) - 2, 2):
         bottom = int((borders[i] + borders[i + 1]) / 2)
@@ -43,31 +248,45 @@ def get_crops(borders):
     yield top, borders[-1] + 20
 
 
-def get_borders(pixels, height, base_x, base_y, max_border_height, min_border_length, min_boder_gray):
+def get_borders(image, base_x, base_y, max_border_height, min_border_length, min_boder_gray):
+    check_border_band(image=image, base_x=base_x, min_border_length=min_border_length)
+    is_border = get_border_mask(
+        pixels=numpy.asarray(image.crop((base_x, 0, base_x + min_border_length, image.height))),
+        min_gray=min_boder_gray,
+    )
+    return find_borders(rows=enumerate(is_border), base_y=base_y, max_border_height=max_border_height)
+
+
+def find_borders(rows, base_y, max_border_height):
     state = 'space'
     last_border = 0
-    for y in range(base_y, height):
+    for y, is_border in rows:
+        if y < base_y:
+            continue
         if state == 'space':
-            if y - last_border >= max_border_height and is_border(pixels, y, base_x, min_border_length, min_boder_gray):
+            if y - last_border >= max_border_height and is_border:
                 state = 'crop'
                 last_border = y
                 yield y
         elif state == 'crop':
-            if y - last_border >= max_border_height and is_border(pixels, y, base_x, min_border_length, min_boder_gray):
+            if y - last_border >= max_border_height and is_border:
                 state = 'space'
                 last_border = y
                 yield y
 
 
-def is_border(pixels, y, base_x, length, min_gray):
-    return all(is_border_color(pixels[x, y], min_gray) for x in range(base_x, base_x + length))
+def check_border_band(image, base_x, min_border_length):
+    if base_x < 0 or min_border_length <= 0 or base_x + min_border_length > image.width:
+        raise ValueError(f'Border band from x={base_x} of length {min_border_length} is out of image with'
+                         + f' width {image.width}')
 
 
-def is_border_color(color, min_gray):
-    return (
-        color[0] == color[1] == color[2] and color[0] <= min_gray or
-        color == (1, 0, 0)
-    )
+def get_border_mask(pixels, min_gray):
+    red, green, blue = pixels[..., 0], pixels[..., 1], pixels[..., 2]
+    is_border_color = (red == green) & (green == blue) & (red <= min_gray)
+    if pixels.shape[2] == 3:
+        is_border_color |= (red == 1) & (green == 0) & (blue == 0)
+    return is_border_color.all(axis=1)
 
 
 if __name__ == "__main__":
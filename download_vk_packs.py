@@ -1,22 +1,50 @@
 #!/usr/bin/env python3
 
-import base64
 import click
 import collections
+import concurrent.futures
+import contextlib
 import functools
+import hashlib
 import json
+import logging
+import lxml.etree
 import os.path
-import pyquery
-import random
 import requests
 import retry
+import threading
 import time
 import urllib.parse
 
-from sigame_tools.common import (
-    read_json,
+from sigame_tools.incremental_index import (
+    IncrementalIndex,
+    IndexingWorker,
 )
 
+from sigame_tools.instrumentation import (
+    count,
+    instrumented,
+    span,
+)
+
+from sigame_tools.manifest import (
+    Manifest,
+    hash_file,
+    remove_cached_file,
+)
+
+from sigame_tools.rate_limit import (
+    TokenBucket,
+)
+
+from sigame_tools.session import (
+    make_session,
+)
+
+CHUNK_SIZE = 64 * 1024
+
+log = logging.getLogger('download_vk_packs')
+
 
 @click.command()
 @click.option('--offset', type=int, default=0)
@@ -25,34 +53,120 @@ from sigame_tools.common import (
 @click.option('--user_agent', type=str, default='Mozilla/5.0 (iPhone; CPU OS 13_4_1 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) FxiOS/26.0 Mobile/15E148 Safari/605.1.15')
 @click.option('--cache_dir', type=click.Path(file_okay=False), required=True)
 @click.option('--speed_limit', type=float, default=None)
-def main(offset, pages, vk_group_url, user_agent, cache_dir, speed_limit):
-    download_files(
-        urls=get_siq_urls(
-            offset=offset,
-            pages=pages,
-            vk_group_url=vk_group_url,
-            cache_dir=cache_dir,
+@click.option('--concurrency', type=int, default=1, show_default=True,
+              help='Number of files downloaded in parallel. All downloads share one speed limit.')
+@click.option('--pool_size', type=int, default=10, show_default=True,
+              help='Number of hosts to keep alive connections for.')
+@click.option('--max_connections_per_host', type=int, default=10, show_default=True)
+@click.option('--page_ttl', type=float, default=None,
+              help='Seconds after which a cached topic page is revalidated. By default pages are cached forever.')
+@click.option('--page_concurrency', type=int, default=1, show_default=True,
+              help='Number of topic pages downloaded in parallel.')
+@click.option('--index_path', type=click.Path(dir_okay=False), default=None,
+              help='Index to add themes of each downloaded package to while other packages are downloaded.')
+@click.option('--index_flush_interval', type=float, default=5, show_default=True,
+              help='Minimum number of seconds between index writes.')
+@instrumented
+def main(offset, pages, vk_group_url, user_agent, cache_dir, speed_limit, concurrency, pool_size,
+         max_connections_per_host, page_ttl, page_concurrency, index_path, index_flush_interval):
+    assert concurrency > 0
+    assert page_concurrency > 0
+    with contextlib.ExitStack() as stack:
+        manifest = stack.enter_context(Manifest(cache_dir))
+        session = stack.enter_context(make_session(
             user_agent=user_agent,
-        ),
-        cache_dir=cache_dir,
-        user_agent=user_agent,
-        speed_limit=speed_limit,
-    )
+            pool_size=pool_size,
+            max_connections_per_host=max_connections_per_host,
+        ))
+        stats = collections.Counter()
+        indexing_worker = None
+        if index_path:
+            indexing_worker = stack.enter_context(IndexingWorker(
+                index=IncrementalIndex(index_path),
+                flush_interval=index_flush_interval,
+            ))
+        download_files(
+            urls=get_siq_urls(
+                offset=offset,
+                pages=pages,
+                vk_group_url=vk_group_url,
+                manifest=manifest,
+                session=session,
+                page_ttl=page_ttl,
+                page_concurrency=page_concurrency,
+                stats=stats,
+            ),
+            manifest=manifest,
+            session=session,
+            speed_limit=speed_limit,
+            concurrency=concurrency,
+            indexing_worker=indexing_worker,
+            stats=stats,
+        )
 
 
-def download_files(urls, user_agent, cache_dir, speed_limit):
+def download_files(urls, session, manifest, speed_limit, concurrency=1, indexing_worker=None, stats=None):
+    limiter = TokenBucket(rate=speed_limit, capacity=speed_limit) if speed_limit else None
     avg_speed = MovingSpeedAverage(10)
     avg_speed.add(cur_time=time.time(), distance=0)
-    for url in urls:
+    avg_speed_lock = threading.Lock()
+    if stats is None:
+        stats = collections.Counter()
+
+    def on_chunk(size):
+        if limiter:
+            limiter.acquire(size)
+        with avg_speed_lock:
+            avg_speed.add(cur_time=time.time(), distance=size)
+            stats['downloaded_bytes'] += size
+
+    def download(url):
         try:
-            while speed_limit and avg_speed.get() > speed_limit:
-                time.sleep(random.normalvariate(mu=1, sigma=0.1))
+            if limiter:
+                limiter.acquire(0)
+            with span('file_download'):
+                path, meta = get_file(url=url, session=session, manifest=manifest, on_chunk=on_chunk)
+            if indexing_worker:
+                indexing_worker.submit(path=path, file_name=meta.get('name'))
+            with avg_speed_lock:
                 avg_speed.add(cur_time=time.time(), distance=0)
-            content, meta = get_file(url=url, user_agent=user_agent, cache_dir=cache_dir)
-            avg_speed.add(cur_time=time.time(), distance=len(content) * (not meta.get('cached')))
-            print(f'Recent speed: {int(avg_speed.get())} B/s (limit: {speed_limit} B/s)')
-        except RuntimeError as e:
-            print(f'Error while downloading {url}: {str(e)}')
+                stats['files'] += 1
+                stats['cached'] += bool(meta.get('cached'))
+                log.info('Recent speed: %d B/s (limit: %s B/s)', avg_speed.get(), speed_limit)
+        except (RuntimeError, requests.RequestException) as e:
+            with avg_speed_lock:
+                stats['errors'] += 1
+            log.error('Error while downloading %s: %s', url, e)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = set()
+        for url in unique(urls):
+            if len(pending) >= 2 * concurrency:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+            pending.add(executor.submit(download, url))
+        for future in concurrent.futures.as_completed(pending):
+            future.result()
+    return DownloadStats(**{v: stats[v] for v in DownloadStats._fields})
+
+
+DownloadStats = collections.namedtuple('DownloadStats', (
+    'files',
+    'cached',
+    'errors',
+    'page_errors',
+    'downloaded_bytes',
+))
+
+
+def unique(values):
+    present = set()
+    for value in values:
+        if value in present:
+            continue
+        present.add(value)
+        yield value
 
 
 class MovingSpeedAverage:
@@ -75,20 +189,45 @@ class MovingSpeedAverage:
         return self.__sum_distance / duration if duration else 0
 
 
-def get_siq_urls(offset, pages, vk_group_url, cache_dir, user_agent):
+def get_siq_urls(offset, pages, vk_group_url, manifest, session, page_ttl=None, page_concurrency=1, stats=None):
     base_url = urllib.parse.urlparse(vk_group_url)
-    for page in range(pages):
+    if stats is None:
+        stats = collections.Counter()
+
+    def get_page_siq_links(page):
         url = make_page_url(offset=offset, page=page, vk_group_url=vk_group_url)
-        content, _ = get_page(url=url, user_agent=user_agent, cache_dir=cache_dir)
-        for siq_link in get_siq_links(content):
-            yield urllib.parse.urlunparse(urllib.parse.ParseResult(
-                scheme=base_url.scheme,
-                netloc=base_url.netloc,
-                path=siq_link,
-                params=None,
-                query=None,
-                fragment=None,
-            ))
+        try:
+            siq_links, _ = get_page(url=url, session=session, manifest=manifest, ttl=page_ttl)
+        except (RuntimeError, requests.RequestException) as e:
+            log.error('Error while downloading page %s: %s', url, e)
+            return None
+        return siq_links
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=page_concurrency) as executor:
+        for siq_links in map_ordered(executor=executor, f=get_page_siq_links, values=range(pages),
+                                     window=page_concurrency):
+            if siq_links is None:
+                stats['page_errors'] += 1
+                continue
+            for siq_link in siq_links:
+                yield urllib.parse.urlunparse(urllib.parse.ParseResult(
+                    scheme=base_url.scheme,
+                    netloc=base_url.netloc,
+                    path=siq_link,
+                    params=None,
+                    query=None,
+                    fragment=None,
+                ))
+
+
+def map_ordered(executor, f, values, window):
+    pending = collections.deque()
+    for value in values:
+        if len(pending) >= window:
+            yield pending.popleft().result()
+        pending.append(executor.submit(f, value))
+    while pending:
+        yield pending.popleft().result()
 
 
 def get_urls(offset, pages, vk_group_url):
@@ -97,44 +236,151 @@ def get_urls(offset, pages, vk_group_url):
 
 
 def get_siq_links(content):
-    html = pyquery.PyQuery(content)
-    for item in html('a.mr_label.medias_link').items():
-        yield item.attr['href']
+    target = SiqLinksTarget()
+    parser = lxml.etree.HTMLParser(target=target)
+    with span('link_extraction'):
+        parser.feed(content)
+        parser.close()
+    return tuple(target.links)
+
+
+class SiqLinksTarget:
+    def __init__(self):
+        self.links = list()
 
+    def start(self, tag, attrib):
+        if tag != 'a' or 'href' not in attrib:
+            return
+        classes = attrib.get('class', '').split()
+        if 'mr_label' in classes and 'medias_link' in classes:
+            self.links.append(attrib['href'])
 
-def fs_cached(extension, mode_suffix):
+    def end(self, tag):
+        pass
+
+    def data(self, data):
+        pass
+
+    def close(self):
+        pass
+
+
+def fs_cached(extension, mode_suffix, parse=None):
     def decorator(f):
         @functools.wraps(f)
-        def impl(url, cache_dir, *args, **kwargs):
-            os.makedirs(cache_dir, exist_ok=True)
-            name = base64.b32encode(url.encode('utf-8')).decode('utf-8')
-            data_path = os.path.join(cache_dir, '.'.join((name, extension)))
-            meta_path = os.path.join(cache_dir, '.'.join((name, extension, 'meta', 'json')))
-            print(f'Read {url} from cache {data_path}')
-            if os.path.exists(data_path) and os.path.exists(meta_path):
-                with open(data_path, 'r' + mode_suffix) as stream:
-                    content = stream.read()
-                meta = read_json(meta_path)
-                meta['cached'] = True
-                return content, meta
-            content, meta = f(url=url, *args, **kwargs)
-            print(f'Write {url} to cache {data_path}')
-            try:
-                with open(data_path, 'w' + mode_suffix) as stream:
-                    stream.write(content)
-                with open(meta_path, 'w') as stream:
-                    json.dump(meta, stream)
-            except:
-                if os.path.exists(data_path):
-                    os.remove(data_path)
-                if os.path.exists(meta_path):
-                    os.remove(meta_path)
-                raise
-            return content, meta
+        def impl(url, manifest, ttl=None, *args, **kwargs):
+            entry = get_cached_entry(manifest=manifest, url=url)
+            if entry is not None and (ttl is None or time.time() - entry.fetched_at < ttl):
+                log.debug('Read %s from cache %s', url, entry.path)
+                count('cached_pages')
+                return read_cached(entry=entry, mode_suffix=mode_suffix, parse=parse), make_cached_meta(entry)
+            content, meta = f(
+                url=url,
+                etag=entry and entry.etag,
+                last_modified=entry and entry.last_modified,
+                *args,
+                **kwargs,
+            )
+            if content is None:
+                log.debug('Read not modified %s from cache %s', url, entry.path)
+                count('not_modified_pages')
+                entry = manifest.put(
+                    url=url,
+                    path=entry.path,
+                    extension=extension,
+                    name=entry.name,
+                    etag=meta.get('etag') or entry.etag,
+                    last_modified=meta.get('last_modified') or entry.last_modified,
+                )
+                return read_cached(entry=entry, mode_suffix=mode_suffix, parse=parse), make_cached_meta(entry)
+            data_path = manifest.make_path(url=url, extension=extension) if entry is None else entry.path
+            log.debug('Write %s to cache %s', url, data_path)
+            count('downloaded_pages')
+            parsed = content if parse is None else write_parsed(path=data_path, data=parse(content))
+            write_atomically(path=data_path, data=content, mode='w' + mode_suffix)
+            write_atomically(path=data_path + '.meta.json', data=json.dumps(meta), mode='w')
+            manifest.put(
+                url=url,
+                path=data_path,
+                extension=extension,
+                name=meta.get('name'),
+                etag=meta.get('etag'),
+                last_modified=meta.get('last_modified'),
+            )
+            return parsed, meta
         return impl
     return decorator
 
 
+def get_cached_entry(manifest, url):
+    entry = manifest.get(url)
+    if entry is None or os.path.exists(entry.path):
+        return entry
+    log.warning('Download %s again: cached file %s does not exist', url, entry.path)
+    count('missing_cached_files')
+    manifest.remove(url)
+    return None
+
+
+def read_cached(entry, mode_suffix, parse=None):
+    if parse is not None and os.path.exists(entry.path + '.parsed.json'):
+        with open(entry.path + '.parsed.json') as stream:
+            return json.load(stream)
+    with open(entry.path, 'r' + mode_suffix) as stream:
+        content = stream.read()
+    return content if parse is None else write_parsed(path=entry.path, data=parse(content))
+
+
+def write_parsed(path, data):
+    write_atomically(path=path + '.parsed.json', data=json.dumps(data), mode='w')
+    return data
+
+
+def fs_streamed(extension):
+    def decorator(f):
+        @functools.wraps(f)
+        def impl(url, manifest, *args, **kwargs):
+            entry = get_cached_entry(manifest=manifest, url=url)
+            if entry is not None:
+                log.debug('Read %s from cache %s', url, entry.path)
+                count('cached_files')
+                return entry.path, make_cached_meta(entry)
+            data_path = manifest.make_path(url=url, extension=extension)
+            part_path = data_path + '.part'
+            meta = f(url=url, part_path=part_path, *args, **kwargs)
+            write_atomically(path=data_path + '.meta.json', data=json.dumps(meta), mode='w')
+            os.replace(part_path, data_path)
+            entry = manifest.add(url=url, path=data_path, extension=extension, name=meta.get('name'),
+                                 sha256=meta['sha256'])
+            if entry.alias_of is not None:
+                log.info('Alias %s to duplicate %s in cache %s', url, entry.alias_of, entry.path)
+                count('duplicate_files')
+                if entry.path != data_path:
+                    remove_cached_file(data_path)
+                return entry.path, meta
+            log.debug('Write %s to cache %s', url, data_path)
+            count('downloaded_files')
+            return data_path, meta
+        return impl
+    return decorator
+
+
+def make_cached_meta(entry):
+    return dict(name=entry.name, size=entry.size, cached=True)
+
+
+def write_atomically(path, data, mode):
+    tmp_path = path + '.tmp'
+    try:
+        with open(tmp_path, mode) as stream:
+            stream.write(data)
+        os.replace(tmp_path, path)
+    except:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
 class BadResponse(RuntimeError):
     pass
 
@@ -143,26 +389,75 @@ class EmptyHistory(RuntimeError):
     pass
 
 
-@fs_cached(extension='siq', mode_suffix='b')
-def get_file(url, user_agent, **_):
-    print(f'Download file from {url}')
-    response = requests.get(url=url, headers={'User-Agent': user_agent})
-    if not response.status_code == 200:
-        raise BadResponse(f'Response is not 200 OK: {response.status_code}')
-    if not response.history:
-        raise EmptyHistory(f'No file info')
-    name = os.path.basename(urllib.parse.urlparse(response.history[-1].headers['Location']).path)
-    return response.content, dict(name=name)
+class IncompleteDownload(RuntimeError):
+    pass
+
+
+@fs_streamed(extension='siq')
+def get_file(url, session, part_path, on_chunk=lambda _: None, **_):
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    headers = dict()
+    if offset:
+        log.info('Resume download file from %s at %s byte', url, offset)
+        headers['Range'] = f'bytes={offset}-'
+    else:
+        log.info('Download file from %s', url)
+    with session.get(url=url, headers=headers, stream=True) as response:
+        if response.status_code not in (200, 206) \
+                and (response.status_code != 416 or get_content_range_size(response) != offset):
+            raise BadResponse(f'Response is not 200 OK or 206 Partial Content: {response.status_code}')
+        if not response.history:
+            raise EmptyHistory(f'No file info')
+        name = os.path.basename(urllib.parse.urlparse(response.history[-1].headers['Location']).path)
+        if response.status_code == 416:
+            return dict(name=name, size=offset, sha256=hash_file(part_path).hexdigest())
+        if response.status_code == 206:
+            if not response.headers.get('Content-Range', '').startswith(f'bytes {offset}-'):
+                os.remove(part_path)
+                raise BadResponse(f'Unexpected Content-Range: {response.headers.get("Content-Range")}')
+            hasher = hash_file(part_path)
+        else:
+            offset = 0
+            hasher = hashlib.sha256()
+        expected_size = None if 'Content-Encoding' in response.headers else response.headers.get('Content-Length')
+        size = 0
+        with open(part_path, 'ab' if offset else 'wb') as stream:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                stream.write(chunk)
+                hasher.update(chunk)
+                size += len(chunk)
+                on_chunk(len(chunk))
+    if expected_size is not None and size != int(expected_size):
+        raise IncompleteDownload(f'Got {size} bytes of {expected_size}, will resume on next run')
+    return dict(name=name, size=offset + size, sha256=hasher.hexdigest())
+
+
+def get_content_range_size(response):
+    value = response.headers.get('Content-Range', '')
+    if value.startswith('bytes */'):
+        return int(value[len('bytes */'):])
 
 
-@fs_cached(extension='html', mode_suffix='')
+@fs_cached(extension='html', mode_suffix='', parse=get_siq_links)
 @retry.retry(BadResponse, tries=3, delay=0.1, backoff=1.5)
-def get_page(url, user_agent, **_):
-    print(f'Download page from {url}')
-    response = requests.get(url=url, headers={'User-Agent': user_agent})
+def get_page(url, session, etag=None, last_modified=None, **_):
+    headers = dict()
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    if headers:
+        log.info('Revalidate page from %s', url)
+    else:
+        log.info('Download page from %s', url)
+    with span('page_download'):
+        response = session.get(url=url, headers=headers)
+    meta = dict(etag=response.headers.get('ETag'), last_modified=response.headers.get('Last-Modified'))
+    if response.status_code == 304:
+        return None, meta
     if not response.status_code == 200:
         raise BadResponse(f'Response is not 200 OK: {response.status_code}')
-    return response.content.decode(response.encoding), dict()
+    return response.content.decode(response.encoding), meta
 
 
 def make_page_url(offset, page, vk_group_url):
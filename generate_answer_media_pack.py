@@ -3,8 +3,11 @@
 import base64
 import click
 import collections
+import contextlib
 import datetime
+import fnmatch
 import glob
+import logging
 import lxml.etree
 import os.path
 import urllib.parse
@@ -14,15 +17,30 @@ import zipfile
 from sigame_tools.common import (
     SIQ_FILE_TYPE_DIRS,
     THEME_METADATA_FIELDS,
+    copy_file_to_siq,
     get_content,
     read_index,
-    read_binary_file,
     write_content_xml,
     write_index,
     write_siq_const_files,
     write_siq_file,
 )
 
+from sigame_tools.instrumentation import (
+    count,
+    instrumented,
+    span,
+)
+
+from sigame_tools.media import (
+    make_media_optimizer,
+    log_optimization_stats,
+)
+
+MAX_PENDING_IMAGES = 64
+
+log = logging.getLogger('generate_answer_media_pack')
+
 
 @click.command()
 @click.option('--author', type=str, multiple=True)
@@ -37,14 +55,28 @@ from sigame_tools.common import (
                    + 'Then file name like answer.ext will be used as answer.')
 @click.option('--comment', type=str)
 @click.option('--duration', type=int, default=None)
+@click.option('--jobs', type=int, default=None,
+              help='Number of processes to optimize images. Number of CPUs is used by default.')
+@click.option('--optimize_images', type=click.Choice(('true', 'false')), default='false', show_default=True,
+              help='Downscale and recompress JPEG, PNG and WebP images copied into the package.')
+@click.option('--max_image_size', type=int, default=1920, show_default=True,
+              help='Max width and height of optimized image.')
+@click.option('--image_quality', type=int, default=85, show_default=True,
+              help='JPEG and WebP quality of optimized image.')
+@click.option('--media_cache_dir', type=click.Path(file_okay=False), default=None,
+              help='Directory to keep optimized images between runs keyed by content hash.'
+                   ' Temporary directory is used by default.')
+@instrumented
 def main(author, package_name, round_name, theme_name, output, media_path,
-         question_suffix, media_type, comment, duration):
-    questions, file_paths = generate_questions(
-        media_path=media_path,
-        media_type=media_type,
-        question_suffix=question_suffix,
-        duration=duration,
-    )
+         question_suffix, media_type, comment, duration, jobs, optimize_images,
+         max_image_size, image_quality, media_cache_dir):
+    with span('scan'):
+        questions, media_files = generate_questions(
+            media_path=media_path,
+            media_type=media_type,
+            question_suffix=question_suffix,
+            duration=duration,
+        )
     content_xml = generate_content_xml(
         authors=author,
         package_name=package_name,
@@ -53,19 +85,28 @@ def main(author, package_name, round_name, theme_name, output, media_path,
         comment=comment,
         questions=questions,
     )
-    write_package(
-        content_xml=content_xml,
-        file_paths=file_paths,
-        media_type=media_type,
-        output=output,
-    )
+    with contextlib.ExitStack() as stack:
+        optimizer = None
+        if optimize_images == 'true' and media_type == 'image':
+            optimizer = stack.enter_context(make_media_optimizer(
+                cache_dir=media_cache_dir,
+                max_size=max_image_size,
+                quality=image_quality,
+                jobs=jobs,
+            ))
+        write_package(
+            content_xml=content_xml,
+            media_files=media_files,
+            media_type=media_type,
+            output=output,
+            optimizer=optimizer,
+        )
 
 
 def generate_questions(media_path, media_type, question_suffix, duration):
     answers = dict()
-    file_paths = list()
-    for path in glob.glob(media_path):
-        file_paths.append(path)
+    media_files, present_paths = scan_media_path(media_path)
+    for path in (v.path for v in media_files):
         name, _ = os.path.basename(path).rsplit('.', 1)
         name_and_suffix = name.rsplit('.', 1)
         if len(name_and_suffix) > 1:
@@ -83,14 +124,14 @@ def generate_questions(media_path, media_type, question_suffix, duration):
         ))
         atom_question_element.text = get_media_text(media_type=media_type, path=path)
         answer_path = get_answer_path(path=path, question_suffix=question_suffix)
-        if answer_path is not None and os.path.exists(answer_path):
+        if answer_path is not None and answer_path in present_paths:
             lxml.etree.SubElement(scenario_element, 'atom', attrib=dict(type='marker'))
             atom_answer_element = lxml.etree.SubElement(scenario_element, 'atom', attrib=get_media_type_attrib(media_type))
             atom_answer_element.text = get_media_text(media_type=media_type, path=answer_path)
         right_element = lxml.etree.SubElement(question_element, 'right', attrib=dict())
         answer_element = lxml.etree.SubElement(right_element, 'answer', attrib=dict())
         answer_element.text = answer
-    return questions_element, file_paths
+    return questions_element, media_files
 
 
 def get_media_type_attrib(media_type, duration=None):
@@ -143,19 +184,65 @@ def generate_content_xml(authors, package_name, round_name, theme_name, comment,
     return lxml.etree.ElementTree(package_element)
 
 
-def write_package(content_xml, file_paths, media_type, output):
+MediaFile = collections.namedtuple('MediaFile', (
+    'path',
+    'size',
+))
+
+
+def scan_media_path(media_path):
+    dir_path, pattern = os.path.split(media_path)
+    dir_paths = sorted(v for v in glob.glob(dir_path) if os.path.isdir(v)) if glob.has_magic(dir_path) else [dir_path]
+    media_files = list()
+    present_paths = set()
+    for path in dir_paths:
+        try:
+            entries = tuple(os.scandir(path or os.curdir))
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            file_path = os.path.join(path, entry.name)
+            present_paths.add(file_path)
+            if entry.name.startswith('.') and not pattern.startswith('.'):
+                continue
+            if fnmatch.fnmatch(entry.name, pattern):
+                media_files.append(MediaFile(path=file_path, size=entry.stat().st_size))
+    return sorted(media_files), present_paths
+
+
+def write_package(content_xml, media_files, media_type, output, optimizer=None):
     with zipfile.ZipFile(output, 'w') as siq:
         write_siq_const_files(siq)
         write_content_xml(siq=siq, content_xml=content_xml)
         if media_type != 'text':
-            copy_files(dst_siq=siq, file_paths=file_paths, media_type=media_type)
+            with span('media_copy'):
+                copy_files(dst_siq=siq, media_files=media_files, media_type=media_type, optimizer=optimizer)
+    if optimizer is not None:
+        log_optimization_stats(optimizer)
 
 
-def copy_files(dst_siq, file_paths, media_type):
-    for src_path in file_paths:
+def copy_files(dst_siq, media_files, media_type, optimizer=None):
+    pending = collections.deque()
+    for media_file in media_files:
         file_dir = SIQ_FILE_TYPE_DIRS[media_type]
-        dst_path = os.path.join(file_dir, get_encoded_file_name(src_path))
-        write_siq_file(siq=dst_siq, path=dst_path, data=read_binary_file(src_path))
+        dst_path = os.path.join(file_dir, get_encoded_file_name(media_file.path))
+        log.debug('Copy %s to %s...', media_file.path, dst_path)
+        count('media_files')
+        count('media_bytes', media_file.size)
+        if optimizer is None:
+            copy_file_to_siq(siq=dst_siq, path=dst_path, src_path=media_file.path)
+            continue
+        with open(media_file.path, 'rb') as stream:
+            pending.append((dst_path, optimizer.submit(stream.read())))
+        while len(pending) > MAX_PENDING_IMAGES:
+            write_optimized_file(siq=dst_siq, pending=pending)
+    while pending:
+        write_optimized_file(siq=dst_siq, pending=pending)
+
+
+def write_optimized_file(siq, pending):
+    path, future = pending.popleft()
+    write_siq_file(siq=siq, path=path, data=future.result())
 
 
 def get_encoded_file_name(path):
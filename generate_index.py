@@ -4,15 +4,32 @@ import click
 
 from sigame_tools.common import (
     build_themes_index,
+    get_theme_position,
     write_index,
 )
 
+from sigame_tools.instrumentation import (
+    instrumented,
+)
+
+from sigame_tools.search import (
+    build_search_index,
+)
+
 
 @click.command()
 @click.option('--output', type=click.Path(), required=True)
+@click.option('--search_index', type=click.Path(dir_okay=False), default=None,
+              help='Also build search index for search_index.py at a given path.')
+@click.option('--jobs', type=int, default=None,
+              help='Number of processes to read packages. Number of CPUs is used by default.')
 @click.argument('paths', nargs=-1, type=str, required=True)
-def main(output, paths):
-    write_index(themes=build_themes_index(paths), output=output)
+@instrumented
+def main(output, search_index, jobs, paths):
+    themes = tuple(sorted(build_themes_index(paths=paths, jobs=jobs), key=get_theme_position))
+    write_index(themes=themes, output=output)
+    if search_index is not None:
+        build_search_index(themes=themes, output=search_index)
 
 
 if __name__ == "__main__":
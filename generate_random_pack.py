@@ -1,9 +1,10 @@
 #!/usr/bin/env python3
 
-import Levenshtein
 import click
 import collections
+import contextlib
 import datetime
+import logging
 import lxml.etree
 import math
 import os.path
@@ -28,6 +29,17 @@ from sigame_tools.common import (
     write_siq_file,
 )
 
+from sigame_tools.instrumentation import (
+    count,
+    instrumented,
+    span,
+)
+
+from sigame_tools.media import (
+    make_media_optimizer,
+    log_optimization_stats,
+)
+
 from sigame_tools.filters import (
     make_filter,
     make_preferred_filter,
@@ -37,6 +49,11 @@ from sigame_tools.weighted import (
     make_get_weight,
 )
 
+MAX_PENDING_IMAGES = 64
+
+log = logging.getLogger('generate_random_pack')
+
+
 @click.command()
 @click.option('--index_path', type=click.Path(exists=True, dir_okay=False), required=True)
 @click.option('--output', type=click.Path(), required=True)
@@ -65,14 +82,26 @@ from sigame_tools.weighted import (
                    ' is 1. If field value matches multiple patterns mean weight is used.')
 @click.option('--final_themes', type=int, default=None)
 @click.option('--prefer_index_path', type=click.Path(exists=True, dir_okay=False), multiple=True)
+@click.option('--max_pack_bytes', type=int, default=None,
+              help='Max total size of media files copied into the package. Themes that do not fit'
+                   ' into the budget are not sampled. Themes with unknown size are excluded.')
+@click.option('--optimize_images', type=click.Choice(('true', 'false')), default='false', show_default=True,
+              help='Downscale and recompress JPEG, PNG and WebP images copied into the package.')
+@click.option('--max_image_size', type=int, default=1920, show_default=True,
+              help='Max width and height of optimized image.')
+@click.option('--image_quality', type=int, default=85, show_default=True,
+              help='JPEG and WebP quality of optimized image.')
+@click.option('--media_cache_dir', type=click.Path(file_okay=False), default=None,
+              help='Directory to keep optimized images between runs keyed by content hash.'
+                   ' Temporary directory is used by default.')
+@click.option('--jobs', type=int, default=None,
+              help='Number of processes to optimize images. Number of CPUs is used by default.')
+@instrumented
 def main(index_path, output, rounds, themes_per_round, min_questions_per_theme,
          max_questions_per_theme, random_seed, package_name, unique_theme_names,
          unique_right_answers, obfuscate, unify_price, shuffle, check_right_answers_similarity,
-         exclude_index_path, output_index, weight, final_themes, prefer_index_path, **kwargs):
-    assert rounds > 0
-    assert themes_per_round > 0
-    assert min_questions_per_theme > 0
-    assert min_questions_per_theme <= max_questions_per_theme
+         exclude_index_path, output_index, weight, final_themes, prefer_index_path,
+         max_pack_bytes, optimize_images, max_image_size, image_quality, media_cache_dir, jobs, **kwargs):
     random.seed(random_seed)
     filters = tuple(
         list(kwargs['filter'])
@@ -80,7 +109,7 @@ def main(index_path, output, rounds, themes_per_round, min_questions_per_theme,
         + list(prefer_by_indices(prefer_index_path))
     )
     weights = tuple((v[0], v[1], float(v[2])) for v in weight)
-    rounds = generate_rounds(
+    rounds, content_xml, files = make_package(
         metadata=read_index(index_path).themes,
         rounds_number=rounds,
         themes_per_round=themes_per_round,
@@ -88,28 +117,84 @@ def main(index_path, output, rounds, themes_per_round, min_questions_per_theme,
         max_questions_per_theme=max_questions_per_theme,
         filter_f=make_filter(args=filters, types=THEME_METADATA_FIELDS),
         is_preferred=make_preferred_filter(args=filters, types=THEME_METADATA_FIELDS),
+        get_weight=make_get_weight(args=weights, types=THEME_METADATA_FIELDS),
+        package_name=package_name,
         use_unique_theme_names=unique_theme_names == 'true',
         use_unique_right_answers=unique_right_answers == 'true',
-        shuffle=shuffle == 'true',
-        check_right_answers_similarity=check_right_answers_similarity == 'true',
-        get_weight=make_get_weight(args=weights, types=THEME_METADATA_FIELDS),
-        final_themes=themes_per_round if final_themes is None else final_themes,
-    )
-    content_xml, files = generate_content_xml(
-        name=package_name,
-        rounds=rounds,
         use_obfuscation=obfuscate == 'true',
         use_unified_price=unify_price == 'true',
+        shuffle=shuffle == 'true',
+        check_right_answers_similarity=check_right_answers_similarity == 'true',
+        final_themes=final_themes,
+        max_pack_bytes=max_pack_bytes,
     )
-    write_package(
-        content_xml=content_xml,
-        files=files,
-        output=output,
-    )
+    with contextlib.ExitStack() as stack:
+        optimizer = None
+        if optimize_images == 'true':
+            optimizer = stack.enter_context(make_media_optimizer(
+                cache_dir=media_cache_dir,
+                max_size=max_image_size,
+                quality=image_quality,
+                jobs=jobs,
+            ))
+        write_package(
+            content_xml=content_xml,
+            files=files,
+            output=output,
+            optimizer=optimizer,
+        )
     if output_index:
         write_index(themes=(w for v in rounds for w in v.themes), output=output_index)
 
 
+def make_package(metadata, rounds_number, themes_per_round, min_questions_per_theme, max_questions_per_theme,
+                 filter_f, is_preferred, get_weight, package_name, use_unique_theme_names, use_unique_right_answers,
+                 use_obfuscation, use_unified_price, shuffle, check_right_answers_similarity, final_themes=None,
+                 max_pack_bytes=None, read_theme=None, rng=random):
+    assert rounds_number > 0
+    assert themes_per_round > 0
+    assert min_questions_per_theme > 0
+    assert min_questions_per_theme <= max_questions_per_theme
+    broken = sum(1 for v in metadata if v.media_ok is False)
+    if broken:
+        log.info('%s themes reference missing media files and will be excluded', broken)
+    budget = None
+    if max_pack_bytes is not None:
+        budget = MediaBudget(max_pack_bytes)
+        unknown = sum(1 for v in metadata if v.media_bytes is None)
+        if unknown:
+            log.warning('%s themes have unknown media size and will be excluded, update index to fix', unknown)
+    rounds = generate_rounds(
+        metadata=metadata,
+        rounds_number=rounds_number,
+        themes_per_round=themes_per_round,
+        min_questions_per_theme=min_questions_per_theme,
+        max_questions_per_theme=max_questions_per_theme,
+        filter_f=filter_f,
+        is_preferred=is_preferred,
+        use_unique_theme_names=use_unique_theme_names,
+        use_unique_right_answers=use_unique_right_answers,
+        shuffle=shuffle,
+        check_right_answers_similarity=check_right_answers_similarity,
+        get_weight=get_weight,
+        final_themes=themes_per_round if final_themes is None else final_themes,
+        budget=budget,
+        rng=rng,
+    )
+    if budget is not None:
+        log.info('Media size: %s of %s bytes', budget.spent, max_pack_bytes)
+    with span('content_xml'):
+        content_xml, files = generate_content_xml(
+            name=package_name,
+            rounds=rounds,
+            use_obfuscation=use_obfuscation,
+            use_unified_price=use_unified_price,
+            read_theme=read_theme,
+            rng=rng,
+        )
+    return rounds, content_xml, files
+
+
 def prefer_by_indices(paths):
     for path in paths:
         yield from prefer_by_index(read_index(path))
@@ -133,60 +218,69 @@ def exclude_by_index(index):
 def generate_rounds(metadata, rounds_number, themes_per_round, min_questions_per_theme,
                     max_questions_per_theme, filter_f, is_preferred, use_unique_theme_names,
                     use_unique_right_answers, shuffle, check_right_answers_similarity, get_weight,
-                    final_themes):
-    print(f'Generate rounds from {len(metadata)} themes...')
+                    final_themes, budget=None, rng=random):
+    log.info('Generate rounds from %s themes...', len(metadata))
     def is_acceptable(theme):
         if theme.round_type is None and not (min_questions_per_theme <= theme.questions_num <= max_questions_per_theme):
             return False
+        if theme.media_ok is False:
+            return False
         return filter_f(theme)
-    accepted, preferred = prepare_themes(
-        metadata=metadata,
-        is_acceptable=is_acceptable,
-        is_preferred=is_preferred,
-    )
-    print(f"Got {sum_themes(preferred.get(None))} normal and {sum_themes(preferred.get('final'))} final preferred"
-          + f" and {sum_themes(accepted.get(None))} normal and {sum_themes(accepted.get('final'))} final accepted"
-          + ' themes')
-    rounds = tuple(make_rounds(rounds_number))
-    populate_rounds_with_preferred(
-        rounds=rounds,
-        themes_per_round=themes_per_round,
-        min_questions_per_theme=min_questions_per_theme,
-        max_questions_per_theme=max_questions_per_theme,
-        themes=preferred,
-        final_themes=final_themes,
-    )
-    used_theme_names = get_theme_names(rounds) if use_unique_theme_names else None
-    used_right_answers = get_right_answers(rounds) if use_unique_right_answers else None
-    is_used = make_filter_used_by(
-        used_theme_names=used_theme_names,
-        used_right_answers=used_right_answers,
-        check_right_answers_similarity=check_right_answers_similarity,
-    )
-    populate_rounds(
-        rounds=rounds,
-        themes_per_round=themes_per_round,
-        min_questions_per_theme=min_questions_per_theme,
-        max_questions_per_theme=max_questions_per_theme,
-        is_used=is_used,
-        themes=accepted,
-        used_theme_names=used_theme_names,
-        used_right_answers=used_right_answers,
-        get_weight=get_weight,
-        final_themes=final_themes,
-    )
-    if shuffle:
-        shuffle_themes(rounds)
+    with span('filter'):
+        accepted, preferred = prepare_themes(
+            metadata=metadata,
+            is_acceptable=is_acceptable,
+            is_preferred=is_preferred,
+        )
+    log.info('Got %s normal and %s final preferred and %s normal and %s final accepted themes',
+             sum_themes(preferred.get(None)), sum_themes(preferred.get('final')),
+             sum_themes(accepted.get(None)), sum_themes(accepted.get('final')))
+    with span('sample'):
+        rounds = tuple(make_rounds(rounds_number))
+        populate_rounds_with_preferred(
+            rounds=rounds,
+            themes_per_round=themes_per_round,
+            min_questions_per_theme=min_questions_per_theme,
+            max_questions_per_theme=max_questions_per_theme,
+            themes=preferred,
+            final_themes=final_themes,
+            budget=budget,
+            rng=rng,
+        )
+        used_theme_names = get_theme_names(rounds) if use_unique_theme_names else None
+        used_right_answers = get_right_answers(rounds) if use_unique_right_answers else None
+        is_used = make_filter_used_by(
+            used_theme_names=used_theme_names,
+            used_right_answers=used_right_answers,
+            check_right_answers_similarity=check_right_answers_similarity,
+            budget=budget,
+        )
+        populate_rounds(
+            rounds=rounds,
+            themes_per_round=themes_per_round,
+            min_questions_per_theme=min_questions_per_theme,
+            max_questions_per_theme=max_questions_per_theme,
+            is_used=is_used,
+            themes=accepted,
+            used_theme_names=used_theme_names,
+            used_right_answers=used_right_answers,
+            get_weight=get_weight,
+            final_themes=final_themes,
+            budget=budget,
+            rng=rng,
+        )
+        if shuffle:
+            shuffle_themes(rounds=rounds, rng=rng)
     return rounds
 
 
-def shuffle_themes(rounds):
+def shuffle_themes(rounds, rng=random):
     themes = collections.defaultdict(list)
     for round_ in rounds:
         if round_.type != 'final':
             themes[round_.themes[0].questions_num].extend(round_.themes)
     for value in themes.values():
-        random.shuffle(value)
+        rng.shuffle(value)
     for round_ in rounds:
         if round_.type != 'final':
             number = len(round_.themes)
@@ -241,7 +335,7 @@ def make_rounds(rounds_number):
 
 
 def populate_rounds_with_preferred(rounds, themes_per_round, min_questions_per_theme, max_questions_per_theme,
-                                   themes, final_themes):
+                                   themes, final_themes, budget=None, rng=random):
     for round_ in rounds:
         if round_.type == 'final':
             questions_num = 1
@@ -252,29 +346,41 @@ def populate_rounds_with_preferred(rounds, themes_per_round, min_questions_per_t
                 key=lambda v: len(themes[round_.type][v]),
             )
             themes_num = themes_per_round
-        print(f'Populate {round_.name} with preferred themes of {questions_num} questions...')
+        log.info('Populate %s with preferred themes of %s questions...', round_.name, questions_num)
         populate_round_with_preferred(
             round_=round_,
             themes_num=themes_num,
             themes=themes[round_.type][questions_num],
             final_themes=final_themes,
+            budget=budget,
+            rng=rng,
         )
 
 
-def populate_round_with_preferred(round_, themes_num, themes, final_themes):
+def populate_round_with_preferred(round_, themes_num, themes, final_themes, budget=None, rng=random):
     if not themes:
         return
     population = sorted(themes)
-    samples = random.sample(
-        population=population,
-        k=min(len(themes), themes_num),
-    )
+    if budget is None:
+        samples = rng.sample(
+            population=population,
+            k=min(len(themes), themes_num),
+        )
+    else:
+        samples = list()
+        for theme in rng.sample(population=population, k=len(population)):
+            if len(samples) >= themes_num:
+                break
+            if budget.fits(theme):
+                budget.spend(theme)
+                samples.append(theme)
     round_.themes.extend(samples)
     themes.difference_update(samples)
 
 
 def populate_rounds(rounds, themes_per_round, min_questions_per_theme, max_questions_per_theme, is_used,
-                    themes, used_theme_names, used_right_answers, get_weight, final_themes):
+                    themes, used_theme_names, used_right_answers, get_weight, final_themes, budget=None,
+                    rng=random):
     for round_ in rounds:
         if round_.themes:
             questions_nums = [round_.themes[0].questions_num]
@@ -282,7 +388,7 @@ def populate_rounds(rounds, themes_per_round, min_questions_per_theme, max_quest
             questions_nums = [1]
         else:
             questions_nums = list(range(min_questions_per_theme, max_questions_per_theme + 1))
-            random.shuffle(questions_nums)
+            rng.shuffle(questions_nums)
         if round_.type == 'final':
             themes_num = final_themes
         else:
@@ -296,23 +402,26 @@ def populate_rounds(rounds, themes_per_round, min_questions_per_theme, max_quest
             used_theme_names=used_theme_names,
             used_right_answers=used_right_answers,
             get_weight=get_weight,
+            budget=budget,
+            rng=rng,
         )
         if not populated:
             raise RuntimeError("Can't get themes for round: not enough samples for a"
                                + f' {round_.type or "normal"} round with [{min_questions_per_theme},'
-                               + f' {max_questions_per_theme}] question(s)')
+                               + f' {max_questions_per_theme}] question(s)'
+                               + ('' if budget is None else f' and {budget.left} media bytes left'))
 
 
 def populate_round(round_, themes_num, questions_nums, is_used, themes,
-                   used_theme_names, used_right_answers, get_weight):
+                   used_theme_names, used_right_answers, get_weight, budget=None, rng=random):
     need = themes_num - len(round_.themes)
     if need <= 0:
         return True
-    print(f'Populate {round_.name} round, need {need} themes...')
+    log.info('Populate %s round, need %s themes...', round_.name, need)
     for questions_num in questions_nums:
-        print(f'Use {len(themes[questions_num])} themes with {questions_num} questions...')
+        log.debug('Use %s themes with %s questions...', len(themes[questions_num]), questions_num)
         filtered = tuple(v for v in themes[questions_num] if not is_used(v))
-        print(f'Filtered themes: {len(filtered)} themes are left')
+        log.debug('Filtered themes: %s themes are left', len(filtered))
         if len(filtered) < need:
             continue
         samples = get_unique_samples(
@@ -322,6 +431,8 @@ def populate_round(round_, themes_num, questions_nums, is_used, themes,
             used_theme_names=used_theme_names,
             used_right_answers=used_right_answers,
             get_weight=get_weight,
+            budget=budget,
+            rng=rng,
         )
         if not samples:
             continue
@@ -331,23 +442,28 @@ def populate_round(round_, themes_num, questions_nums, is_used, themes,
     return False
 
 
-def get_unique_samples(number, is_used, themes, used_theme_names, used_right_answers, get_weight):
+def get_unique_samples(number, is_used, themes, used_theme_names, used_right_answers, get_weight, budget=None,
+                       rng=random):
     currently_used_theme_names = set()
     currently_used_right_answers = set()
     selected = list()
     while len(selected) < number:
         need = number - len(selected)
-        print(f'Need {need} sample(s)')
-        if len(themes) < need:
+        log.debug('Need %s sample(s)', need)
+        count('sample_attempts')
+        filtered = tuple(v for v in themes if not is_used(v)) if len(themes) >= need else tuple()
+        if len(filtered) < need:
             if used_theme_names is not None:
                 used_theme_names.difference_update(currently_used_theme_names)
             if used_right_answers is not None:
                 used_right_answers.difference_update(currently_used_right_answers)
+            if budget is not None:
+                for sample in selected:
+                    budget.refund(sample)
             return
-        filtered = tuple(v for v in themes if not is_used(v))
         population = sorted(filtered)
-        print(f'Filtered themes: {len(population)} themes are left')
-        samples = frozenset(random.choices(
+        log.debug('Filtered themes: %s themes are left', len(population))
+        samples = frozenset(rng.choices(
             population=population,
             k=need,
             weights=tuple(get_weight(v) for v in population),
@@ -357,6 +473,8 @@ def get_unique_samples(number, is_used, themes, used_theme_names, used_right_ans
                 continue
             selected.append(sample)
             themes.remove(sample)
+            if budget is not None:
+                budget.spend(sample)
             if used_theme_names is not None:
                 used_theme_names.add(sample.theme_name.strip())
                 currently_used_theme_names.add(sample.theme_name.strip())
@@ -367,8 +485,10 @@ def get_unique_samples(number, is_used, themes, used_theme_names, used_right_ans
     return selected
 
 
-def make_filter_used_by(used_theme_names, used_right_answers, check_right_answers_similarity):
+def make_filter_used_by(used_theme_names, used_right_answers, check_right_answers_similarity, budget=None):
     def impl(theme):
+        if budget is not None and not budget.fits(theme):
+            return True
         if used_theme_names is not None and theme.theme_name.strip() in used_theme_names:
             return True
         if used_right_answers is not None:
@@ -383,9 +503,34 @@ def make_filter_used_by(used_theme_names, used_right_answers, check_right_answer
     return impl
 
 
+class MediaBudget:
+    def __init__(self, max_bytes):
+        assert max_bytes >= 0
+        self.__max_bytes = max_bytes
+        self.__spent = 0
+
+    @property
+    def spent(self):
+        return self.__spent
+
+    @property
+    def left(self):
+        return self.__max_bytes - self.__spent
+
+    def fits(self, theme):
+        return theme.media_bytes is not None and theme.media_bytes <= self.left
+
+    def spend(self, theme):
+        self.__spent += theme.media_bytes
+
+    def refund(self, theme):
+        self.__spent -= theme.media_bytes
+
+
 def contains_similar(values, target):
     if len(target) < 5:
         return False
+    import Levenshtein
     target = target.lower()
     for value in values:
         value = value.lower()
@@ -414,30 +559,48 @@ def theme_with_round_type(theme, value):
     return ThemeMetadata(**theme_dict)
 
 
-def write_package(content_xml, files, output):
+def write_package(content_xml, files, output, optimizer=None):
     with zipfile.ZipFile(output, 'w') as siq:
         write_siq_const_files(siq)
         write_content_xml(siq=siq, content_xml=content_xml)
-        copy_files_from_siq(dst_siq=siq, files=files)
+        with span('media_copy'):
+            copy_files_from_siq(dst_siq=siq, files=files, optimizer=optimizer)
+    if optimizer is not None:
+        log_optimization_stats(optimizer)
 
 
-def copy_files_from_siq(dst_siq, files):
+def copy_files_from_siq(dst_siq, files, optimizer=None):
+    pending = collections.deque()
     for path in sorted(files.keys()):
         path_files = sorted(files[path])
-        print(f'Copy files from {path}...')
+        log.info('Copy files from %s...', path)
         with zipfile.ZipFile(path) as src_siq:
             src_siq_file_paths = {urllib.parse.unquote(v): v for v in src_siq.namelist()}
             for file_type, src_file_name, dst_file_name, theme_id in path_files:
-                print(f'Request {file_type} file {src_file_name}...')
+                log.debug('Request %s file %s...', file_type, src_file_name)
                 file_dir = SIQ_FILE_TYPE_DIRS[file_type]
                 src_file_path = src_siq_file_paths.get(os.path.join(file_dir, src_file_name))
                 if src_file_path is None:
                     raise RuntimeError(f"Can't find referenced {file_type} file {src_file_name} from {path}:"
                                        + f" package doesn't contain file, fix files or exclude theme by id {theme_id}")
                 dst_file_path = os.path.join(file_dir, dst_file_name)
-                print(f'Copy {path} package file {src_file_path} to {dst_file_path}...')
+                log.debug('Copy %s package file %s to %s...', path, src_file_path, dst_file_path)
                 data = read_siq_file(siq=src_siq, path=src_file_path)
-                write_siq_file(siq=dst_siq, path=dst_file_path, data=data)
+                count('media_files')
+                count('media_bytes', len(data))
+                if optimizer is None or file_type != 'image':
+                    write_siq_file(siq=dst_siq, path=dst_file_path, data=data)
+                    continue
+                pending.append((dst_file_path, optimizer.submit(data)))
+                while len(pending) > MAX_PENDING_IMAGES:
+                    write_optimized_file(siq=dst_siq, pending=pending)
+    while pending:
+        write_optimized_file(siq=dst_siq, pending=pending)
+
+
+def write_optimized_file(siq, pending):
+    path, future = pending.popleft()
+    write_siq_file(siq=siq, path=path, data=future.result())
 
 
 def read_siq_file(siq, path):
@@ -445,7 +608,7 @@ def read_siq_file(siq, path):
         return stream.read()
 
 
-def generate_content_xml(name, rounds, use_obfuscation, use_unified_price):
+def generate_content_xml(name, rounds, use_obfuscation, use_unified_price, read_theme=None, rng=random):
     package_element = lxml.etree.Element('package', attrib=dict(
         name=name,
         version='4',
@@ -464,7 +627,7 @@ def generate_content_xml(name, rounds, use_obfuscation, use_unified_price):
         themes_element = lxml.etree.SubElement(round_element, 'themes', attrib=dict())
         for theme in round_.themes:
             theme_element = lxml.etree.SubElement(themes_element, 'theme', attrib=dict(name=theme.theme_name))
-            theme_theme_element, theme_authors_element = read_theme_and_authors(theme)
+            theme_theme_element, theme_authors_element = (read_theme or read_theme_and_authors)(theme)
             for atom in theme_theme_element.iter('atom'):
                 atom_type = atom.attrib.get('type')
                 if atom_type and atom.text and atom.text.startswith('@'):
@@ -473,11 +636,11 @@ def generate_content_xml(name, rounds, use_obfuscation, use_unified_price):
                     files[theme.path].add((atom_type, atom.text[1:], file_name, theme.id))
                     atom.text = f'@{file_name}'
                 elif atom_type is None and atom.text and use_obfuscation:
-                    atom.text = obfuscate(atom.text)
+                    atom.text = obfuscate(text=atom.text, rng=rng)
             if use_obfuscation:
                 for answer in theme_theme_element.iter('answer'):
                     if answer.text:
-                        answer.text = obfuscate(answer.text)
+                        answer.text = obfuscate(text=answer.text, rng=rng)
             if use_unified_price:
                 if round_.type is None:
                     num = sum(1 for _ in theme_theme_element.iter('question'))
@@ -504,13 +667,13 @@ def generate_content_xml(name, rounds, use_obfuscation, use_unified_price):
     return lxml.etree.ElementTree(package_element), files
 
 
-def obfuscate(text):
+def obfuscate(text, rng=random):
     result = str()
     for symbol in text:
         if symbol.isalnum():
-            symbol = random.choice(string.ascii_uppercase if symbol.isupper() else string.ascii_lowercase)
+            symbol = rng.choice(string.ascii_uppercase if symbol.isupper() else string.ascii_lowercase)
         elif symbol.isnumeric():
-            symbol = str(random.randint(1, 9))
+            symbol = str(rng.randint(1, 9))
         result += symbol
     return result
 
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+import click
+import json
+import logging
+import numpy
+import shlex
+import sys
+
+from sigame_tools.columnar import (
+    is_columns_outdated,
+    make_theme_columns,
+    read_theme_columns,
+    write_theme_columns,
+)
+
+from sigame_tools.common import (
+    THEME_METADATA_FIELDS,
+    read_index,
+)
+
+from sigame_tools.instrumentation import (
+    instrumented,
+    span,
+)
+
+log = logging.getLogger('index_stats')
+
+
+@click.command()
+@click.option('--index_path', type=click.Path(exists=True, dir_okay=False), required=True)
+@click.option('--columns_path', type=click.Path(dir_okay=False), default=None,
+              help='Columnar copy of the index to read instead of JSON.'
+                   ' It is written when missing or older than the index.')
+@click.option('--filter_set', type=str, multiple=True,
+              help='Space separated triples of <prefer|include|exclude> <field> <pattern> in the same format'
+                   ' as --filter of generate_random_pack.py. Use shell quoting for patterns with spaces.'
+                   ' Report includes number of themes left by each set.')
+@click.option('--top', type=int, default=20, show_default=True,
+              help='Number of most frequent authors and packages to report.')
+@click.option('--output', type=click.Path(dir_okay=False), default=None,
+              help='Path to write JSON report to. Report is written to stdout by default.')
+@instrumented
+def main(index_path, columns_path, filter_set, top, output):
+    filter_sets = [parse_filter_set(v) for v in filter_set]
+    if columns_path is None:
+        columns = make_theme_columns(read_index(index_path).themes)
+    else:
+        if is_columns_outdated(columns_path=columns_path, index_path=index_path):
+            log.info('Write columns of %s to %s...', index_path, columns_path)
+            write_theme_columns(columns=make_theme_columns(read_index(index_path).themes), output=columns_path)
+        columns = read_theme_columns(columns_path)
+    with span('stats'):
+        report = dict(
+            **get_stats(columns=columns, top=top),
+            filter_sets=[dict(filter=v, **get_filter_set_stats(columns=columns, filter_set=v)) for v in filter_sets],
+        )
+    if output:
+        with open(output, 'w') as stream:
+            json.dump(report, stream, indent=4, ensure_ascii=False)
+    else:
+        json.dump(report, sys.stdout, indent=4, ensure_ascii=False)
+        sys.stdout.write('\n')
+
+
+def parse_filter_set(value):
+    tokens = shlex.split(value)
+    if len(tokens) % 3 != 0:
+        raise click.BadParameter(f'expected triples of <prefer|include|exclude> <field> <pattern>: {value}',
+                                 param_hint='--filter_set')
+    result = [tuple(tokens[i:i + 3]) for i in range(0, len(tokens), 3)]
+    for filter_type, field, _ in result:
+        if filter_type not in ('include', 'exclude', 'prefer'):
+            raise click.BadParameter(f'invalid filter type: {filter_type}', param_hint='--filter_set')
+        if field not in THEME_METADATA_FIELDS:
+            raise click.BadParameter(f'unknown field: {field}', param_hint='--filter_set')
+    return result
+
+
+def get_stats(columns, top):
+    images_num = columns['images_num'].values
+    videos_num = columns['videos_num'].values
+    voices_num = columns['voices_num'].values
+    media_bytes = columns['media_bytes']
+    known_media_bytes = media_bytes.values[media_bytes.present]
+    return dict(
+        themes=columns.size,
+        packages=len(columns['path'].categories),
+        questions_num=get_int_counts(columns['questions_num'].values),
+        round_type=get_top_counts(columns['round_type'], top=None),
+        authors=get_top_counts(columns['authors'], top),
+        package_names=get_top_counts(columns['package_name'], top),
+        media=dict(
+            images_num=int(images_num.sum()),
+            videos_num=int(videos_num.sum()),
+            voices_num=int(voices_num.sum()),
+            themes_with_images=int(numpy.count_nonzero(images_num)),
+            themes_with_videos=int(numpy.count_nonzero(videos_num)),
+            themes_with_voices=int(numpy.count_nonzero(voices_num)),
+            themes_with_unknown_bytes=int(columns.size - known_media_bytes.size),
+            themes_with_missing_files=int(numpy.count_nonzero(columns['media_ok'].values == 0)),
+            bytes=dict(
+                total=int(known_media_bytes.sum()),
+                **get_percentiles(known_media_bytes),
+            ),
+        ),
+    )
+
+
+def get_filter_set_stats(columns, filter_set):
+    with span('filter'):
+        mask = columns.filter(filter_set)
+        preferred = columns.preferred(filter_set) & mask
+    return dict(
+        themes=int(numpy.count_nonzero(mask)),
+        preferred_themes=int(numpy.count_nonzero(preferred)),
+        packages=int(numpy.unique(columns['path'].codes[mask]).size),
+        questions_num=get_int_counts(columns['questions_num'].values[mask]),
+        media_bytes=int(columns['media_bytes'].values[mask & columns['media_bytes'].present].sum()),
+    )
+
+
+def get_int_counts(values):
+    unique, counts = numpy.unique(values, return_counts=True)
+    return dict(zip(unique.tolist(), counts.tolist()))
+
+
+def get_top_counts(column, top):
+    counts = column.counts()
+    order = numpy.argsort(-counts, kind='stable')[:top]
+    return {column.categories[i]: int(counts[i]) for i in order}
+
+
+def get_percentiles(values):
+    if not values.size:
+        return dict()
+    p50, p90, p99 = numpy.percentile(values, (50, 90, 99)).tolist()
+    return dict(min=int(values.min()), p50=p50, p90=p90, p99=p99, max=int(values.max()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+import click
+import contextlib
+import heapq
+import itertools
+import logging
+import os.path
+import sqlite3
+import tempfile
+
+from sigame_tools.common import (
+    IndexWriter,
+    ThemeMetadata,
+    get_theme_position,
+    open_index,
+)
+
+from sigame_tools.instrumentation import (
+    count,
+    instrumented,
+    span,
+)
+
+log = logging.getLogger('merge_index')
+
+
+@click.command()
+@click.option('--output', type=click.Path(dir_okay=False), required=True)
+@click.option('--on_conflict', type=click.Choice(('error', 'first', 'last')), default='error', show_default=True,
+              help='Which theme to keep when themes at the same package path and position have different content.'
+                   ' Order of indexes in arguments is used.')
+@click.option('--on_duplicate_id', type=click.Choice(('error', 'skip')), default='error', show_default=True,
+              help='What to do with a theme having id of already written theme at other package path or position.')
+@click.argument('paths', nargs=-1, type=click.Path(exists=True, dir_okay=False), required=True)
+@instrumented
+def main(output, on_conflict, on_duplicate_id, paths):
+    with contextlib.ExitStack() as stack:
+        sources = [check_order(themes=stack.enter_context(open_index(v)).themes, path=v) for v in paths]
+        tmp_dir = stack.enter_context(tempfile.TemporaryDirectory(prefix='sigame_merge_'))
+        ids = stack.enter_context(WrittenIds(os.path.join(tmp_dir, 'ids.sqlite')))
+        with span('merge'), IndexWriter(output) as writer:
+            for theme in merge_themes(sources=sources, on_conflict=on_conflict):
+                if is_new_id(ids=ids, theme=theme, on_duplicate_id=on_duplicate_id):
+                    writer.write(theme)
+    log.info('Merged %s themes from %s indexes into %s', writer.themes, len(paths), output)
+
+
+def check_order(themes, path):
+    previous = None
+    for theme in themes:
+        position = get_theme_position(theme)
+        if previous is not None and position < previous:
+            raise RuntimeError(f'Index {path} is not sorted by package path and theme position at theme {theme.id},'
+                               + ' rewrite it with update_index.py')
+        previous = position
+        yield theme
+
+
+def merge_themes(sources, on_conflict):
+    merged = heapq.merge(*sources, key=get_theme_position)
+    for _, themes in itertools.groupby(merged, key=get_theme_position):
+        yield merge_same_position_themes(themes=themes, on_conflict=on_conflict)
+
+
+def merge_same_position_themes(themes, on_conflict):
+    unique = list()
+    for theme in themes:
+        for number, other in enumerate(unique):
+            if is_same_theme(theme, other):
+                count('duplicate_themes')
+                if get_known_fields_num(theme) > get_known_fields_num(other):
+                    unique[number] = theme._replace(id=other.id)
+                break
+        else:
+            unique.append(theme)
+    if len(unique) == 1:
+        return unique[0]
+    theme = unique[0]
+    message = (f'Themes with ids {", ".join(v.id for v in unique)} at round {theme.round_number}'
+               + f' theme {theme.theme_number} of {theme.path} have different content')
+    if on_conflict == 'error':
+        raise RuntimeError(f'{message}, choose one with --on_conflict')
+    count('conflicting_themes', len(unique) - 1)
+    log.warning('%s, keep %s one', message, on_conflict)
+    return unique[0] if on_conflict == 'first' else unique[-1]
+
+
+class WrittenIds:
+    def __init__(self, path):
+        self.__connection = sqlite3.connect(path)
+        self.__connection.execute('PRAGMA journal_mode=OFF')
+        self.__connection.execute('PRAGMA synchronous=OFF')
+        self.__connection.execute(
+            'CREATE TABLE ids (id TEXT PRIMARY KEY, path TEXT NOT NULL, round_number INTEGER NOT NULL,'
+            + ' theme_number INTEGER NOT NULL)'
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.__connection.close()
+
+    def add(self, theme):
+        cursor = self.__connection.execute(
+            'INSERT OR IGNORE INTO ids VALUES (?, ?, ?, ?)',
+            (theme.id, theme.path, theme.round_number, theme.theme_number),
+        )
+        if cursor.rowcount:
+            return None
+        return self.__connection.execute(
+            'SELECT path, round_number, theme_number FROM ids WHERE id = ?',
+            (theme.id,),
+        ).fetchone()
+
+
+def is_new_id(ids, theme, on_duplicate_id):
+    other = ids.add(theme)
+    if other is None:
+        return True
+    message = (f'Theme id {theme.id} at round {theme.round_number} theme {theme.theme_number} of {theme.path}'
+               + f' is already used at round {other[1]} theme {other[2]} of {other[0]}')
+    if on_duplicate_id == 'error':
+        raise RuntimeError(f'{message}, skip it with --on_duplicate_id=skip')
+    count('duplicate_ids')
+    log.warning('%s, skip it', message)
+    return False
+
+
+def is_same_theme(a, b):
+    return all(
+        getattr(a, v) == getattr(b, v)
+        for v in ThemeMetadata._fields
+        if v != 'id' and getattr(a, v) is not None and getattr(b, v) is not None
+    )
+
+
+def get_known_fields_num(theme):
+    return sum(1 for v in theme if v is not None)
+
+
+if __name__ == "__main__":
+    main()
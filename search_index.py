@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+import click
+import json
+import logging
+import sys
+
+from sigame_tools.common import (
+    read_index,
+)
+
+from sigame_tools.instrumentation import (
+    instrumented,
+)
+
+from sigame_tools.search import (
+    SEARCH_FIELDS,
+    SearchIndex,
+    build_search_index,
+    is_search_index_outdated,
+)
+
+log = logging.getLogger('search_index')
+
+
+@click.command()
+@click.option('--search_index', type=click.Path(dir_okay=False), required=True,
+              help='Path to search index. Use --search_index with generate_index.py or update_index.py to build it.')
+@click.option('--index_path', type=click.Path(exists=True, dir_okay=False), default=None,
+              help='Rebuild search index from a given index when it is missing or older than the index.')
+@click.option('--field', type=click.Choice(SEARCH_FIELDS), multiple=True,
+              help='Field to search in. All fields are used by default.')
+@click.option('--fuzzy', type=click.Choice(('true', 'false')), default='false', show_default=True,
+              help='Find values similar to a query by Levenshtein distance instead of exact substrings.')
+@click.option('--min_similarity', type=float, default=0.8, show_default=True,
+              help='Min similarity ratio of a matched value for fuzzy search.')
+@click.option('--limit', type=int, default=20, show_default=True)
+@click.argument('query', type=str)
+@instrumented
+def main(search_index, index_path, field, fuzzy, min_similarity, limit, query):
+    if index_path is not None and is_search_index_outdated(search_index_path=search_index, index_path=index_path):
+        log.info('Build search index %s from %s...', search_index, index_path)
+        build_search_index(themes=read_index(index_path).themes, output=search_index)
+    with SearchIndex(search_index) as index:
+        if fuzzy == 'true':
+            results = index.find_similar(query=query, fields=field, limit=limit, min_similarity=min_similarity)
+        else:
+            results = index.find(query=query, fields=field, limit=limit)
+    log.info('Found %s themes', len(results))
+    for result in results:
+        json.dump(result._asdict(), sys.stdout, ensure_ascii=False)
+        sys.stdout.write('\n')
+
+
+if __name__ == "__main__":
+    main()
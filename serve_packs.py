@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+
+import click
+import collections
+import contextlib
+import copy
+import functools
+import http.server
+import json
+import logging
+import os
+import random
+import re
+import shutil
+import signal
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import zipfile
+
+from generate_random_pack import (
+    exclude_by_index,
+    get_authors,
+    get_theme,
+    make_package,
+    prefer_by_index,
+    write_package,
+)
+
+from sigame_tools.common import (
+    THEME_METADATA_FIELDS,
+    get_content,
+    read_index,
+)
+
+from sigame_tools.filters import (
+    make_filter,
+    make_preferred_filter,
+)
+
+from sigame_tools.instrumentation import (
+    count,
+    instrumented,
+    span,
+)
+
+from sigame_tools.media import (
+    make_media_optimizer,
+)
+
+from sigame_tools.weighted import (
+    make_get_weight,
+)
+
+PACK_PARAMETERS = dict(
+    rounds=3,
+    themes_per_round=3,
+    min_questions_per_theme=5,
+    max_questions_per_theme=10,
+    filter=tuple(),
+    weight=tuple(),
+    random_seed=None,
+    package_name='Generated pack',
+    unique_theme_names=True,
+    unique_right_answers=True,
+    obfuscate=False,
+    unify_price=True,
+    shuffle=True,
+    check_right_answers_similarity=True,
+    exclude_index=tuple(),
+    prefer_index=tuple(),
+    final_themes=None,
+    max_pack_bytes=None,
+)
+
+INT_PARAMETERS = (
+    'rounds',
+    'themes_per_round',
+    'min_questions_per_theme',
+    'max_questions_per_theme',
+    'random_seed',
+    'final_themes',
+    'max_pack_bytes',
+)
+
+SEND_CHUNK_SIZE = 1024 * 1024
+
+log = logging.getLogger('serve_packs')
+
+
+@click.command()
+@click.option('--index_path', type=click.Path(exists=True, dir_okay=False), required=True,
+              help='Index to sample themes from. Index is reloaded when file is replaced.')
+@click.option('--host', type=str, default='127.0.0.1', show_default=True)
+@click.option('--port', type=int, default=8080, show_default=True)
+@click.option('--filter_cache_size', type=int, default=128, show_default=True,
+              help='Number of compiled filter and weight sets to keep.')
+@click.option('--package_cache_size', type=int, default=256, show_default=True,
+              help='Number of parsed package contents to keep.')
+@click.option('--optimize_images', type=click.Choice(('true', 'false')), default='false', show_default=True,
+              help='Downscale and recompress JPEG, PNG and WebP images copied into packages.')
+@click.option('--max_image_size', type=int, default=1920, show_default=True,
+              help='Max width and height of optimized image.')
+@click.option('--image_quality', type=int, default=85, show_default=True,
+              help='JPEG and WebP quality of optimized image.')
+@click.option('--media_cache_dir', type=click.Path(file_okay=False), default=None,
+              help='Directory to keep optimized images between runs keyed by content hash.'
+                   ' Temporary directory is used by default.')
+@click.option('--jobs', type=int, default=None,
+              help='Number of processes to optimize images. Number of CPUs is used by default.')
+@click.option('--named_index', type=str, multiple=True,
+              help='Index available to requests by name as NAME=PATH to exclude or prefer its themes.')
+@instrumented
+def main(index_path, host, port, filter_cache_size, package_cache_size, optimize_images, max_image_size,
+         image_quality, media_cache_dir, jobs, named_index):
+    named_indexes = parse_named_indexes(named_index)
+    with contextlib.ExitStack() as stack:
+        optimizer = None
+        if optimize_images == 'true':
+            optimizer = stack.enter_context(make_media_optimizer(
+                cache_dir=media_cache_dir,
+                max_size=max_image_size,
+                quality=image_quality,
+                jobs=jobs,
+            ))
+        server = stack.enter_context(PackServer(
+            address=(host, port),
+            index_path=index_path,
+            filter_cache_size=filter_cache_size,
+            package_cache_size=package_cache_size,
+            optimizer=optimizer,
+            named_indexes=named_indexes,
+        ))
+        log.info('Serve packs on http://%s:%s/', host, server.server_port)
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            log.info('Stop serving packs')
+
+
+def parse_named_indexes(values):
+    result = dict()
+    for value in values:
+        name, separator, path = value.partition('=')
+        if not separator or not name or not path:
+            raise click.BadParameter(f'Named index should be NAME=PATH: {value}', param_hint='--named_index')
+        if not os.path.isfile(path):
+            raise click.BadParameter(f'Index file does not exist: {path}', param_hint='--named_index')
+        result[name] = path
+    return result
+
+
+class WarmIndex:
+    def __init__(self, path, filter_cache_size, package_cache_size, named_indexes=None):
+        self.__path = path
+        self.__filter_cache_size = filter_cache_size
+        self.__package_cache_size = package_cache_size
+        self.__named_indexes = dict() if named_indexes is None else named_indexes
+        self.__lock = threading.Lock()
+        self.__state = None
+        self.__named_states = dict()
+        self.get()
+
+    def get(self):
+        stat = get_stat_key(self.__path)
+        state = self.__state
+        if state is not None and state.stat == stat:
+            return state
+        with self.__lock:
+            if self.__state is None or self.__state.stat != stat:
+                log.info('Load index %s...', self.__path)
+                with span('load_index'):
+                    self.__state = LoadedIndex(
+                        index=read_index(self.__path),
+                        stat=stat,
+                        filter_cache_size=self.__filter_cache_size,
+                        package_cache_size=self.__package_cache_size,
+                    )
+                count('index_loads')
+            return self.__state
+
+    def get_named(self, names):
+        unknown = sorted(set(names) - set(self.__named_indexes))
+        if unknown:
+            raise BadRequest(f'Unknown indexes: {", ".join(unknown)}')
+        return tuple(self.__get_named(v) for v in names)
+
+    def __get_named(self, name):
+        path = self.__named_indexes[name]
+        stat = get_stat_key(path)
+        state = self.__named_states.get(name)
+        if state is not None and state.stat == stat:
+            return state.index
+        with self.__lock:
+            state = self.__named_states.get(name)
+            if state is None or state.stat != stat:
+                log.info('Load named index %s from %s...', name, path)
+                with span('load_named_index'):
+                    state = NamedIndex(index=read_index(path), stat=stat)
+                self.__named_states[name] = state
+                count('named_index_loads')
+            return state.index
+
+
+class LoadedIndex:
+    def __init__(self, index, stat, filter_cache_size, package_cache_size):
+        self.index = index
+        self.stat = stat
+        self.loaded_at = time.time()
+        self.get_filters = functools.lru_cache(maxsize=filter_cache_size)(make_filters)
+        self.get_weight = functools.lru_cache(maxsize=filter_cache_size)(make_weight)
+        self.read_theme = make_cached_read_theme(package_cache_size)
+
+
+NamedIndex = collections.namedtuple('NamedIndex', ('index', 'stat'))
+
+
+def get_stat_key(path):
+    stat = os.stat(path)
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def make_filters(filters):
+    return (
+        make_filter(args=filters, types=THEME_METADATA_FIELDS),
+        make_preferred_filter(args=filters, types=THEME_METADATA_FIELDS),
+    )
+
+
+def make_weight(weights):
+    return make_get_weight(args=weights, types=THEME_METADATA_FIELDS)
+
+
+def make_cached_read_theme(maxsize):
+    @functools.lru_cache(maxsize=maxsize)
+    def read_content(path, mtime_ns):
+        count('package_cache_misses')
+        with zipfile.ZipFile(path) as siq:
+            return get_content(siq)
+
+    def impl(metadata):
+        content = read_content(metadata.path, os.stat(metadata.path).st_mtime_ns)
+        return copy.deepcopy(get_theme(content=content, metadata=metadata)), tuple(get_authors(content))
+
+    return impl
+
+
+class PackServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, index_path, filter_cache_size=128, package_cache_size=256, optimizer=None,
+                 named_indexes=None):
+        self.warm_index = WarmIndex(
+            path=index_path,
+            filter_cache_size=filter_cache_size,
+            package_cache_size=package_cache_size,
+            named_indexes=named_indexes,
+        )
+        self.optimizer = optimizer
+        super().__init__(address, PackHandler)
+
+
+class BadRequest(ValueError):
+    pass
+
+
+class PackHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if urllib.parse.urlparse(self.path).path != '/status':
+            return self.send_json(status=404, body=dict(error='Not found'))
+        loaded = self.server.warm_index.get()
+        self.send_json(status=200, body=dict(
+            version=loaded.index.version,
+            themes=len(loaded.index.themes),
+            loaded_at=loaded.loaded_at,
+        ))
+
+    def do_POST(self):
+        if urllib.parse.urlparse(self.path).path != '/pack':
+            return self.send_json(status=404, body=dict(error='Not found'))
+        with tempfile.TemporaryFile() as stream:
+            try:
+                parameters = parse_pack_parameters(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                with span('request'):
+                    generate_pack(
+                        loaded=self.server.warm_index.get(),
+                        parameters=parameters,
+                        output=stream,
+                        optimizer=self.server.optimizer,
+                        exclude_indexes=self.server.warm_index.get_named(parameters['exclude_index']),
+                        prefer_indexes=self.server.warm_index.get_named(parameters['prefer_index']),
+                    )
+            except (BadRequest, AssertionError) as e:
+                return self.send_json(status=400, body=dict(error=str(e) or 'Invalid parameters'))
+            except RuntimeError as e:
+                return self.send_json(status=422, body=dict(error=str(e)))
+            except Exception:
+                log.exception('Failed to generate pack')
+                count('failed_packs')
+                return self.send_json(status=500, body=dict(error='Failed to generate pack'))
+            count('packs')
+            size = stream.tell()
+            stream.seek(0)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Disposition', 'attachment; filename="pack.siq"')
+            self.send_header('Content-Length', str(size))
+            self.end_headers()
+            shutil.copyfileobj(stream, self.wfile, SEND_CHUNK_SIZE)
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        log.info('%s %s', self.address_string(), format % args)
+
+
+def parse_pack_parameters(data):
+    try:
+        values = json.loads(data or b'{}')
+    except ValueError as e:
+        raise BadRequest(f'Invalid JSON: {e}')
+    if not isinstance(values, dict):
+        raise BadRequest('Parameters should be a JSON object')
+    unknown = sorted(set(values) - set(PACK_PARAMETERS))
+    if unknown:
+        raise BadRequest(f'Unknown parameters: {", ".join(unknown)}')
+    parameters = dict(PACK_PARAMETERS, **values)
+    try:
+        parameters['filter'] = tuple((str(v[0]), str(v[1]), str(v[2])) for v in parameters['filter'])
+        parameters['weight'] = tuple((str(v[0]), str(v[1]), float(v[2])) for v in parameters['weight'])
+    except (TypeError, ValueError, IndexError) as e:
+        raise BadRequest(f'Invalid filter or weight: {e}')
+    for name in ('exclude_index', 'prefer_index'):
+        value = parameters[name]
+        if not isinstance(value, (list, tuple)) or not all(isinstance(v, str) for v in value):
+            raise BadRequest(f'Parameter {name} should be a list of index names')
+        parameters[name] = tuple(value)
+    for name in INT_PARAMETERS:
+        value = parameters[name]
+        if value is not None and (not isinstance(value, int) or isinstance(value, bool)):
+            raise BadRequest(f'Parameter {name} should be an integer')
+    for name, default in PACK_PARAMETERS.items():
+        if isinstance(default, bool):
+            parameters[name] = parameters[name] in (True, 'true')
+    return parameters
+
+
+def generate_pack(loaded, parameters, output, optimizer=None, exclude_indexes=tuple(), prefer_indexes=tuple()):
+    filters = (
+        parameters['filter']
+        + tuple(v for index in exclude_indexes for v in exclude_by_index(index))
+        + tuple(v for index in prefer_indexes for v in prefer_by_index(index))
+    )
+    try:
+        filter_f, is_preferred = loaded.get_filters(filters)
+        get_weight = loaded.get_weight(parameters['weight'])
+    except (KeyError, ValueError, re.error) as e:
+        raise BadRequest(f'Invalid filter or weight: {e}')
+    _, content_xml, files = make_package(
+        metadata=loaded.index.themes,
+        rounds_number=parameters['rounds'],
+        themes_per_round=parameters['themes_per_round'],
+        min_questions_per_theme=parameters['min_questions_per_theme'],
+        max_questions_per_theme=parameters['max_questions_per_theme'],
+        filter_f=filter_f,
+        is_preferred=is_preferred,
+        get_weight=get_weight,
+        package_name=parameters['package_name'],
+        use_unique_theme_names=parameters['unique_theme_names'],
+        use_unique_right_answers=parameters['unique_right_answers'],
+        use_obfuscation=parameters['obfuscate'],
+        use_unified_price=parameters['unify_price'],
+        shuffle=parameters['shuffle'],
+        check_right_answers_similarity=parameters['check_right_answers_similarity'],
+        final_themes=parameters['final_themes'],
+        max_pack_bytes=parameters['max_pack_bytes'],
+        read_theme=loaded.read_theme,
+        rng=random.Random(parameters['random_seed']),
+    )
+    write_package(content_xml=content_xml, files=files, output=output, optimizer=optimizer)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+import json
+import numpy
+import os
+import re
+
+from sigame_tools.common import (
+    THEME_METADATA_FIELDS,
+)
+
+from sigame_tools.filters import (
+    parse_bool,
+)
+
+from sigame_tools.instrumentation import (
+    span,
+)
+
+COLUMNS_VERSION = 2
+
+MISSING_INT = -1
+
+
+class IntColumn:
+    def __init__(self, values):
+        self.values = values
+        self.present = values != MISSING_INT
+
+    def match(self, pattern):
+        return (self.values == int(pattern)) & self.present
+
+    def arrays(self):
+        return dict(values=self.values)
+
+
+class BoolColumn(IntColumn):
+    def match(self, pattern):
+        return (self.values == int(parse_bool(pattern))) & self.present
+
+
+class StrColumn:
+    def __init__(self, categories, codes):
+        self.categories = categories
+        self.codes = codes
+
+    def match(self, pattern):
+        return match_categories(self.categories, pattern)[self.codes]
+
+    def counts(self):
+        return numpy.bincount(self.codes, minlength=len(self.categories))
+
+    def arrays(self):
+        return dict(categories=encode_categories(self.categories), codes=self.codes)
+
+
+class StrListColumn:
+    def __init__(self, categories, codes, lengths):
+        self.categories = categories
+        self.codes = codes
+        self.lengths = lengths
+        self.owners = numpy.repeat(numpy.arange(len(lengths)), lengths)
+
+    def match(self, pattern):
+        result = numpy.zeros(len(self.lengths), dtype=bool)
+        result[self.owners[match_categories(self.categories, pattern)[self.codes]]] = True
+        return result
+
+    def counts(self):
+        unique = numpy.unique(self.owners * len(self.categories) + self.codes)
+        return numpy.bincount(unique % max(1, len(self.categories)), minlength=len(self.categories))
+
+    def arrays(self):
+        return dict(categories=encode_categories(self.categories), codes=self.codes, lengths=self.lengths)
+
+
+class ThemeColumns:
+    def __init__(self, size, make_column):
+        self.size = size
+        self.__make_column = make_column
+        self.__columns = dict()
+
+    def __getitem__(self, field):
+        column = self.__columns.get(field)
+        if column is None:
+            with span('columns'):
+                column = self.__columns[field] = self.__make_column(field)
+        return column
+
+    def filter(self, args):
+        includes = None
+        excludes = numpy.zeros(self.size, dtype=bool)
+        present = set()
+        for filter_type, field, pattern in args:
+            assert filter_type in ('include', 'exclude', 'prefer')
+            if (filter_type, field, pattern) in present:
+                continue
+            present.add((filter_type, field, pattern))
+            mask = self[field].match(pattern)
+            if filter_type == 'exclude':
+                excludes |= mask
+            elif includes is None:
+                includes = mask
+            else:
+                includes = includes | mask
+        if includes is None:
+            return ~excludes
+        return includes & ~excludes
+
+    def preferred(self, args):
+        args = [v for v in args if v[0] == 'prefer']
+        if not args:
+            return numpy.zeros(self.size, dtype=bool)
+        return self.filter(args)
+
+
+def make_theme_columns(themes):
+    themes = tuple(themes)
+    fields = tuple(THEME_METADATA_FIELDS.keys())
+
+    def make_column(field):
+        position = fields.index(field)
+        return make_column_from_values(THEME_METADATA_FIELDS[field], [v[position] for v in themes])
+
+    return ThemeColumns(size=len(themes), make_column=make_column)
+
+
+def make_column_from_values(field_type, values):
+    if field_type == int:
+        return IntColumn(numpy.array([MISSING_INT if v is None else v for v in values], dtype=numpy.int64))
+    elif field_type == bool:
+        return BoolColumn(numpy.array([MISSING_INT if v is None else int(v) for v in values], dtype=numpy.int8))
+    elif field_type == str:
+        return StrColumn(*factorize(values))
+    elif isinstance(field_type, list):
+        lengths = numpy.fromiter((len(v) for v in values), dtype=numpy.int64, count=len(values))
+        return StrListColumn(*factorize([v for value in values for v in value]), lengths=lengths)
+    raise ValueError(f'Unsupported field type: {field_type}')
+
+
+def write_theme_columns(columns, output):
+    arrays = dict(version=numpy.array(COLUMNS_VERSION), size=numpy.array(columns.size))
+    for field in THEME_METADATA_FIELDS:
+        for name, value in columns[field].arrays().items():
+            arrays[f'{field}.{name}'] = value
+    tmp_output = output + '.tmp'
+    try:
+        with span('write_columns'), open(tmp_output, 'wb') as stream:
+            numpy.savez(stream, **arrays)
+        os.replace(tmp_output, output)
+    except:
+        if os.path.exists(tmp_output):
+            os.remove(tmp_output)
+        raise
+
+
+def read_theme_columns(path):
+    data = numpy.load(path)
+    version = int(data['version'])
+    if version != COLUMNS_VERSION:
+        raise RuntimeError(f'Unsupported columns version {version} in {path}, rebuild it')
+
+    def make_column(field):
+        field_type = THEME_METADATA_FIELDS[field]
+        if field_type == int:
+            return IntColumn(data[f'{field}.values'])
+        if field_type == bool:
+            return BoolColumn(data[f'{field}.values'])
+        categories = decode_categories(data[f'{field}.categories'])
+        if field_type == str:
+            return StrColumn(categories=categories, codes=data[f'{field}.codes'])
+        return StrListColumn(categories=categories, codes=data[f'{field}.codes'], lengths=data[f'{field}.lengths'])
+
+    return ThemeColumns(size=int(data['size']), make_column=make_column)
+
+
+def is_columns_outdated(columns_path, index_path):
+    if not os.path.exists(columns_path) or os.path.getmtime(columns_path) < os.path.getmtime(index_path):
+        return True
+    with numpy.load(columns_path) as data:
+        return int(data['version']) != COLUMNS_VERSION
+
+
+def factorize(values):
+    categories = dict()
+    codes = numpy.fromiter((categories.setdefault(v, len(categories)) for v in values), dtype=numpy.int64,
+                           count=len(values))
+    return list(categories), codes
+
+
+def encode_categories(categories):
+    return numpy.frombuffer(json.dumps(categories, ensure_ascii=False).encode('utf-8'), dtype=numpy.uint8)
+
+
+def decode_categories(value):
+    return json.loads(value.tobytes().decode('utf-8'))
+
+
+def match_categories(categories, pattern):
+    search = re.compile(pattern).search
+    if None in categories:
+        return numpy.array([v is not None and search(v) is not None for v in categories], dtype=bool)
+    return numpy.fromiter(map(bool, map(search, categories)), dtype=bool, count=len(categories))
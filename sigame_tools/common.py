@@ -1,14 +1,38 @@
 import base64
-import click
 import collections
+import concurrent.futures
+import contextlib
 import defusedxml.ElementTree
 import json
+import logging
 import math
+import os
 import os.path
+import urllib.parse
 import uuid
 import zipfile
 
-INDEX_VERSION=3
+from sigame_tools.instrumentation import (
+    STATS,
+    count,
+    span,
+)
+
+from sigame_tools.json_stream import (
+    JsonStreamReader,
+)
+
+from sigame_tools.manifest import (
+    Manifest,
+    has_manifest,
+    hash_file,
+)
+
+INDEX_VERSION=5
+
+PENDING_PACKAGES_PER_JOB = 4
+
+log = logging.getLogger(__name__)
 
 CONTENT_TYPES = (
     r'<?xml version="1.0" encoding="utf-8"?>'
@@ -54,17 +78,35 @@ THEME_METADATA_FIELDS = collections.OrderedDict(
     images_num=int,
     videos_num=int,
     voices_num=int,
+    media_bytes=int,
+    media_ok=bool,
 )
 
 ThemeMetadata = collections.namedtuple('ThemeMetadata', tuple(THEME_METADATA_FIELDS.keys()))
 
+Package = collections.namedtuple('Package', (
+    'content',
+    'media_sizes',
+))
+
+PackageFile = collections.namedtuple('PackageFile', (
+    'path',
+    'file_name',
+    'size',
+    'sha256',
+))
+
 
-def read_content(path):
-    print(f'Read .siq file {path}...')
-    with zipfile.ZipFile(path) as siq:
+def read_package(path):
+    log.info('Read .siq file %s...', path)
+    with span('zip_open'):
+        siq = zipfile.ZipFile(path)
+    with siq:
         if not 'content.xml' in siq.namelist():
             raise NoContentXml(f'No content.xml in {path}')
-        return get_content(siq)
+        with span('xml_parse'):
+            content = get_content(siq)
+        return Package(content=content, media_sizes=get_media_sizes(siq))
 
 
 class NoContentXml(RuntimeError):
@@ -83,21 +125,64 @@ def remove_namespace(tag):
     return tag.split('}', 1)[1]
 
 
+def get_media_sizes(siq):
+    return {urllib.parse.unquote(v.filename): v.file_size for v in siq.infolist()}
+
+
 def read_index(path):
-    index = read_json(path)
-    if index['version'] < INDEX_VERSION:
-        print(f'Index version {index["version"]} is outdated: this program is designed for index version {INDEX_VERSION}')
-    if index['version'] > INDEX_VERSION:
-        print(f'Index version {index["version"]} is too advanced: this program is designed for index version {INDEX_VERSION}')
-    if index['version'] < 2:
-        index['file_name'] = ''
-    if index['version'] < 3:
-        index['images_num'] = 0
-        index['video_num'] = 0
-        index['voice_num'] = 0
+    with span('read_index'):
+        index = read_json(path)
+    check_index_version(index['version'])
+    for theme in index['themes']:
+        upgrade_theme(theme=theme, version=index['version'])
     return make_index(**index)
 
 
+@contextlib.contextmanager
+def open_index(path):
+    with open(path) as stream:
+        reader = JsonStreamReader(stream)
+        version = None
+        for key in reader.iter_object_keys():
+            if key == 'themes':
+                break
+            value = reader.read_value()
+            if key == 'version':
+                version = value
+        else:
+            raise ValueError(f'Index {path} has no themes')
+        if version is None:
+            raise ValueError(f'Index {path} should have version before themes')
+        check_index_version(version)
+        yield Index(
+            version=version,
+            themes=(make_theme_metadata(**upgrade_theme(theme=v, version=version)) for v in reader.iter_array()),
+        )
+
+
+def check_index_version(version):
+    if version < INDEX_VERSION:
+        log.warning('Index version %s is outdated: this program is designed for index version %s',
+                    version, INDEX_VERSION)
+    if version > INDEX_VERSION:
+        log.warning('Index version %s is too advanced: this program is designed for index version %s',
+                    version, INDEX_VERSION)
+
+
+def upgrade_theme(theme, version):
+    if version < 2:
+        theme['file_name'] = ''
+    if version < 3:
+        theme['images_num'] = 0
+        theme['videos_num'] = 0
+        theme['voices_num'] = 0
+    if version < 4:
+        theme['media_bytes'] = None
+    if version < 5:
+        theme['media_ok'] = None
+    return theme
+
+
 def make_index(themes, **kwargs):
     return Index(
         themes=tuple(make_theme_metadata(**v) for v in themes),
@@ -118,57 +203,163 @@ def read_json(path):
         return json.load(stream)
 
 
-def build_themes_index(paths, ignore_paths=tuple()):
+def build_themes_index(paths, ignore_paths=tuple(), known_paths=tuple(), jobs=1):
+    packages = deduplicate_packages(packages=find_packages(paths=paths, ignore_paths=ignore_paths),
+                                    known_paths=known_paths)
+    for _, themes in read_packages_themes(packages=packages, jobs=jobs):
+        yield from themes
+
+
+def read_packages_themes(packages, jobs=1):
+    jobs = jobs or os.cpu_count()
+    if jobs == 1:
+        for package in packages:
+            yield package, read_package_themes(path=package.path, file_name=package.file_name)
+        return
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        pending = collections.deque()
+        for package in packages:
+            pending.append((package, executor.submit(read_package_themes_with_stats, path=package.path,
+                                                     file_name=package.file_name)))
+            while len(pending) > jobs * PENDING_PACKAGES_PER_JOB:
+                yield get_package_themes(*pending.popleft())
+        while pending:
+            yield get_package_themes(*pending.popleft())
+
+
+def read_package_themes_with_stats(path, file_name):
+    STATS.reset()
+    themes = read_package_themes(path=path, file_name=file_name)
+    return themes, STATS.report()
+
+
+def get_package_themes(package, future):
+    themes, stats = future.result()
+    STATS.merge(stats)
+    return package, themes
+
+
+def deduplicate_packages(packages, known_paths=tuple()):
+    packages = tuple(packages)
+    sizes = collections.Counter(v.size for v in packages)
+    paths = dict()
+    for path in known_paths:
+        if os.path.exists(path) and os.path.getsize(path) in sizes:
+            paths.setdefault(hash_file(path).hexdigest(), path)
+            sizes[os.path.getsize(path)] += 1
+    for package in packages:
+        if sizes[package.size] > 1:
+            sha256 = package.sha256 or hash_file(package.path).hexdigest()
+            path = paths.setdefault(sha256, package.path)
+            if path != package.path:
+                log.info('Ignore %s: duplicate of %s', package.path, path)
+                count('duplicate_packages')
+                continue
+        yield package
+
+
+def read_package_themes(path, file_name):
+    try:
+        package = read_package(path)
+    except (zipfile.BadZipFile, NoContentXml) as e:
+        log.warning('Ignore %s: %s', path, e)
+        count('broken_packages')
+        return tuple()
+    with span('metadata'):
+        themes = tuple(get_themes_metadata(path=path, package=package, file_name=file_name))
+    count('packages')
+    count('themes', len(themes))
+    return themes
+
+
+def find_packages(paths, ignore_paths=tuple()):
     for path in paths:
         if path in ignore_paths:
-            print(f'Ignore {path}: path is in ignore list')
+            log.info('Ignore %s: path is in ignore list', path)
             continue
         if not os.path.exists(path):
-            print(f'Ignore {path}: path does not exist')
+            log.warning('Ignore %s: path does not exist', path)
+            continue
+        if os.path.isdir(path) and has_manifest(path):
+            log.info('Process cache manifest in %s...', path)
+            yield from find_cached_packages(cache_dir=path, ignore_paths=ignore_paths)
             continue
         if os.path.isdir(path):
-            print(f'Process directory {path}...')
-            yield from build_themes_index(
-                paths=(os.path.join(path, v) for v in os.listdir(path)),
+            log.info('Process directory %s...', path)
+            yield from find_packages(
+                paths=(os.path.join(path, v) for v in sorted(os.listdir(path))),
                 ignore_paths=ignore_paths,
             )
             continue
         if not path.endswith('.siq'):
-            print(f'Ignore {path}: not .siq file')
+            log.debug('Ignore %s: not .siq file', path)
+            continue
+        yield PackageFile(
+            path=path,
+            file_name=get_file_name(path),
+            size=os.path.getsize(path),
+            sha256=None,
+        )
+
+
+def find_cached_packages(cache_dir, ignore_paths):
+    with Manifest(cache_dir, read_only=True) as manifest:
+        entries = manifest.entries(extension='siq')
+    listed_paths = set()
+    for entry in entries:
+        listed_paths.add(entry.path)
+        if entry.path in ignore_paths:
+            log.info('Ignore %s: path is in ignore list', entry.path)
             continue
-        file_name = get_file_name(path)
-        try:
-            content = read_content(path)
-        except (zipfile.BadZipFile, NoContentXml) as e:
-            print(f'Ignore {path}: {str(e)}')
+        if not os.path.exists(entry.path):
+            log.warning('Ignore %s: file from cache manifest does not exist', entry.path)
+            count('missing_packages')
             continue
-        yield from get_themes_metadata(path=path, content=content, file_name=file_name)
+        yield PackageFile(
+            path=entry.path,
+            file_name=entry.name or os.path.basename(entry.path),
+            size=entry.size,
+            sha256=entry.sha256,
+        )
+    unlisted_paths = sorted(
+        os.path.join(cache_dir, v.name)
+        for v in os.scandir(cache_dir)
+        if v.name.endswith('.siq') and v.is_file() and os.path.join(cache_dir, v.name) not in listed_paths
+    )
+    if unlisted_paths:
+        log.info('Process %s files missing in cache manifest in %s...', len(unlisted_paths), cache_dir)
+    yield from find_packages(paths=unlisted_paths, ignore_paths=ignore_paths)
 
 
 def get_file_name(path):
     meta_path = path + '.meta.json'
     if os.path.exists(meta_path):
-        print(f'Read .meta.json file {meta_path}...')
+        log.debug('Read .meta.json file %s...', meta_path)
         return read_json(meta_path).get('name')
     else:
         return os.path.basename(path)
 
 
-def get_themes_metadata(path, content, file_name):
-    package = content.getroot()
-    authors = tuple(sorted({v.text for v in package.iter('author') if v.text}))
+def get_themes_metadata(path, package, file_name):
+    root = package.content.getroot()
+    authors = tuple(sorted({v.text for v in root.iter('author') if v.text}))
     round_number = 0
-    for round_ in package.iter('round'):
+    for round_ in root.iter('round'):
         round_number += 1
         theme_number = 0
         for theme in round_.iter('theme'):
             theme_number += 1
+            missing_media = get_missing_media(theme=theme, media_sizes=package.media_sizes)
+            if missing_media:
+                log.warning('Theme "%s" of %s references missing files: %s', theme.attrib['name'], path,
+                            ', '.join(missing_media))
+                count('broken_themes')
             yield ThemeMetadata(
                 id=str(uuid.uuid1()),
                 round_number=round_number,
                 theme_number=theme_number,
                 path=path,
-                package_name=package.attrib['name'],
+                package_name=root.attrib['name'],
                 round_name=round_.attrib['name'],
                 theme_name=theme.attrib['name'],
                 questions_num=get_number_of_questions(theme),
@@ -179,6 +370,8 @@ def get_themes_metadata(path, content, file_name):
                 images_num=get_atom_num(theme=theme, atom_type='image'),
                 videos_num=get_atom_num(theme=theme, atom_type='video'),
                 voices_num=get_atom_num(theme=theme, atom_type='voice'),
+                media_bytes=get_media_bytes(theme=theme, media_sizes=package.media_sizes),
+                media_ok=not missing_media,
             )
 
 
@@ -205,13 +398,61 @@ def get_atom_num(theme, atom_type):
     return sum(1 for v in theme.iter('atom') if v.attrib.get('type') == atom_type)
 
 
+def get_media_bytes(theme, media_sizes):
+    return sum(media_sizes.get(v, 0) for v in get_media_paths(theme))
+
+
+def get_missing_media(theme, media_sizes):
+    return [v for v in get_media_paths(theme) if v not in media_sizes]
+
+
+def get_media_paths(theme):
+    for atom in theme.iter('atom'):
+        file_dir = SIQ_FILE_TYPE_DIRS.get(atom.attrib.get('type'))
+        if file_dir and atom.text and atom.text.startswith('@'):
+            yield os.path.join(file_dir, atom.text[1:])
+
+
 def write_index(themes, output):
-    index = dict(
-        version=INDEX_VERSION,
-        themes=[v._asdict() for v in themes],
-    )
-    with open(output, 'w') as stream:
-        json.dump(index, stream, ensure_ascii=False)
+    with span('write_index'), IndexWriter(output) as writer:
+        for theme in themes:
+            writer.write(theme)
+
+
+class IndexWriter:
+    def __init__(self, output):
+        self.__output = output
+        self.__tmp_output = output + '.tmp'
+        self.__stream = None
+        self.themes = 0
+
+    def __enter__(self):
+        self.__stream = open(self.__tmp_output, 'w')
+        self.__stream.write(f'{{"version": {INDEX_VERSION}, "themes": [')
+        return self
+
+    def __exit__(self, exc_type, *_):
+        if exc_type is None:
+            self.__stream.write(']}')
+        self.__stream.close()
+        if exc_type is None:
+            os.replace(self.__tmp_output, self.__output)
+        elif os.path.exists(self.__tmp_output):
+            os.remove(self.__tmp_output)
+
+    def write(self, theme):
+        if self.themes:
+            self.__stream.write(', ')
+        self.__stream.write(json.dumps(theme._asdict(), ensure_ascii=False))
+        self.themes += 1
+
+
+def get_theme_position(theme):
+    return get_path_position(theme.path), theme.round_number, theme.theme_number
+
+
+def get_path_position(path):
+    return tuple(os.path.normpath(path).split(os.sep))
 
 
 def get_prices(num, max_price=1000):
@@ -246,6 +487,5 @@ def write_content_xml(siq, content_xml):
         content_xml.write(stream, xml_declaration=True, encoding='utf-8')
 
 
-def read_binary_file(path):
-    with open(path, 'rb') as stream:
-        return stream.read()
+def copy_file_to_siq(siq, path, src_path):
+    siq.write(src_path, arcname=path)
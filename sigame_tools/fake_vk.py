@@ -0,0 +1,148 @@
+import contextlib
+import functools
+import hashlib
+import http.server
+import io
+import random
+import re
+import threading
+import time
+import urllib.parse
+import zipfile
+
+POSTS_PER_PAGE = 20
+
+SEND_CHUNK_SIZE = 16 * 1024
+
+CONTENT_XML = (
+    '<?xml version="1.0" encoding="utf-8"?>'
+    + '<package name="Package {number}" version="4" xmlns="http://vladimirkhil.com/ygpackage3.0.xsd">'
+    + '<info><authors><author>Author {number}</author></authors></info>'
+    + '<rounds><round name="Round"><themes><theme name="Theme {number}"><questions>'
+    + '<question price="100"><scenario><atom type="image">@image.bin</atom></scenario>'
+    + '<right><answer>Answer {number}</answer></right></question>'
+    + '</questions></theme></themes></round></rounds>'
+    + '</package>'
+)
+
+
+class FakeVkServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, packages, package_size, latency=0, bandwidth=None, error_rate=0, random_seed=None):
+        super().__init__(('127.0.0.1', 0), FakeVkHandler)
+        self.packages = packages
+        self.package_size = package_size
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.random = random.Random(random_seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.sent_bytes = 0
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_port}'
+
+    @property
+    def topic_url(self):
+        return f'{self.url}/topic-1_1'
+
+    def should_fail(self):
+        with self.lock:
+            self.requests += 1
+            if self.random.random() < self.error_rate:
+                self.errors += 1
+                return True
+            return False
+
+    def add_sent_bytes(self, value):
+        with self.lock:
+            self.sent_bytes += value
+
+    @functools.lru_cache(maxsize=None)
+    def get_package(self, number):
+        media = random.Random(number).getrandbits(8 * self.package_size).to_bytes(self.package_size, 'little')
+        stream = io.BytesIO()
+        with zipfile.ZipFile(stream, 'w') as siq:
+            siq.writestr('content.xml', CONTENT_XML.format(number=number))
+            siq.writestr('Images/image.bin', media)
+        return stream.getvalue()
+
+    def get_page(self, offset):
+        links = ''.join(
+            f'<div class="post"><a class="mr_label medias_link" href="/doc{number}">pack{number}.siq</a></div>'
+            for number in range(offset, min(offset + POSTS_PER_PAGE, self.packages))
+        )
+        return f'<html><head><meta charset="utf-8"></head><body>{links}</body></html>'.encode('utf-8')
+
+
+class FakeVkHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        if self.server.should_fail():
+            return self.send_body(status=503, body=b'')
+        url = urllib.parse.urlparse(self.path)
+        if url.path.startswith('/topic'):
+            offset = int(urllib.parse.parse_qs(url.query).get('offset', ['0'])[0])
+            return self.send_page(offset)
+        match = re.fullmatch(r'/doc(\d+)', url.path)
+        if match and int(match.group(1)) < self.server.packages:
+            self.send_response(302)
+            self.send_header('Location', f'/files/pack{match.group(1)}.siq')
+            self.send_header('Content-Length', '0')
+            return self.end_headers()
+        match = re.fullmatch(r'/files/pack(\d+)\.siq', url.path)
+        if match and int(match.group(1)) < self.server.packages:
+            return self.send_package(int(match.group(1)))
+        self.send_body(status=404, body=b'')
+
+    def send_page(self, offset):
+        body = self.server.get_page(offset)
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        if self.headers.get('If-None-Match') == etag:
+            return self.send_body(status=304, body=b'', headers=dict(ETag=etag))
+        self.send_body(status=200, body=body, headers={'ETag': etag, 'Content-Type': 'text/html; charset=utf-8'})
+
+    def send_package(self, number):
+        body = self.server.get_package(number)
+        match = re.fullmatch(r'bytes=(\d+)-', self.headers.get('Range', ''))
+        if match is None:
+            return self.send_body(status=200, body=body)
+        start = int(match.group(1))
+        if start >= len(body):
+            return self.send_body(status=416, body=b'', headers={'Content-Range': f'bytes */{len(body)}'})
+        self.send_body(status=206, body=body[start:],
+                       headers={'Content-Range': f'bytes {start}-{len(body) - 1}/{len(body)}'})
+
+    def send_body(self, status, body, headers=None):
+        self.send_response(status)
+        for name, value in (headers or dict()).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        for offset in range(0, len(body), SEND_CHUNK_SIZE):
+            chunk = body[offset:offset + SEND_CHUNK_SIZE]
+            self.wfile.write(chunk)
+            self.server.add_sent_bytes(len(chunk))
+            if self.server.bandwidth:
+                time.sleep(len(chunk) / self.server.bandwidth)
+
+    def log_message(self, *args):
+        pass
+
+
+@contextlib.contextmanager
+def run_fake_vk_server(**kwargs):
+    server = FakeVkServer(**kwargs)
+    thread = threading.Thread(target=server.serve_forever, kwargs=dict(poll_interval=0.01), daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
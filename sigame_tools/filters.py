@@ -42,6 +42,9 @@ def make_typed_field_filter(field_type, pattern):
     if field_type == int:
         pattern = int(pattern)
         return lambda value: value == pattern
+    elif field_type == bool:
+        pattern = parse_bool(pattern)
+        return lambda value: value is pattern
     elif field_type == str:
         regex = re.compile(pattern)
         return lambda value: re.search(regex, value)
@@ -49,3 +52,9 @@ def make_typed_field_filter(field_type, pattern):
         f = make_typed_field_filter(field_type[0], pattern)
         return lambda value: any(v for v in value if f(v))
     return None
+
+
+def parse_bool(value):
+    if value not in ('true', 'false'):
+        raise ValueError(f'Invalid bool value: {value}')
+    return value == 'true'
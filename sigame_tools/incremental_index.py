@@ -0,0 +1,108 @@
+import collections
+import logging
+import os.path
+import queue
+import threading
+import time
+
+from sigame_tools.common import (
+    get_path_position,
+    read_index,
+    read_package_themes,
+    write_index,
+)
+
+from sigame_tools.instrumentation import (
+    count,
+)
+
+log = logging.getLogger(__name__)
+
+
+class IncrementalIndex:
+    def __init__(self, path):
+        self.__path = path
+        self.__themes = collections.OrderedDict()
+        if os.path.exists(path):
+            for theme in read_index(path).themes:
+                self.__themes.setdefault(theme.path, list()).append(theme)
+
+    def __contains__(self, path):
+        return path in self.__themes
+
+    def get(self, path):
+        return tuple(self.__themes.get(path, tuple()))
+
+    def put(self, path, themes):
+        self.__themes[path] = list(themes)
+
+    def remove(self, path):
+        self.__themes.pop(path, None)
+
+    def themes(self):
+        for path in sorted(self.__themes, key=get_path_position):
+            yield from self.__themes[path]
+
+    def flush(self):
+        log.info('Write index %s with %s themes...', self.__path, sum(len(v) for v in self.__themes.values()))
+        write_index(themes=self.themes(), output=self.__path)
+
+
+class IndexingWorker:
+    def __init__(self, index, flush_interval):
+        self.__index = index
+        self.__flush_interval = flush_interval
+        self.__queue = queue.Queue()
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__error = None
+
+    def __enter__(self):
+        self.__thread.start()
+        return self
+
+    def __exit__(self, exc_type, *_):
+        self.__queue.put(None)
+        self.__thread.join()
+        if self.__error is not None and exc_type is None:
+            raise self.__error
+
+    def submit(self, path, file_name):
+        if self.__error is not None:
+            raise self.__error
+        self.__queue.put((path, file_name))
+
+    def __run(self):
+        try:
+            self.__process()
+        except Exception as e:
+            log.exception('Indexing worker failed: %s', e)
+            self.__error = e
+
+    def __process(self):
+        last_flush = time.monotonic()
+        changed = False
+        while True:
+            try:
+                item = self.__queue.get(timeout=self.__flush_interval if changed else None)
+            except queue.Empty:
+                item = tuple()
+            if item is None:
+                break
+            if item and item[0] not in self.__index:
+                changed |= self.__add(*item)
+            if changed and (not item or time.monotonic() - last_flush >= self.__flush_interval):
+                self.__index.flush()
+                last_flush = time.monotonic()
+                changed = False
+        if changed:
+            self.__index.flush()
+
+    def __add(self, path, file_name):
+        try:
+            themes = read_package_themes(path=path, file_name=file_name)
+        except Exception as e:
+            log.error('Skip indexing %s: %s', path, e)
+            count('failed_packages')
+            return False
+        self.__index.put(path=path, themes=themes)
+        return True
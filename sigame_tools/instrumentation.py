@@ -0,0 +1,181 @@
+import click
+import collections
+import contextlib
+import functools
+import json
+import logging
+import os
+import threading
+import time
+
+from sigame_tools.rate_limit import (
+    TokenBucket,
+)
+
+LOG_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+LOG_LEVELS = ('debug', 'info', 'warning', 'error')
+
+LOG_RATE = 10
+
+LOG_BURST = 100
+
+PROFILE_FUNCTIONS = 50
+
+log = logging.getLogger(__name__)
+
+
+class Stats:
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__spans = collections.defaultdict(lambda: dict(count=0, total=0, max=0))
+        self.__counters = collections.Counter()
+
+    def add_span(self, name, duration):
+        with self.__lock:
+            span = self.__spans[name]
+            span['count'] += 1
+            span['total'] += duration
+            span['max'] = max(span['max'], duration)
+
+    def add(self, name, value=1):
+        with self.__lock:
+            self.__counters[name] += value
+
+    def merge(self, report):
+        with self.__lock:
+            for name, value in report['spans'].items():
+                span = self.__spans[name]
+                span['count'] += value['count']
+                span['total'] += value['total']
+                span['max'] = max(span['max'], value['max'])
+            self.__counters.update(report['counters'])
+
+    def reset(self):
+        with self.__lock:
+            self.__spans.clear()
+            self.__counters.clear()
+
+    def report(self):
+        with self.__lock:
+            return dict(
+                spans={k: dict(v) for k, v in sorted(self.__spans.items())},
+                counters=dict(sorted(self.__counters.items())),
+            )
+
+
+STATS = Stats()
+
+
+@contextlib.contextmanager
+def span(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STATS.add_span(name, time.perf_counter() - start)
+
+
+def count(name, value=1):
+    STATS.add(name, value)
+
+
+class RateLimitFilter(logging.Filter):
+    def __init__(self, rate, burst, max_level=logging.INFO, clock=time.monotonic):
+        super().__init__()
+        self.__rate = rate
+        self.__burst = burst
+        self.__max_level = max_level
+        self.__clock = clock
+        self.__lock = threading.Lock()
+        self.__buckets = dict()
+        self.__suppressed = collections.Counter()
+
+    def filter(self, record):
+        if record.levelno > self.__max_level:
+            return True
+        key = (record.name, record.msg)
+        with self.__lock:
+            bucket = self.__buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(rate=self.__rate, capacity=self.__burst, clock=self.__clock)
+                self.__buckets[key] = bucket
+            if not bucket.try_acquire(1):
+                self.__suppressed[key] += 1
+                count('suppressed_log_records')
+                return False
+            suppressed = self.__suppressed.pop(key, 0)
+        if suppressed:
+            record.msg = f'{record.msg} ({suppressed} similar messages suppressed)'
+        return True
+
+
+def setup_logging(level, rate=LOG_RATE, burst=LOG_BURST):
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    handler.addFilter(RateLimitFilter(rate=rate, burst=burst))
+    root = logging.getLogger()
+    for value in tuple(root.handlers):
+        root.removeHandler(value)
+    root.addHandler(handler)
+    root.setLevel(level.upper())
+
+
+@contextlib.contextmanager
+def profiling(path):
+    if path is None:
+        yield
+        return
+    import cProfile
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        duration = time.perf_counter() - start
+        log.info('Write profile to %s...', path)
+        write_profile(path=path, duration=duration, profiler=profiler)
+
+
+def write_profile(path, duration, profiler):
+    report = dict(
+        duration=duration,
+        **STATS.report(),
+        functions=get_profile_functions(profiler),
+    )
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as stream:
+        json.dump(report, stream, indent=4)
+    os.replace(tmp_path, path)
+
+
+def get_profile_functions(profiler, limit=PROFILE_FUNCTIONS):
+    import pstats
+    stats = pstats.Stats(profiler).stats
+    functions = sorted(stats.items(), key=lambda v: v[1][3], reverse=True)[:limit]
+    return [
+        dict(
+            function=function,
+            file=file_name,
+            line=line,
+            primitive_calls=primitive_calls,
+            calls=calls,
+            total_time=total_time,
+            cumulative_time=cumulative_time,
+        )
+        for (file_name, line, function), (primitive_calls, calls, total_time, cumulative_time, _) in functions
+    ]
+
+
+def instrumented(f):
+    @click.option('--log_level', type=click.Choice(LOG_LEVELS), default='info', show_default=True)
+    @click.option('--profile', type=click.Path(dir_okay=False), default=None,
+                  help='Write JSON report with stage timings, counters and cProfile statistics to a given path.')
+    @functools.wraps(f)
+    def impl(log_level, profile, **kwargs):
+        setup_logging(log_level)
+        with profiling(profile):
+            return f(**kwargs)
+    return impl
@@ -0,0 +1,85 @@
+import json
+
+READ_CHUNK_SIZE = 1024 * 1024
+
+WHITESPACE = ' \t\n\r'
+
+
+class JsonStreamReader:
+    def __init__(self, stream, chunk_size=READ_CHUNK_SIZE):
+        self.__stream = stream
+        self.__chunk_size = chunk_size
+        self.__decoder = json.JSONDecoder()
+        self.__buffer = ''
+        self.__position = 0
+        self.__eof = False
+
+    def peek(self):
+        while True:
+            while self.__position < len(self.__buffer) and self.__buffer[self.__position] in WHITESPACE:
+                self.__position += 1
+            if self.__position < len(self.__buffer):
+                return self.__buffer[self.__position]
+            if not self.__fill():
+                return ''
+
+    def expect(self, symbol):
+        value = self.peek()
+        if value != symbol:
+            raise ValueError(f'Expected {symbol!r} but got {value or "end of stream"!r}')
+        self.__position += 1
+
+    def read_value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.__decoder.raw_decode(self.__buffer, self.__position)
+            except json.JSONDecodeError:
+                if self.__fill():
+                    continue
+                raise
+            if end == len(self.__buffer) and self.__fill():
+                continue
+            self.__position = end
+            return value
+
+    def iter_object_keys(self):
+        self.expect('{')
+        if self.peek() == '}':
+            self.__position += 1
+            return
+        while True:
+            key = self.read_value()
+            if not isinstance(key, str):
+                raise ValueError(f'Expected object key but got {key!r}')
+            self.expect(':')
+            yield key
+            if self.peek() == ',':
+                self.__position += 1
+                continue
+            self.expect('}')
+            return
+
+    def iter_array(self):
+        self.expect('[')
+        if self.peek() == ']':
+            self.__position += 1
+            return
+        while True:
+            yield self.read_value()
+            if self.peek() == ',':
+                self.__position += 1
+                continue
+            self.expect(']')
+            return
+
+    def __fill(self):
+        if self.__eof:
+            return False
+        chunk = self.__stream.read(self.__chunk_size)
+        if not chunk:
+            self.__eof = True
+            return False
+        self.__buffer = self.__buffer[self.__position:] + chunk
+        self.__position = 0
+        return True
@@ -0,0 +1,274 @@
+import base64
+import binascii
+import collections
+import hashlib
+import json
+import os.path
+import sqlite3
+import threading
+import time
+import urllib.parse
+
+MANIFEST_FILE_NAME = 'manifest.sqlite'
+
+MIGRATIONS = (
+    (
+        'CREATE TABLE entries ('
+        + ' url TEXT PRIMARY KEY,'
+        + ' path TEXT NOT NULL,'
+        + ' extension TEXT NOT NULL,'
+        + ' size INTEGER NOT NULL,'
+        + ' name TEXT,'
+        + ' fetched_at REAL NOT NULL'
+        + ')',
+        'CREATE INDEX entries_extension_path ON entries (extension, path)',
+    ),
+    (
+        'ALTER TABLE entries ADD COLUMN etag TEXT',
+        'ALTER TABLE entries ADD COLUMN last_modified TEXT',
+    ),
+    (
+        'ALTER TABLE entries ADD COLUMN sha256 TEXT',
+        'ALTER TABLE entries ADD COLUMN alias_of TEXT',
+        'CREATE INDEX entries_sha256 ON entries (sha256)',
+    ),
+    (
+        lambda connection, cache_dir: deduplicate_entries(connection=connection, cache_dir=cache_dir),
+        'CREATE UNIQUE INDEX entries_extension_sha256 ON entries (extension, sha256) WHERE alias_of IS NULL',
+    ),
+)
+
+DEDUPLICATED_EXTENSIONS = ('siq',)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+Entry = collections.namedtuple('Entry', (
+    'url',
+    'path',
+    'extension',
+    'size',
+    'name',
+    'fetched_at',
+    'etag',
+    'last_modified',
+    'sha256',
+    'alias_of',
+))
+
+
+class Manifest:
+    def __init__(self, cache_dir, read_only=False):
+        self.__cache_dir = cache_dir
+        self.__lock = threading.Lock()
+        self.__table = 'entries'
+        path = os.path.join(cache_dir, MANIFEST_FILE_NAME)
+        if read_only:
+            self.__connection = sqlite3.connect(f'file:{urllib.parse.quote(path)}?mode=ro', uri=True,
+                                                check_same_thread=False)
+            self.__table = f'(SELECT {get_entry_columns(self.__connection)} FROM entries)'
+            return
+        os.makedirs(cache_dir, exist_ok=True)
+        self.__connection = sqlite3.connect(path, check_same_thread=False)
+        self.__connection.execute('PRAGMA journal_mode=WAL')
+        with self.__connection:
+            version = self.__connection.execute('PRAGMA user_version').fetchone()[0]
+            for statements in MIGRATIONS[version:]:
+                for statement in statements:
+                    if callable(statement):
+                        statement(self.__connection, cache_dir)
+                    else:
+                        self.__connection.execute(statement)
+            self.__connection.execute(f'PRAGMA user_version = {len(MIGRATIONS)}')
+            if version == 0:
+                for entry in find_flat_cache_entries(cache_dir):
+                    if self.__add(entry).path != entry.path:
+                        remove_cached_file(os.path.join(cache_dir, entry.path))
+
+    @property
+    def cache_dir(self):
+        return self.__cache_dir
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self):
+        with self.__lock:
+            self.__connection.close()
+
+    def get(self, url):
+        with self.__lock:
+            row = self.__connection.execute(f'SELECT {", ".join(Entry._fields)} FROM {self.__table} WHERE url = ?',
+                                            (url,)).fetchone()
+        return None if row is None else self.__make_entry(row)
+
+    def put(self, url, path, extension, name=None, etag=None, last_modified=None, sha256=None, alias_of=None):
+        entry = Entry(
+            url=url,
+            path=os.path.relpath(path, self.__cache_dir),
+            extension=extension,
+            size=os.path.getsize(path),
+            name=name,
+            fetched_at=time.time(),
+            etag=etag,
+            last_modified=last_modified,
+            sha256=sha256,
+            alias_of=alias_of,
+        )
+        with self.__lock, self.__connection:
+            self.__insert(entry)
+        return self.__make_entry(entry)
+
+    def add(self, url, path, extension, sha256, name=None):
+        entry = Entry(
+            url=url,
+            path=os.path.relpath(path, self.__cache_dir),
+            extension=extension,
+            size=os.path.getsize(path),
+            name=name,
+            fetched_at=time.time(),
+            etag=None,
+            last_modified=None,
+            sha256=sha256,
+            alias_of=None,
+        )
+        with self.__lock, self.__connection:
+            self.__connection.execute('BEGIN IMMEDIATE')
+            entry = self.__add(entry)
+        return self.__make_entry(entry)
+
+    def remove(self, url):
+        with self.__lock, self.__connection:
+            self.__connection.execute('DELETE FROM entries WHERE url = ?', (url,))
+
+    def find(self, sha256, extension):
+        with self.__lock:
+            row = self.__connection.execute(
+                f'SELECT {", ".join(Entry._fields)} FROM {self.__table}'
+                + ' WHERE sha256 = ? AND extension = ? AND alias_of IS NULL LIMIT 1',
+                (sha256, extension),
+            ).fetchone()
+        return None if row is None else self.__make_entry(row)
+
+    def entries(self, extension):
+        with self.__lock:
+            rows = self.__connection.execute(
+                f'SELECT {", ".join(Entry._fields)} FROM {self.__table}'
+                + ' WHERE extension = ? AND alias_of IS NULL ORDER BY path',
+                (extension,),
+            ).fetchall()
+        return tuple(self.__make_entry(v) for v in rows)
+
+    def make_path(self, url, extension):
+        digest = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        shard_dir = os.path.join(self.__cache_dir, digest[:2], digest[2:4])
+        os.makedirs(shard_dir, exist_ok=True)
+        return os.path.join(shard_dir, '.'.join((digest, extension)))
+
+    def __add(self, entry):
+        original = self.__connection.execute(
+            'SELECT url, path FROM entries WHERE sha256 = ? AND extension = ? AND alias_of IS NULL AND url != ?',
+            (entry.sha256, entry.extension, entry.url),
+        ).fetchone()
+        if original is not None:
+            if not os.path.exists(os.path.join(self.__cache_dir, original[1])):
+                self.__connection.execute(
+                    'UPDATE entries SET path = ?, size = ? WHERE url = ? OR alias_of = ?',
+                    (entry.path, entry.size, original[0], original[0]),
+                )
+            else:
+                entry = entry._replace(path=original[1])
+            entry = entry._replace(alias_of=original[0])
+        self.__insert(entry)
+        return entry
+
+    def __insert(self, entry):
+        self.__connection.execute(
+            f'INSERT OR REPLACE INTO entries ({", ".join(Entry._fields)})'
+            + f' VALUES ({", ".join("?" for _ in Entry._fields)})',
+            entry,
+        )
+
+    def __make_entry(self, row):
+        entry = Entry(*row)
+        return entry._replace(path=os.path.join(self.__cache_dir, entry.path))
+
+
+def get_entry_columns(connection):
+    columns = {v[1] for v in connection.execute('PRAGMA table_info(entries)')}
+    return ', '.join(v if v in columns else f'NULL AS {v}' for v in Entry._fields)
+
+
+def has_manifest(cache_dir):
+    return os.path.exists(os.path.join(cache_dir, MANIFEST_FILE_NAME))
+
+
+def deduplicate_entries(connection, cache_dir):
+    rows = connection.execute(
+        'SELECT url, path, extension, sha256 FROM entries'
+        + f' WHERE alias_of IS NULL AND extension IN ({", ".join("?" for _ in DEDUPLICATED_EXTENSIONS)})'
+        + ' ORDER BY fetched_at, url',
+        DEDUPLICATED_EXTENSIONS,
+    ).fetchall()
+    originals = dict()
+    for url, path, extension, sha256 in rows:
+        if sha256 is None:
+            if not os.path.exists(os.path.join(cache_dir, path)):
+                continue
+            sha256 = hash_file(os.path.join(cache_dir, path)).hexdigest()
+        original_url, original_path = originals.setdefault((extension, sha256), (url, path))
+        if original_url == url:
+            connection.execute('UPDATE entries SET sha256 = ? WHERE url = ?', (sha256, url))
+            continue
+        connection.execute(
+            'UPDATE entries SET sha256 = ?, path = ?, alias_of = ? WHERE url = ?',
+            (sha256, original_path, original_url, url),
+        )
+        if path != original_path:
+            remove_cached_file(os.path.join(cache_dir, path))
+
+
+def hash_file(path):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as stream:
+        for chunk in iter(lambda: stream.read(HASH_CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    return hasher
+
+
+def remove_cached_file(path):
+    for v in (path, path + '.meta.json'):
+        if os.path.exists(v):
+            os.remove(v)
+
+
+def find_flat_cache_entries(cache_dir):
+    meta_suffix = '.meta.json'
+    for file_name in sorted(os.listdir(cache_dir)):
+        if not file_name.endswith(meta_suffix):
+            continue
+        data_file_name = file_name[:-len(meta_suffix)]
+        if not os.path.exists(os.path.join(cache_dir, data_file_name)):
+            continue
+        name, extension = data_file_name.rsplit('.', 1)
+        try:
+            url = base64.b32decode(name.encode('utf-8')).decode('utf-8')
+        except (binascii.Error, UnicodeDecodeError):
+            continue
+        with open(os.path.join(cache_dir, file_name)) as stream:
+            meta = json.load(stream)
+        data_path = os.path.join(cache_dir, data_file_name)
+        yield Entry(
+            url=url,
+            path=data_file_name,
+            extension=extension,
+            size=os.path.getsize(data_path),
+            name=meta.get('name'),
+            fetched_at=os.path.getmtime(data_path),
+            etag=None,
+            last_modified=None,
+            sha256=hash_file(data_path).hexdigest() if extension in DEDUPLICATED_EXTENSIONS else None,
+            alias_of=None,
+        )
@@ -0,0 +1,131 @@
+import concurrent.futures
+import contextlib
+import hashlib
+import io
+import logging
+import os
+import os.path
+import tempfile
+import threading
+
+OPTIMIZED_IMAGE_FORMATS = ('JPEG', 'PNG', 'WEBP')
+
+log = logging.getLogger(__name__)
+
+
+class MediaOptimizer:
+    def __init__(self, cache_dir, max_size, quality, jobs=None):
+        assert max_size > 0
+        assert 0 < quality <= 100
+        self.__cache_dir = cache_dir
+        self.__max_size = max_size
+        self.__quality = quality
+        self.__executor = concurrent.futures.ProcessPoolExecutor(max_workers=jobs)
+        self.__lock = threading.Lock()
+        self.__pending = dict()
+        self.original_bytes = 0
+        self.optimized_bytes = 0
+        self.cache_hits = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self):
+        self.__executor.shutdown()
+
+    def submit(self, data):
+        cache_path = self.__get_cache_path(data)
+        submitted = False
+        with self.__lock:
+            optimized = self.__pending.get(cache_path)
+            if optimized is None and os.path.exists(cache_path):
+                self.cache_hits += 1
+                optimized = concurrent.futures.Future()
+                with open(cache_path, 'rb') as stream:
+                    optimized.set_result(stream.read())
+            elif optimized is None:
+                optimized = self.__executor.submit(
+                    optimize_image,
+                    data=data,
+                    max_size=self.__max_size,
+                    quality=self.__quality,
+                )
+                self.__pending[cache_path] = optimized
+                submitted = True
+        if submitted:
+            # Callback of a done future runs immediately in this thread and takes the lock.
+            optimized.add_done_callback(lambda future: self.__write_cache(cache_path, future))
+        result = concurrent.futures.Future()
+
+        def on_done(future):
+            if future.exception() is not None:
+                return result.set_exception(future.exception())
+            result.set_result(self.__choose(data, future.result()))
+
+        optimized.add_done_callback(on_done)
+        return result
+
+    def __write_cache(self, cache_path, future):
+        if future.exception() is None:
+            write_cache_file(cache_path, future.result() or b'')
+        with self.__lock:
+            del self.__pending[cache_path]
+
+    def __choose(self, data, optimized):
+        if not optimized:
+            optimized = data
+        with self.__lock:
+            self.original_bytes += len(data)
+            self.optimized_bytes += len(optimized)
+        return optimized
+
+    def __get_cache_path(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        return os.path.join(self.__cache_dir, digest[:2], f'{digest}.{self.__max_size}.{self.__quality}')
+
+
+@contextlib.contextmanager
+def make_media_optimizer(cache_dir, max_size, quality, jobs=None):
+    with contextlib.ExitStack() as stack:
+        if cache_dir is None:
+            cache_dir = stack.enter_context(tempfile.TemporaryDirectory(prefix='sigame_media_'))
+        yield stack.enter_context(MediaOptimizer(cache_dir=cache_dir, max_size=max_size, quality=quality, jobs=jobs))
+
+
+def log_optimization_stats(optimizer):
+    saved = optimizer.original_bytes - optimizer.optimized_bytes
+    ratio = saved / optimizer.original_bytes if optimizer.original_bytes else 0
+    log.info('Optimized images: %s -> %s bytes (%.1f%% saved, %s cache hits)',
+             optimizer.original_bytes, optimizer.optimized_bytes, ratio * 100, optimizer.cache_hits)
+
+
+def optimize_image(data, max_size, quality):
+    import PIL.Image
+    import PIL.ImageOps
+    try:
+        with PIL.Image.open(io.BytesIO(data)) as image:
+            image_format = image.format
+            if image_format not in OPTIMIZED_IMAGE_FORMATS or getattr(image, 'n_frames', 1) > 1:
+                return None
+            image = PIL.ImageOps.exif_transpose(image)
+            image.thumbnail((max_size, max_size), PIL.Image.LANCZOS)
+            output = io.BytesIO()
+            if image_format == 'PNG':
+                image.save(output, format=image_format, optimize=True)
+            else:
+                image.save(output, format=image_format, quality=quality, optimize=True)
+    except (OSError, PIL.Image.DecompressionBombError):
+        return None
+    result = output.getvalue()
+    return result if len(result) < len(data) else None
+
+
+def write_cache_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as stream:
+        stream.write(data)
+    os.replace(tmp_path, path)
@@ -0,0 +1,35 @@
+import threading
+import time
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity, clock=time.monotonic, sleep=time.sleep):
+        assert rate > 0
+        self.__rate = rate
+        self.__capacity = capacity
+        self.__clock = clock
+        self.__sleep = sleep
+        self.__tokens = capacity
+        self.__time = clock()
+        self.__lock = threading.Lock()
+
+    def acquire(self, amount):
+        with self.__lock:
+            delay = self.__reserve(amount)
+        if delay > 0:
+            self.__sleep(delay)
+        return delay
+
+    def try_acquire(self, amount):
+        with self.__lock:
+            if self.__reserve(0) > 0 or self.__tokens < amount:
+                return False
+            self.__tokens -= amount
+            return True
+
+    def __reserve(self, amount):
+        cur_time = self.__clock()
+        self.__tokens = min(self.__capacity, self.__tokens + (cur_time - self.__time) * self.__rate)
+        self.__time = cur_time
+        self.__tokens -= amount
+        return -self.__tokens / self.__rate if self.__tokens < 0 else 0
@@ -0,0 +1,186 @@
+import collections
+import contextlib
+import os
+import sqlite3
+
+from sigame_tools.common import (
+    decode_answer,
+)
+
+from sigame_tools.instrumentation import (
+    count,
+    span,
+)
+
+SEARCH_INDEX_VERSION = 1
+
+SEARCH_FIELDS = (
+    'theme_name',
+    'package_name',
+    'authors',
+    'right_answers',
+)
+
+STORED_FIELDS = (
+    'id',
+    'path',
+    'round_name',
+)
+
+MIN_TRIGRAM_QUERY_LENGTH = 3
+
+FUZZY_CANDIDATES = 1000
+
+VALUES_SEPARATOR = '\n'
+
+SearchResult = collections.namedtuple('SearchResult', STORED_FIELDS + SEARCH_FIELDS + ('score',))
+
+
+def build_search_index(themes, output):
+    tmp_output = output + '.tmp'
+    if os.path.exists(tmp_output):
+        os.remove(tmp_output)
+    try:
+        with span('build_search_index'), contextlib.closing(sqlite3.connect(tmp_output)) as connection:
+            connection.execute('PRAGMA journal_mode=OFF')
+            connection.execute('PRAGMA synchronous=OFF')
+            with connection:
+                connection.execute(
+                    'CREATE VIRTUAL TABLE themes USING fts5('
+                    + ', '.join(f'{v} UNINDEXED' for v in STORED_FIELDS) + ', '
+                    + ', '.join(SEARCH_FIELDS) + ', '
+                    + "tokenize='trigram')"
+                )
+                connection.executemany(
+                    f'INSERT INTO themes VALUES ({", ".join("?" * len(STORED_FIELDS + SEARCH_FIELDS))})',
+                    (make_row(v) for v in themes),
+                )
+                connection.execute("INSERT INTO themes (themes) VALUES ('optimize')")
+                connection.execute(f'PRAGMA user_version = {SEARCH_INDEX_VERSION}')
+        os.replace(tmp_output, output)
+    except:
+        if os.path.exists(tmp_output):
+            os.remove(tmp_output)
+        raise
+
+
+def make_row(theme):
+    count('search_index_themes')
+    return (
+        theme.id,
+        theme.path,
+        theme.round_name,
+        theme.theme_name,
+        theme.package_name,
+        VALUES_SEPARATOR.join(theme.authors),
+        VALUES_SEPARATOR.join(decode_answer(v) for v in theme.base64_encoded_right_answers),
+    )
+
+
+def is_search_index_outdated(search_index_path, index_path):
+    return (not os.path.exists(search_index_path)
+            or os.path.getmtime(search_index_path) < os.path.getmtime(index_path))
+
+
+class SearchIndex:
+    def __init__(self, path):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f'Search index {path} does not exist')
+        self.__connection = sqlite3.connect(f'file:{path}?mode=ro', uri=True, check_same_thread=False)
+        version = self.__connection.execute('PRAGMA user_version').fetchone()[0]
+        if version != SEARCH_INDEX_VERSION:
+            self.__connection.close()
+            raise RuntimeError(f'Unsupported search index version {version} in {path}, rebuild it')
+        self.__connection.create_function('casefold_contains', 2, casefold_contains, deterministic=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self):
+        self.__connection.close()
+
+    def find(self, query, fields=SEARCH_FIELDS, limit=20):
+        fields = get_fields(fields)
+        with span('search'):
+            if len(query) < MIN_TRIGRAM_QUERY_LENGTH:
+                condition = ' OR '.join(f'casefold_contains({v}, ?)' for v in fields)
+                rows = self.__connection.execute(
+                    f'SELECT {", ".join(SearchResult._fields[:-1])}, 0 FROM themes WHERE {condition} LIMIT ?',
+                    (query,) * len(fields) + (limit,),
+                )
+            else:
+                rows = self.__match(expression=quote_phrase(query), fields=fields, limit=limit)
+            return [make_search_result(v) for v in rows]
+
+    def find_similar(self, query, fields=SEARCH_FIELDS, limit=20, min_similarity=0.8):
+        fields = get_fields(fields)
+        trigrams = sorted(get_trigrams(query))
+        if not trigrams:
+            return self.find(query=query, fields=fields, limit=limit)
+        with span('search'):
+            candidates = [make_search_result(v) for v in self.__match(
+                expression=' OR '.join(quote_phrase(v) for v in trigrams),
+                fields=fields,
+                limit=FUZZY_CANDIDATES,
+            )]
+        count('search_candidates', len(candidates))
+        with span('rerank'):
+            results = list()
+            for candidate in candidates:
+                similarity = max(get_similarity(query, getattr(candidate, v)) for v in fields)
+                if similarity >= min_similarity:
+                    results.append(candidate._replace(score=similarity))
+            results.sort(key=lambda v: v.score, reverse=True)
+            return results[:limit]
+
+    def __match(self, expression, fields, limit):
+        return self.__connection.execute(
+            f'SELECT {", ".join(SearchResult._fields[:-1])}, -rank FROM themes WHERE themes MATCH ?'
+            + ' ORDER BY rank LIMIT ?',
+            (f'{{{" ".join(fields)}}} : ({expression})', limit),
+        )
+
+
+def get_fields(fields):
+    fields = tuple(fields) or SEARCH_FIELDS
+    unknown = sorted(set(fields) - set(SEARCH_FIELDS))
+    if unknown:
+        raise ValueError(f'Unknown search fields: {", ".join(unknown)}')
+    return fields
+
+
+def make_search_result(row):
+    values = dict(zip(SearchResult._fields, row))
+    for name in ('authors', 'right_answers'):
+        values[name] = tuple(values[name].split(VALUES_SEPARATOR)) if values[name] else tuple()
+    return SearchResult(**values)
+
+
+def quote_phrase(value):
+    return '"' + value.replace('"', '""') + '"'
+
+
+def casefold_contains(value, query):
+    return value is not None and query.casefold() in value.casefold()
+
+
+def get_trigrams(value):
+    value = value.casefold()
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+def get_similarity(query, values):
+    import Levenshtein
+    query = query.casefold()
+    query_words = len(query.split())
+    result = 0
+    for value in (values if isinstance(values, tuple) else (values,)):
+        value = value.casefold()
+        result = max(result, Levenshtein.ratio(query, value))
+        words = value.split()
+        for i in range(len(words) - query_words + 1):
+            result = max(result, Levenshtein.ratio(query, ' '.join(words[i:i + query_words])))
+    return result
@@ -0,0 +1,15 @@
+import requests
+import requests.adapters
+
+
+def make_session(user_agent, pool_size=10, max_connections_per_host=10):
+    session = requests.Session()
+    session.headers['User-Agent'] = user_agent
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=max_connections_per_host,
+        pool_block=True,
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
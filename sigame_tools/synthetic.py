@@ -0,0 +1,105 @@
+import collections
+import lxml.etree
+import os.path
+import random
+import string
+import urllib.parse
+import zipfile
+
+from sigame_tools.common import (
+    SIQ_FILE_TYPE_DIRS,
+    write_content_xml,
+    write_siq_const_files,
+    write_siq_file,
+)
+
+CorpusParameters = collections.namedtuple('CorpusParameters', (
+    'packages',
+    'rounds',
+    'themes_per_round',
+    'questions_per_theme',
+    'answers_per_question',
+    'media_per_theme',
+    'media_size',
+    'final_themes',
+))
+
+DEFAULT_CORPUS_PARAMETERS = CorpusParameters(
+    packages=10,
+    rounds=3,
+    themes_per_round=6,
+    questions_per_theme=5,
+    answers_per_question=2,
+    media_per_theme=1,
+    media_size=1024,
+    final_themes=3,
+)
+
+
+def generate_corpus(output_dir, parameters=DEFAULT_CORPUS_PARAMETERS, random_seed=None):
+    os.makedirs(output_dir, exist_ok=True)
+    rng = random.Random(random_seed)
+    paths = list()
+    for number in range(parameters.packages):
+        path = os.path.join(output_dir, f'synthetic_{number:06d}.siq')
+        write_synthetic_package(path=path, number=number, parameters=parameters, rng=rng)
+        paths.append(path)
+    return paths
+
+
+def write_synthetic_package(path, number, parameters, rng):
+    package_element = lxml.etree.Element('package', attrib=dict(
+        name=f'Synthetic package {number}',
+        version='4',
+        id=f'synthetic-{number}',
+        xmlns='http://vladimirkhil.com/ygpackage3.0.xsd',
+    ))
+    info_element = lxml.etree.SubElement(package_element, 'info')
+    authors_element = lxml.etree.SubElement(info_element, 'authors')
+    for _ in range(rng.randint(1, 3)):
+        lxml.etree.SubElement(authors_element, 'author').text = make_words(rng, 2).title()
+    rounds_element = lxml.etree.SubElement(package_element, 'rounds')
+    media = list()
+    for round_number in range(parameters.rounds):
+        round_element = lxml.etree.SubElement(rounds_element, 'round', attrib=dict(name=f'Round {round_number + 1}'))
+        themes_element = lxml.etree.SubElement(round_element, 'themes')
+        for _ in range(parameters.themes_per_round):
+            add_theme(themes_element=themes_element, questions=parameters.questions_per_theme,
+                      parameters=parameters, rng=rng, media=media)
+    if parameters.final_themes:
+        round_element = lxml.etree.SubElement(rounds_element, 'round', attrib=dict(name='Final', type='final'))
+        themes_element = lxml.etree.SubElement(round_element, 'themes')
+        for _ in range(parameters.final_themes):
+            add_theme(themes_element=themes_element, questions=1, parameters=parameters, rng=rng, media=media)
+    with zipfile.ZipFile(path, 'w') as siq:
+        write_siq_const_files(siq)
+        write_content_xml(siq=siq, content_xml=lxml.etree.ElementTree(package_element))
+        for file_name in media:
+            data = rng.getrandbits(8 * parameters.media_size).to_bytes(parameters.media_size, 'little')
+            write_siq_file(siq=siq, path=os.path.join(SIQ_FILE_TYPE_DIRS['image'], urllib.parse.quote(file_name)),
+                           data=data)
+
+
+def add_theme(themes_element, questions, parameters, rng, media):
+    theme_element = lxml.etree.SubElement(themes_element, 'theme', attrib=dict(name=make_words(rng, 3).title()))
+    questions_element = lxml.etree.SubElement(theme_element, 'questions')
+    media_questions = set(rng.sample(range(questions), min(questions, parameters.media_per_theme)))
+    for number in range(questions):
+        question_element = lxml.etree.SubElement(questions_element, 'question',
+                                                 attrib=dict(price=str((number + 1) * 100)))
+        scenario_element = lxml.etree.SubElement(question_element, 'scenario')
+        lxml.etree.SubElement(scenario_element, 'atom').text = make_words(rng, 8).capitalize() + '?'
+        if number in media_questions:
+            file_name = f'{make_words(rng, 2)} {len(media)}.png'
+            media.append(file_name)
+            lxml.etree.SubElement(scenario_element, 'atom', attrib=dict(type='image')).text = f'@{file_name}'
+        right_element = lxml.etree.SubElement(question_element, 'right')
+        for _ in range(parameters.answers_per_question):
+            lxml.etree.SubElement(right_element, 'answer').text = make_words(rng, rng.randint(1, 3))
+
+
+def make_words(rng, number):
+    return ' '.join(
+        ''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 9)))
+        for _ in range(number)
+    )
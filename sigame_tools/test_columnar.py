@@ -0,0 +1,86 @@
+import pytest
+
+from sigame_tools.columnar import (
+    make_theme_columns,
+    read_theme_columns,
+    write_theme_columns,
+)
+
+from sigame_tools.common import (
+    THEME_METADATA_FIELDS,
+    build_themes_index,
+)
+
+from sigame_tools.filters import (
+    make_filter,
+    make_preferred_filter,
+)
+
+from sigame_tools.synthetic import (
+    CorpusParameters,
+    generate_corpus,
+)
+
+CORPUS_PARAMETERS = CorpusParameters(
+    packages=5,
+    rounds=2,
+    themes_per_round=4,
+    questions_per_theme=5,
+    answers_per_question=1,
+    media_per_theme=1,
+    media_size=10,
+    final_themes=2,
+)
+
+FILTER_SETS = (
+    tuple(),
+    (('include', 'questions_num', '5'),),
+    (('exclude', 'theme_name', '^[A-M]'),),
+    (('include', 'media_ok', 'true'), ('exclude', 'media_ok', 'false')),
+    (('include', 'images_num', '1'), ('include', 'questions_num', '5'), ('exclude', 'authors', 'a')),
+    (('prefer', 'package_name', '[13]$'), ('include', 'path', '000004'), ('exclude', 'theme_name', 'e')),
+)
+
+
+@pytest.fixture(scope='module')
+def themes(tmp_path_factory):
+    corpus_dir = str(tmp_path_factory.mktemp('corpus'))
+    generate_corpus(output_dir=corpus_dir, parameters=CORPUS_PARAMETERS, random_seed=3)
+    return tuple(build_themes_index([corpus_dir]))
+
+
+@pytest.mark.parametrize('filter_set', FILTER_SETS)
+def test_theme_columns_filter_should_match_make_filter(themes, filter_set):
+    columns = make_theme_columns(themes)
+    filter_f = make_filter(args=filter_set, types=THEME_METADATA_FIELDS)
+    is_preferred = make_preferred_filter(args=filter_set, types=THEME_METADATA_FIELDS)
+    assert columns.filter(filter_set).tolist() == [bool(filter_f(v)) for v in themes]
+    assert columns.preferred(filter_set).tolist() == [bool(is_preferred(v)) for v in themes]
+
+
+def test_theme_columns_should_be_same_after_write_and_read(themes, tmp_path):
+    columns = make_theme_columns(themes)
+    path = str(tmp_path / 'columns.npz')
+    write_theme_columns(columns=columns, output=path)
+    read_columns = read_theme_columns(path)
+    assert read_columns.size == len(themes)
+    for field in ('path', 'round_type', 'authors'):
+        assert read_columns[field].categories == columns[field].categories
+        assert read_columns[field].counts().tolist() == columns[field].counts().tolist()
+    assert None in read_columns['round_type'].categories
+    for filter_set in FILTER_SETS:
+        assert read_columns.filter(filter_set).tolist() == columns.filter(filter_set).tolist()
+
+
+def test_theme_columns_filter_should_not_match_missing_values(themes):
+    columns = make_theme_columns(themes)
+    mask = columns.filter([('include', 'round_type', '')])
+    assert mask.tolist() == [v.round_type is not None for v in themes]
+    assert 0 < mask.sum() < len(themes)
+
+
+def test_str_list_column_counts_should_count_themes(themes):
+    theme = themes[0]._replace(authors=('A', 'A', 'B'))
+    columns = make_theme_columns([theme, themes[1]._replace(authors=('A',))])
+    counts = dict(zip(columns['authors'].categories, columns['authors'].counts().tolist()))
+    assert counts == dict(A=2, B=1)
@@ -0,0 +1,114 @@
+import json
+import os
+import shutil
+import zipfile
+
+from sigame_tools.common import (
+    build_themes_index,
+    copy_file_to_siq,
+    find_packages,
+    read_index,
+    write_index,
+)
+
+from sigame_tools.manifest import Manifest
+
+from sigame_tools.testing import (
+    make_content_xml,
+    write_package,
+)
+
+
+def test_build_themes_index_should_skip_duplicate_packages(tmp_path):
+    package_path = write_package(tmp_path / 'a.siq', name='A')
+    duplicate_path = str(tmp_path / 'b.siq')
+    shutil.copyfile(package_path, duplicate_path)
+    themes = list(build_themes_index(paths=[package_path, duplicate_path]))
+    assert [v.path for v in themes] == [package_path]
+
+
+def test_build_themes_index_should_keep_packages_with_same_size(tmp_path):
+    package_a_path = write_package(tmp_path / 'a.siq', name='A')
+    package_b_path = write_package(tmp_path / 'b.siq', name='B')
+    themes = list(build_themes_index(paths=[package_a_path, package_b_path]))
+    assert [v.path for v in themes] == [package_a_path, package_b_path]
+
+
+def test_find_packages_should_add_unlisted_and_skip_missing_cache_files(tmp_path):
+    with Manifest(str(tmp_path)) as manifest:
+        listed_path = write_package(manifest.make_path(url='listed', extension='siq'), name='Listed')
+        manifest.put(url='listed', path=listed_path, extension='siq', name='listed.siq')
+        missing_path = write_package(manifest.make_path(url='missing', extension='siq'), name='Missing')
+        manifest.put(url='missing', path=missing_path, extension='siq', name='missing.siq')
+    os.remove(missing_path)
+    unlisted_path = write_package(tmp_path / 'unlisted.siq', name='Unlisted')
+    (tmp_path / 'manual').mkdir()
+    write_package(tmp_path / 'manual' / 'nested.siq', name='Nested')
+    packages = list(find_packages(paths=[str(tmp_path)]))
+    assert [(v.path, v.file_name) for v in packages] == [(listed_path, 'listed.siq'), (unlisted_path, 'unlisted.siq')]
+
+
+def test_build_themes_index_should_count_media_bytes_per_theme(tmp_path):
+    path = str(tmp_path / 'media.siq')
+    with zipfile.ZipFile(path, 'w') as siq:
+        siq.writestr('content.xml', make_content_xml(name='Media').replace(
+            '<atom>Question</atom>',
+            '<atom type="image">@cat 1.png</atom><atom type="voice">@meow.mp3</atom>'
+            + '<atom type="image">@missing.png</atom>',
+        ))
+        siq.writestr('Images/cat%201.png', b'x' * 100)
+        siq.writestr('Audio/meow.mp3', b'x' * 20)
+    themes = tuple(build_themes_index(paths=(path,)))
+    assert [v.media_bytes for v in themes] == [120]
+    assert [v.media_ok for v in themes] == [False]
+
+
+def test_build_themes_index_should_mark_themes_with_all_media_present(tmp_path):
+    path = str(tmp_path / 'media.siq')
+    with zipfile.ZipFile(path, 'w') as siq:
+        siq.writestr('content.xml', make_content_xml(name='Media').replace(
+            '<atom>Question</atom>',
+            '<atom type="image">@cat 1.png</atom><atom>@not a file</atom>',
+        ))
+        siq.writestr('Images/cat%201.png', b'x' * 100)
+    themes = tuple(build_themes_index(paths=(path,)))
+    assert [v.media_ok for v in themes] == [True]
+
+
+def test_build_themes_index_should_read_packages_in_parallel(tmp_path):
+    paths = [write_package(tmp_path / f'{v}.siq', name=v) for v in 'ABCDEFGHIJ']
+    serial = list(build_themes_index(paths=paths))
+    parallel = list(build_themes_index(paths=paths, jobs=3))
+    assert [v._replace(id=None) for v in parallel] == [v._replace(id=None) for v in serial]
+    assert len({v.id for v in serial + parallel}) == len(serial) * 2
+
+
+def test_read_index_should_upgrade_themes_from_old_version(tmp_path):
+    path = str(tmp_path / 'index.json')
+    write_index(themes=build_themes_index(paths=(write_package(tmp_path / 'a.siq', name='A'),)), output=path)
+    with open(path) as stream:
+        index = json.load(stream)
+    index['version'] = 1
+    for theme in index['themes']:
+        for field in ('file_name', 'images_num', 'videos_num', 'voices_num', 'media_bytes', 'media_ok'):
+            del theme[field]
+    with open(path, 'w') as stream:
+        json.dump(index, stream)
+    theme = read_index(path).themes[0]
+    assert (theme.file_name, theme.images_num, theme.videos_num, theme.voices_num) == ('', 0, 0, 0)
+    assert theme.media_bytes is None
+    assert theme.media_ok is None
+
+
+def test_copy_file_to_siq_should_use_archive_compression_and_file_time(tmp_path):
+    src_path = tmp_path / 'image.png'
+    src_path.write_bytes(b'x' * 1000)
+    os.utime(src_path, (1700000000, 1700000000))
+    with zipfile.ZipFile(tmp_path / 'pack.siq', 'w', compression=zipfile.ZIP_DEFLATED) as siq:
+        copy_file_to_siq(siq=siq, path='Images/image.png', src_path=str(src_path))
+    with zipfile.ZipFile(tmp_path / 'pack.siq') as siq:
+        info = siq.getinfo('Images/image.png')
+        assert siq.read(info) == b'x' * 1000
+    assert info.compress_type == zipfile.ZIP_DEFLATED
+    assert info.compress_size < 1000
+    assert info.date_time[0] == 2023
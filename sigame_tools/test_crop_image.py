@@ -0,0 +1,164 @@
+import PIL.Image
+import click.testing
+import numpy
+import os
+import pytest
+import random
+
+import crop_image
+
+
+def is_border(pixels, y, base_x, length, min_gray):
+    return all(is_border_color(pixels[x, y], min_gray) for x in range(base_x, base_x + length))
+
+
+def is_border_color(color, min_gray):
+    return (
+        color[0] == color[1] == color[2] and color[0] <= min_gray or
+        color == (1, 0, 0)
+    )
+
+
+def make_image(mode, width, height, seed):
+    generator = random.Random(seed)
+    colors = [(0, 0, 0), (1, 0, 0), (40, 40, 40), (41, 41, 41), (10, 10, 11), (200, 200, 200)]
+    image = PIL.Image.new(mode, (width, height), (255,) * len(mode))
+    for y in range(height):
+        row = generator.choice(('border', 'mixed', 'space'))
+        for x in range(width):
+            if row == 'border':
+                color = generator.choice(colors[:3])
+            elif row == 'mixed':
+                color = generator.choice(colors)
+            else:
+                color = colors[-1]
+            image.putpixel((x, y), color + (generator.choice((0, 255)),) * (len(mode) - 3))
+    return image
+
+
+@pytest.mark.parametrize('mode', ('RGB', 'RGBA'))
+@pytest.mark.parametrize('seed', range(5))
+def test_get_border_mask_should_match_per_pixel_check(mode, seed):
+    image = make_image(mode=mode, width=12, height=200, seed=seed)
+    base_x, length, min_gray = 2, 8, 40
+    mask = crop_image.get_border_mask(
+        pixels=numpy.asarray(image.crop((base_x, 0, base_x + length, image.height))),
+        min_gray=min_gray,
+    )
+    pixels = image.load()
+    expected = [is_border(pixels, y, base_x, length, min_gray) for y in range(image.height)]
+    assert mask.tolist() == expected
+    assert any(expected) and not all(expected)
+
+
+def test_get_borders_should_fail_when_band_is_out_of_image():
+    image = PIL.Image.new('RGB', (10, 10))
+    with pytest.raises(ValueError, match='out of image'):
+        crop_image.get_borders(image=image, base_x=5, base_y=0, max_border_height=1, min_border_length=6,
+                               min_boder_gray=40)
+
+
+def write_lines_image(path, lines):
+    image = PIL.Image.new('RGB', (200, 40 * lines + 60), (255, 255, 255))
+    for number in range(lines):
+        for x in range(image.width):
+            image.putpixel((x, 30 + 40 * number), (0, 0, 0))
+    image.save(path)
+    return str(path)
+
+
+def run_crop(*args):
+    result = click.testing.CliRunner().invoke(crop_image.main, ['--log_level=error', *args])
+    if result.exception is not None and not isinstance(result.exception, SystemExit):
+        raise result.exception
+    assert result.exit_code == 0, result.output
+
+
+def get_names(path):
+    return sorted(v.name for v in path.iterdir())
+
+
+@pytest.mark.parametrize('jobs', (1, 2))
+def test_crop_image_should_crop_directory_and_skip_failed_images(tmp_path, jobs):
+    write_lines_image(tmp_path / 'a.png', lines=4)
+    write_lines_image(tmp_path / 'b.png', lines=22)
+    PIL.Image.new('RGB', (200, 100), (255, 255, 255)).save(tmp_path / 'c.png')
+    (tmp_path / 'd.png').write_bytes(b'not an image')
+    run_crop(f'--jobs={jobs}', str(tmp_path))
+    assert get_names(tmp_path) == sorted(
+        ['a.png', 'a.0.png', 'a.1.png', 'b.png', 'c.png', 'd.png']
+        + [f'b.{str(v).zfill(2)}.png' for v in range(11)]
+    )
+    with PIL.Image.open(tmp_path / 'a.0.png') as image:
+        assert image.size == (200, 70)
+
+
+def test_crop_image_should_skip_cropped_images(tmp_path):
+    path = write_lines_image(tmp_path / 'a.png', lines=4)
+    run_crop('--jobs=1', path)
+    crop_mtime = os.stat(tmp_path / 'a.0.png').st_mtime_ns
+    run_crop('--jobs=1', str(tmp_path))
+    assert os.stat(tmp_path / 'a.0.png').st_mtime_ns == crop_mtime
+    run_crop('--jobs=1', '--skip_cropped=false', str(tmp_path))
+    assert os.stat(tmp_path / 'a.0.png').st_mtime_ns != crop_mtime
+    crop_mtime = os.stat(tmp_path / 'a.0.png').st_mtime_ns
+    os.utime(path, ns=(crop_mtime + 10 ** 9, crop_mtime + 10 ** 9))
+    run_crop('--jobs=1', str(tmp_path))
+    assert os.stat(tmp_path / 'a.0.png').st_mtime_ns != crop_mtime
+    assert get_names(tmp_path) == ['a.0.png', 'a.1.png', 'a.png']
+
+
+def write_noise_lines_image(path, lines, seed):
+    generator = numpy.random.default_rng(seed)
+    pixels = numpy.full((40 * lines + 60, 200, 3), 255, dtype=numpy.uint8)
+    pixels[..., 0] = generator.integers(100, 256, size=pixels.shape[:2])
+    pixels[..., 1] = pixels[..., 0] - 50
+    pixels[..., 2] = generator.integers(0, 256, size=pixels.shape[:2])
+    for number in range(lines):
+        pixels[30 + 40 * number] = 0
+    PIL.Image.fromarray(pixels).save(path)
+    return str(path)
+
+
+@pytest.mark.parametrize('extension', ('bmp', 'ppm', 'png', 'tiff'))
+@pytest.mark.parametrize('strip_height', (7, 33, 1000))
+def test_crop_image_by_strips_should_match_crop_image(tmp_path, extension, strip_height):
+    (tmp_path / 'full').mkdir()
+    (tmp_path / 'strips').mkdir()
+    path = write_noise_lines_image(tmp_path / 'full' / f'a.{extension}', lines=6, seed=strip_height)
+    strips_path = str(tmp_path / 'strips' / f'a.{extension}')
+    os.link(path, strips_path)
+    parameters = dict(base_x=0, base_y=0, max_border_height=10, min_border_length=150, min_boder_gray=40)
+    assert crop_image.crop_image(path, **parameters) == 3
+    assert crop_image.crop_image_by_strips(strips_path, strip_height=strip_height, **parameters) == 3
+    assert get_names(tmp_path / 'full') == get_names(tmp_path / 'strips')
+    for name in get_names(tmp_path / 'full'):
+        with PIL.Image.open(tmp_path / 'full' / name) as full, PIL.Image.open(tmp_path / 'strips' / name) as strips:
+            assert (full.mode, full.size) == (strips.mode, strips.size)
+            assert full.tobytes() == strips.tobytes()
+
+
+@pytest.mark.parametrize('extension, orientation', (('bmp', -1), ('ppm', 1), ('tiff', 1)))
+def test_read_strips_should_read_raw_images_from_file(tmp_path, extension, orientation):
+    path = write_noise_lines_image(tmp_path / f'a.{extension}', lines=2, seed=1)
+    with PIL.Image.open(path) as image:
+        decoder, _, _, args = image.tile[0]
+        assert (decoder, args[-1]) == ('raw', orientation)
+        strips = list(crop_image.read_strips(path=path, image=image, strip_height=33))
+        assert [top for top, _ in strips] == [0, 33, 66, 99, 132]
+        buffer = crop_image.StripBuffer(image)
+        for top, strip in strips:
+            buffer.append(top=top, strip=strip)
+        assert buffer.crop(top=10, bottom=120).tobytes() == image.crop((0, 10, image.width, 120)).tobytes()
+
+
+@pytest.mark.parametrize('path, source', (
+    ('a.0.png', 'a.png'),
+    ('dir/a.b.07.png', 'dir/a.b.png'),
+    ('a.18.png', 'a.png'),
+    ('photo.2023.png', None),
+    ('a.9.png', None),
+    ('a.png', None),
+))
+def test_get_crop_source_should_match_crop_names_only(path, source):
+    assert crop_image.get_crop_source(path) == source
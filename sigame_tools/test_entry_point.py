@@ -0,0 +1,37 @@
+import json
+import os.path
+import subprocess
+import sys
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ('PIL', 'Levenshtein', 'deepdiff', 'pstats', 'requests', 'numpy', 'lxml')
+
+
+def get_imported_modules(code):
+    result = subprocess.run([sys.executable, '-c', code + '\nimport json, sys\nprint(json.dumps(sorted(sys.modules)))'],
+                            cwd=BASE_DIR, check=True, stdout=subprocess.PIPE, universal_newlines=True)
+    modules = json.loads(result.stdout.splitlines()[-1])
+    return sorted({v.split('.')[0] for v in modules} & set(HEAVY_MODULES))
+
+
+def test_entry_point_should_list_commands_without_importing_them():
+    result = subprocess.run([sys.executable, 'sigame-tools', '--help'], cwd=BASE_DIR, check=True,
+                            stdout=subprocess.PIPE, universal_newlines=True)
+    assert 'generate-random-pack' in result.stdout
+    assert 'update-index' in result.stdout
+    code = ('import runpy, sys\nsys.argv = ["sigame-tools", "--help"]\n'
+            'try:\n    runpy.run_path("sigame-tools", run_name="__main__")\nexcept SystemExit:\n    pass')
+    assert get_imported_modules(code) == []
+
+
+def test_entry_point_should_run_subcommand():
+    result = subprocess.run([sys.executable, 'sigame-tools', 'generate-index', '--help'], cwd=BASE_DIR, check=True,
+                            stdout=subprocess.PIPE, universal_newlines=True)
+    assert 'Usage: sigame-tools generate-index' in result.stdout
+
+
+def test_scripts_should_not_import_unused_heavy_modules():
+    assert get_imported_modules('import update_index') == []
+    assert get_imported_modules('import generate_random_pack') == ['lxml']
+    assert get_imported_modules('import serve_packs') == ['lxml']
@@ -0,0 +1,169 @@
+import collections
+import hashlib
+import os
+import download_vk_packs
+import pytest
+
+from sigame_tools.fake_vk import run_fake_vk_server
+from sigame_tools.instrumentation import STATS
+from sigame_tools.manifest import Manifest
+from sigame_tools.session import make_session
+
+
+def get_siq_urls(server, cache_dir, **kwargs):
+    with Manifest(cache_dir) as manifest, make_session(user_agent='test') as session:
+        return list(download_vk_packs.get_siq_urls(
+            offset=0,
+            pages=2,
+            vk_group_url=server.topic_url,
+            manifest=manifest,
+            session=session,
+            **kwargs,
+        ))
+
+
+def download(server, cache_dir, **kwargs):
+    stats = collections.Counter()
+    with Manifest(cache_dir) as manifest, make_session(user_agent='test') as session:
+        return download_vk_packs.download_files(
+            urls=download_vk_packs.get_siq_urls(
+                offset=0,
+                pages=2,
+                vk_group_url=server.topic_url,
+                manifest=manifest,
+                session=session,
+                page_concurrency=2,
+                stats=stats,
+            ),
+            session=session,
+            manifest=manifest,
+            stats=stats,
+            **kwargs,
+        )
+
+
+SAMPLE_PAGE = (
+    '<html><head><meta charset="utf-8"><title>Пакеты</title></head><body>'
+    + '<div class="post"><a class="mr_label medias_link" href="/doc1?dl=1&amp;hash=a">pack1.siq</a></div>'
+    + '<div class="post"><a class="medias_link  mr_label\tother" href="/doc2">Пакет 2.siq</a></div>'
+    + '<div class="post"><a class="mr_label" href="/label">label</a></div>'
+    + '<div class="post"><a class="medias_link" href="/media">media</a></div>'
+    + '<div class="post"><span class="mr_label medias_link" href="/span">span</span></div>'
+    + '<div class="post"><a class="mr_label_medias_link" href="/joined">joined</a></div>'
+    + '<div class="post"><p><a class="mr_label medias_link" href="/doc3"><b>pack3</b>.siq</a>'
+    + '<div class="post"><a class="mr_label medias_link" href="/doc4">pack4.siq'
+    + '</body></html>'
+).encode('utf-8')
+
+
+def test_get_siq_links_should_match_mr_label_medias_link_anchors():
+    assert download_vk_packs.get_siq_links(SAMPLE_PAGE) == ('/doc1?dl=1&hash=a', '/doc2', '/doc3', '/doc4')
+
+
+def test_get_siq_links_should_read_fake_vk_page():
+    with run_fake_vk_server(packages=25, package_size=1024) as server:
+        assert download_vk_packs.get_siq_links(server.get_page(20)) == tuple(f'/doc{v}' for v in range(20, 25))
+
+
+def test_download_files_should_use_cache_on_second_run(tmp_path):
+    with run_fake_vk_server(packages=25, package_size=1024, random_seed=42) as server:
+        first = download(server=server, cache_dir=str(tmp_path), speed_limit=None, concurrency=4)
+        sent_bytes = server.sent_bytes
+        second = download(server=server, cache_dir=str(tmp_path), speed_limit=None, concurrency=4)
+        assert server.sent_bytes == sent_bytes
+    assert (first.files, first.cached, first.errors) == (25, 0, 0)
+    assert first.downloaded_bytes == sum(len(server.get_package(v)) for v in range(25))
+    assert (second.files, second.cached, second.errors, second.downloaded_bytes) == (25, 25, 0, 0)
+
+
+def test_get_siq_urls_should_not_parse_not_modified_pages(tmp_path):
+    with run_fake_vk_server(packages=25, package_size=1024) as server:
+        urls = get_siq_urls(server=server, cache_dir=str(tmp_path))
+        with Manifest(str(tmp_path)) as manifest:
+            for page in range(2):
+                url = download_vk_packs.make_page_url(offset=0, page=page, vk_group_url=server.topic_url)
+                with open(manifest.get(url).path, 'w') as stream:
+                    stream.write('<html></html>')
+        STATS.reset()
+        assert get_siq_urls(server=server, cache_dir=str(tmp_path), page_ttl=0) == urls
+    assert len(urls) == 25
+    counters = STATS.report()['counters']
+    assert (counters.get('not_modified_pages'), counters.get('downloaded_pages')) == (2, None)
+
+
+def test_download_files_should_download_again_deleted_cached_files(tmp_path):
+    with run_fake_vk_server(packages=25, package_size=1024, random_seed=42) as server:
+        download(server=server, cache_dir=str(tmp_path), speed_limit=None, concurrency=4)
+        with Manifest(str(tmp_path)) as manifest:
+            page_url = download_vk_packs.make_page_url(offset=0, page=0, vk_group_url=server.topic_url)
+            page_path = manifest.get(page_url).path
+            package_path = manifest.entries(extension='siq')[0].path
+        os.remove(page_path)
+        os.remove(package_path)
+        STATS.reset()
+        stats = download(server=server, cache_dir=str(tmp_path), speed_limit=None, concurrency=4)
+    assert (stats.files, stats.cached, stats.errors, stats.page_errors) == (25, 24, 0, 0)
+    assert STATS.report()['counters']['downloaded_pages'] == 1
+    assert os.path.exists(page_path)
+    assert os.path.exists(package_path)
+
+
+def test_download_files_should_report_errors(tmp_path):
+    with run_fake_vk_server(packages=40, package_size=1024, error_rate=0.2, random_seed=42) as server:
+        with Manifest(str(tmp_path)) as manifest, make_session(user_agent='test') as session:
+            stats = download_vk_packs.download_files(
+                urls=[f'{server.url}/doc{v}' for v in range(40)],
+                session=session,
+                manifest=manifest,
+                speed_limit=None,
+                concurrency=2,
+            )
+    assert stats.files + stats.errors == 40
+    assert stats.errors > 0
+
+
+def test_download_files_should_count_failed_pages(tmp_path):
+    with run_fake_vk_server(packages=25, package_size=1024, error_rate=1, random_seed=42) as server:
+        stats = download(server=server, cache_dir=str(tmp_path), speed_limit=None, concurrency=2)
+    assert (stats.files, stats.errors, stats.page_errors) == (0, 0, 2)
+
+
+def test_get_file_should_report_error_status(tmp_path):
+    with run_fake_vk_server(packages=1, package_size=1024, error_rate=1) as server:
+        with Manifest(str(tmp_path)) as manifest, make_session(user_agent='test') as session:
+            with pytest.raises(download_vk_packs.BadResponse, match='503'):
+                download_vk_packs.get_file(url=f'{server.url}/doc0', session=session, manifest=manifest)
+
+
+def test_get_file_should_resume_partial_download(tmp_path):
+    with run_fake_vk_server(packages=1, package_size=64 * 1024) as server:
+        url = f'{server.url}/doc0'
+        package = server.get_package(0)
+        with Manifest(str(tmp_path)) as manifest, make_session(user_agent='test') as session:
+            with open(manifest.make_path(url=url, extension='siq') + '.part', 'wb') as stream:
+                stream.write(package[:1000])
+            path, meta = download_vk_packs.get_file(url=url, session=session, manifest=manifest)
+            entry = manifest.get(url)
+        assert server.sent_bytes == len(package) - 1000
+    with open(path, 'rb') as stream:
+        assert stream.read() == package
+    assert meta['name'] == 'pack0.siq'
+    assert (entry.size, entry.sha256) == (len(package), hashlib.sha256(package).hexdigest())
+
+
+def test_get_file_should_complete_download_of_already_fully_downloaded_part(tmp_path):
+    with run_fake_vk_server(packages=1, package_size=64 * 1024) as server:
+        url = f'{server.url}/doc0'
+        package = server.get_package(0)
+        with Manifest(str(tmp_path)) as manifest, make_session(user_agent='test') as session:
+            part_path = manifest.make_path(url=url, extension='siq') + '.part'
+            with open(part_path, 'wb') as stream:
+                stream.write(package)
+            path, meta = download_vk_packs.get_file(url=url, session=session, manifest=manifest)
+            entry = manifest.get(url)
+        assert server.sent_bytes == 0
+    assert not os.path.exists(part_path)
+    with open(path, 'rb') as stream:
+        assert stream.read() == package
+    assert meta['name'] == 'pack0.siq'
+    assert (entry.size, entry.sha256) == (len(package), hashlib.sha256(package).hexdigest())
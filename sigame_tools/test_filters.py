@@ -368,3 +368,14 @@ def test_filter_exclude_by_one_field_mutually_exclusive_values(values, filtered)
         types=TYPES,
     )
     assert list(filter(f, values)) == filtered
+
+
+def test_filter_include_by_bool():
+    BoolValue = collections.namedtuple('BoolValue', ('b',))
+    values = [BoolValue(b=True), BoolValue(b=False), BoolValue(b=None)]
+    f = make_filter(args=[('include', 'b', 'true')], types=dict(b=bool))
+    assert list(filter(f, values)) == [BoolValue(b=True)]
+    f = make_filter(args=[('exclude', 'b', 'false')], types=dict(b=bool))
+    assert list(filter(f, values)) == [BoolValue(b=True), BoolValue(b=None)]
+    with pytest.raises(ValueError):
+        make_filter(args=[('include', 'b', '1')], types=dict(b=bool))
@@ -0,0 +1,98 @@
+import base64
+import pytest
+import random
+
+from generate_random_pack import (
+    MediaBudget,
+    get_unique_samples,
+    make_filter_used_by,
+    make_package,
+)
+
+from sigame_tools.common import ThemeMetadata
+
+
+def make_theme(number, media_bytes):
+    return ThemeMetadata(
+        id=str(number),
+        round_number=0,
+        theme_number=number,
+        path='a.siq',
+        package_name='A',
+        round_name='Round',
+        theme_name=f'Theme {number}',
+        questions_num=5,
+        authors=tuple(),
+        base64_encoded_right_answers=(base64.b64encode(f'Answer {number}'.encode('utf-8')).decode('utf-8'),),
+        round_type=None,
+        file_name='a.siq',
+        images_num=1,
+        videos_num=0,
+        voices_num=0,
+        media_bytes=media_bytes,
+        media_ok=True,
+    )
+
+
+def sample(themes, number, budget):
+    used_theme_names = set()
+    used_right_answers = set()
+    return get_unique_samples(
+        number=number,
+        is_used=make_filter_used_by(used_theme_names=used_theme_names, used_right_answers=used_right_answers,
+                                    check_right_answers_similarity=False, budget=budget),
+        themes=set(themes),
+        used_theme_names=used_theme_names,
+        used_right_answers=used_right_answers,
+        get_weight=lambda _: 1,
+        budget=budget,
+    )
+
+
+def test_get_unique_samples_should_spend_budget():
+    random.seed(42)
+    budget = MediaBudget(120)
+    samples = sample(themes=[make_theme(v, media_bytes=40) for v in range(3)], number=3, budget=budget)
+    assert sorted(v.theme_number for v in samples) == [0, 1, 2]
+    assert (budget.spent, budget.left) == (120, 0)
+
+
+def test_get_unique_samples_should_skip_themes_not_fitting_budget():
+    random.seed(42)
+    budget = MediaBudget(100)
+    themes = [make_theme(0, media_bytes=90), make_theme(1, media_bytes=10), make_theme(2, media_bytes=None)]
+    samples = sample(themes=themes, number=1, budget=budget)
+    assert [v.theme_number for v in samples] in ([0], [1])
+    samples = sample(themes=themes, number=2, budget=MediaBudget(100))
+    assert sorted(v.theme_number for v in samples) == [0, 1]
+
+
+@pytest.mark.parametrize('random_seed', range(5))
+def test_get_unique_samples_should_refund_budget_when_themes_do_not_fit(random_seed):
+    random.seed(random_seed)
+    budget = MediaBudget(100)
+    assert sample(themes=[make_theme(v, media_bytes=40) for v in range(3)], number=3, budget=budget) is None
+    assert budget.spent == 0
+
+
+def test_make_package_should_report_not_enough_media_bytes():
+    with pytest.raises(RuntimeError, match='not enough samples .* and 100 media bytes left'):
+        make_package(
+            metadata=tuple(make_theme(v, media_bytes=40) for v in range(3)),
+            rounds_number=2,
+            themes_per_round=3,
+            min_questions_per_theme=1,
+            max_questions_per_theme=10,
+            filter_f=lambda _: True,
+            is_preferred=lambda _: False,
+            get_weight=lambda _: 1,
+            package_name='Pack',
+            use_unique_theme_names=True,
+            use_unique_right_answers=True,
+            use_obfuscation=False,
+            use_unified_price=True,
+            shuffle=False,
+            check_right_answers_similarity=False,
+            final_themes=0,
+            max_pack_bytes=100,
+        )
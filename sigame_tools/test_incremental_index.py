@@ -0,0 +1,82 @@
+import pytest
+import time
+import zipfile
+
+from sigame_tools.common import read_index
+from sigame_tools.incremental_index import (
+    IncrementalIndex,
+    IndexingWorker,
+)
+from sigame_tools.testing import write_package
+
+
+def test_indexing_worker_should_add_themes_to_index(tmp_path):
+    index_path = str(tmp_path / 'index.json')
+    package_path = write_package(tmp_path / 'a.siq', name='A')
+    with IndexingWorker(index=IncrementalIndex(index_path), flush_interval=60) as worker:
+        worker.submit(path=package_path, file_name='a.siq')
+    themes = read_index(index_path).themes
+    assert [(v.path, v.package_name, v.file_name) for v in themes] == [(package_path, 'A', 'a.siq')]
+
+
+def test_indexing_worker_should_keep_indexed_themes(tmp_path):
+    index_path = str(tmp_path / 'index.json')
+    package_a_path = write_package(tmp_path / 'a.siq', name='A')
+    package_b_path = write_package(tmp_path / 'b.siq', name='B')
+    with IndexingWorker(index=IncrementalIndex(index_path), flush_interval=60) as worker:
+        worker.submit(path=package_a_path, file_name='a.siq')
+    theme_id = read_index(index_path).themes[0].id
+    with IndexingWorker(index=IncrementalIndex(index_path), flush_interval=60) as worker:
+        worker.submit(path=package_a_path, file_name='a.siq')
+        worker.submit(path=package_b_path, file_name='b.siq')
+    themes = read_index(index_path).themes
+    assert [v.package_name for v in themes] == ['A', 'B']
+    assert themes[0].id == theme_id
+
+
+def test_incremental_index_should_replace_and_remove_path_themes(tmp_path):
+    index_path = str(tmp_path / 'index.json')
+    package_path = write_package(tmp_path / 'a.siq', name='A')
+    index = IncrementalIndex(index_path)
+    assert package_path not in index
+    with IndexingWorker(index=index, flush_interval=60) as worker:
+        worker.submit(path=package_path, file_name='a.siq')
+    assert package_path in index
+    index.remove(package_path)
+    index.flush()
+    assert read_index(index_path).themes == tuple()
+
+
+def test_indexing_worker_should_raise_error_on_next_submit(tmp_path, caplog):
+    index_path = str(tmp_path / 'missing' / 'index.json')
+    package_path = write_package(tmp_path / 'a.siq', name='A')
+    worker = IndexingWorker(index=IncrementalIndex(index_path), flush_interval=0.01)
+    submitted = 0
+    with pytest.raises(FileNotFoundError):
+        with worker:
+            for submitted in range(1000):
+                worker.submit(path=package_path, file_name='a.siq')
+                time.sleep(0.01)
+    assert submitted < 999
+    assert 'Indexing worker failed' in caplog.text
+
+
+def test_indexing_worker_should_skip_broken_packages(tmp_path):
+    index_path = str(tmp_path / 'index.json')
+    broken_path = str(tmp_path / 'broken.siq')
+    with zipfile.ZipFile(broken_path, 'w') as siq:
+        siq.writestr('content.xml', '<package')
+    package_path = write_package(tmp_path / 'a.siq', name='A')
+    with IndexingWorker(index=IncrementalIndex(index_path), flush_interval=60) as worker:
+        worker.submit(path=broken_path, file_name='broken.siq')
+        worker.submit(path=package_path, file_name='a.siq')
+    assert [v.path for v in read_index(index_path).themes] == [package_path]
+
+
+def test_indexing_worker_should_not_replace_propagating_error(tmp_path):
+    index_path = str(tmp_path / 'missing' / 'index.json')
+    package_path = write_package(tmp_path / 'a.siq', name='A')
+    with pytest.raises(ValueError):
+        with IndexingWorker(index=IncrementalIndex(index_path), flush_interval=60) as worker:
+            worker.submit(path=package_path, file_name='a.siq')
+            raise ValueError()
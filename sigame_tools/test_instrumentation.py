@@ -0,0 +1,50 @@
+import json
+import logging
+
+from sigame_tools.instrumentation import (
+    STATS,
+    RateLimitFilter,
+    count,
+    profiling,
+    span,
+)
+
+from sigame_tools.testing import (
+    FakeClock,
+)
+
+
+def make_record(msg, level=logging.INFO):
+    return logging.LogRecord('test', level, __file__, 0, msg, None, None)
+
+
+def test_rate_limit_filter_should_suppress_frequent_messages_and_report_count():
+    clock = FakeClock()
+    log_filter = RateLimitFilter(rate=1, burst=2, clock=clock)
+    assert [log_filter.filter(make_record('Read %s')) for _ in range(5)] == [True, True, False, False, False]
+    assert log_filter.filter(make_record('Write %s'))
+    clock.time = 1
+    record = make_record('Read %s')
+    assert log_filter.filter(record)
+    assert record.msg == 'Read %s (3 similar messages suppressed)'
+
+
+def test_rate_limit_filter_should_not_suppress_warnings():
+    log_filter = RateLimitFilter(rate=1, burst=1, clock=FakeClock())
+    assert all(log_filter.filter(make_record('Ignore %s', level=logging.WARNING)) for _ in range(5))
+
+
+def test_profiling_should_write_spans_counters_and_functions(tmp_path):
+    STATS.reset()
+    path = str(tmp_path / 'profile.json')
+    with profiling(path):
+        with span('stage'):
+            count('items', 3)
+        with span('stage'):
+            count('items')
+    with open(path) as stream:
+        report = json.load(stream)
+    assert report['duration'] > 0
+    assert report['spans']['stage']['count'] == 2
+    assert report['counters'] == dict(items=4)
+    assert report['functions']
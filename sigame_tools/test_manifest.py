@@ -0,0 +1,196 @@
+import base64
+import hashlib
+import json
+import os.path
+import pytest
+import sqlite3
+import threading
+
+from sigame_tools.manifest import (
+    MANIFEST_FILE_NAME,
+    MIGRATIONS,
+    Manifest,
+    has_manifest,
+)
+
+
+def write_file(path, data):
+    with open(path, 'w') as stream:
+        stream.write(data)
+
+
+def test_make_path_should_shard_by_url_hash(tmp_path):
+    cache_dir = str(tmp_path)
+    with Manifest(cache_dir) as manifest:
+        path = manifest.make_path(url='https://example.com/doc1', extension='siq')
+    relative_path = os.path.relpath(path, cache_dir)
+    shard1, shard2, file_name = relative_path.split(os.sep)
+    assert file_name.startswith(shard1 + shard2)
+    assert file_name.endswith('.siq')
+    assert os.path.isdir(os.path.join(cache_dir, shard1, shard2))
+
+
+def test_get_should_return_put_entry(tmp_path):
+    cache_dir = str(tmp_path)
+    url = 'https://example.com/doc1'
+    with Manifest(cache_dir) as manifest:
+        path = manifest.make_path(url=url, extension='siq')
+        write_file(path, 'data')
+        manifest.put(url=url, path=path, extension='siq', name='pack.siq')
+    assert has_manifest(cache_dir)
+    with Manifest(cache_dir) as manifest:
+        entry = manifest.get(url)
+        assert manifest.get('https://example.com/doc2') is None
+    assert entry.path == path
+    assert entry.size == 4
+    assert entry.name == 'pack.siq'
+    assert entry.etag is None
+
+
+def test_put_should_store_validators(tmp_path):
+    cache_dir = str(tmp_path)
+    url = 'https://example.com/topic'
+    with Manifest(cache_dir) as manifest:
+        path = manifest.make_path(url=url, extension='html')
+        write_file(path, 'data')
+        manifest.put(url=url, path=path, extension='html', etag='"v1"', last_modified='Mon, 19 Oct 2026 00:00:00 GMT')
+        entry = manifest.get(url)
+    assert entry.etag == '"v1"'
+    assert entry.last_modified == 'Mon, 19 Oct 2026 00:00:00 GMT'
+
+
+def test_manifest_should_migrate_existing_entries(tmp_path):
+    cache_dir = str(tmp_path)
+    connection = sqlite3.connect(os.path.join(cache_dir, MANIFEST_FILE_NAME))
+    with connection:
+        for statement in MIGRATIONS[0]:
+            connection.execute(statement)
+        connection.execute("INSERT INTO entries VALUES ('a', 'a.siq', 'siq', 1, 'pack.siq', 0)")
+        connection.execute('PRAGMA user_version = 1')
+    connection.close()
+    with Manifest(cache_dir) as manifest:
+        entry = manifest.get('a')
+    assert entry.name == 'pack.siq'
+    assert entry.etag is None
+
+
+def test_entries_should_be_filtered_by_extension_and_sorted_by_path(tmp_path):
+    cache_dir = str(tmp_path)
+    with Manifest(cache_dir) as manifest:
+        for url, extension in (('a', 'siq'), ('b', 'html'), ('c', 'siq')):
+            path = manifest.make_path(url=url, extension=extension)
+            write_file(path, url)
+            manifest.put(url=url, path=path, extension=extension)
+        entries = manifest.entries(extension='siq')
+    assert sorted(v.url for v in entries) == ['a', 'c']
+    assert [v.path for v in entries] == sorted(v.path for v in entries)
+
+
+def test_find_should_return_original_entry_by_hash(tmp_path):
+    cache_dir = str(tmp_path)
+    with Manifest(cache_dir) as manifest:
+        path = manifest.make_path(url='a', extension='siq')
+        write_file(path, 'data')
+        manifest.put(url='a', path=path, extension='siq', sha256='hash')
+        manifest.put(url='b', path=path, extension='siq', sha256='hash', alias_of='a')
+        assert manifest.find(sha256='hash', extension='siq').url == 'a'
+        assert manifest.find(sha256='other', extension='siq') is None
+        assert manifest.get('b').path == path
+        assert [v.url for v in manifest.entries(extension='siq')] == ['a']
+
+
+def test_add_should_keep_one_original_per_hash_across_connections(tmp_path):
+    cache_dir = str(tmp_path)
+    with Manifest(cache_dir) as first, Manifest(cache_dir) as second:
+        def add(manifest, prefix):
+            for number in range(20):
+                url = f'{prefix}{number}'
+                path = manifest.make_path(url=url, extension='siq')
+                write_file(path, 'data')
+                manifest.add(url=url, path=path, extension='siq', sha256='hash')
+        threads = [threading.Thread(target=add, args=(v, n)) for n, v in (('a', first), ('b', second))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        original = first.find(sha256='hash', extension='siq')
+        assert [v.url for v in first.entries(extension='siq')] == [original.url]
+        assert {first.get(f'{p}{n}').alias_of for p in 'ab' for n in range(20)} == {None, original.url}
+        assert first.get('b0').path == original.path
+
+
+def test_add_should_move_original_to_new_file_when_its_file_is_missing(tmp_path):
+    cache_dir = str(tmp_path)
+    with Manifest(cache_dir) as manifest:
+        paths = dict()
+        for url in 'abc':
+            paths[url] = manifest.make_path(url=url, extension='siq')
+            write_file(paths[url], 'data')
+            manifest.add(url=url, path=paths[url], extension='siq', sha256='hash')
+            if url == 'b':
+                os.remove(paths['a'])
+        entries = {v: manifest.get(v) for v in 'abc'}
+    assert {v: (e.path, e.alias_of) for v, e in entries.items()} == dict(
+        a=(paths['c'], None),
+        b=(paths['c'], 'a'),
+        c=(paths['c'], 'a'),
+    )
+
+
+def test_manifest_should_hash_and_deduplicate_entries_on_migration(tmp_path):
+    cache_dir = str(tmp_path)
+    connection = sqlite3.connect(os.path.join(cache_dir, MANIFEST_FILE_NAME))
+    with connection:
+        for statements in MIGRATIONS[:3]:
+            for statement in statements:
+                connection.execute(statement)
+        for url, data, fetched_at in (('a', 'data', 1), ('b', 'data', 2), ('c', 'other', 3)):
+            write_file(os.path.join(cache_dir, f'{url}.siq'), data)
+            connection.execute(f"INSERT INTO entries (url, path, extension, size, fetched_at)"
+                               + f" VALUES ('{url}', '{url}.siq', 'siq', 4, {fetched_at})")
+        connection.execute('PRAGMA user_version = 3')
+    connection.close()
+    with Manifest(cache_dir) as manifest:
+        a, b, c = (manifest.get(v) for v in 'abc')
+    assert a.sha256 == b.sha256 != c.sha256
+    assert (a.alias_of, b.alias_of, c.alias_of) == (None, 'a', None)
+    assert b.path == a.path
+    assert not os.path.exists(os.path.join(cache_dir, 'b.siq'))
+
+
+def test_read_only_manifest_should_not_migrate_entries(tmp_path):
+    cache_dir = str(tmp_path)
+    connection = sqlite3.connect(os.path.join(cache_dir, MANIFEST_FILE_NAME))
+    with connection:
+        for statement in MIGRATIONS[0]:
+            connection.execute(statement)
+        for url in 'ab':
+            write_file(os.path.join(cache_dir, f'{url}.siq'), 'data')
+            connection.execute(f"INSERT INTO entries VALUES ('{url}', '{url}.siq', 'siq', 4, 'pack.siq', 0)")
+        connection.execute('PRAGMA user_version = 1')
+    connection.close()
+    with Manifest(cache_dir, read_only=True) as manifest:
+        entries = manifest.entries(extension='siq')
+        with pytest.raises(sqlite3.OperationalError):
+            manifest.remove('a')
+    assert [(v.url, v.sha256, v.alias_of) for v in entries] == [('a', None, None), ('b', None, None)]
+    assert os.path.exists(os.path.join(cache_dir, 'b.siq'))
+    connection = sqlite3.connect(os.path.join(cache_dir, MANIFEST_FILE_NAME))
+    assert connection.execute('PRAGMA user_version').fetchone()[0] == 1
+    connection.close()
+
+
+def test_new_manifest_should_adopt_flat_cache(tmp_path):
+    cache_dir = str(tmp_path)
+    url = 'https://example.com/doc1'
+    name = base64.b32encode(url.encode('utf-8')).decode('utf-8')
+    write_file(os.path.join(cache_dir, f'{name}.siq'), 'data')
+    write_file(os.path.join(cache_dir, f'{name}.siq.meta.json'), json.dumps(dict(name='pack.siq')))
+    write_file(os.path.join(cache_dir, 'unrelated.txt'), '')
+    with Manifest(cache_dir) as manifest:
+        entry = manifest.get(url)
+    assert os.path.exists(os.path.join(cache_dir, MANIFEST_FILE_NAME))
+    assert entry.path == os.path.join(cache_dir, f'{name}.siq')
+    assert entry.name == 'pack.siq'
+    assert entry.extension == 'siq'
+    assert entry.sha256 == hashlib.sha256(b'data').hexdigest()
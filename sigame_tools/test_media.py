@@ -0,0 +1,93 @@
+import concurrent.futures
+import PIL.Image
+import io
+import os
+import pytest
+
+from sigame_tools.media import (
+    MediaOptimizer,
+    optimize_image,
+)
+
+
+def make_image(size, image_format, mode='RGB'):
+    image = PIL.Image.frombytes(mode, size, os.urandom(size[0] * size[1] * len(mode)))
+    stream = io.BytesIO()
+    image.save(stream, format=image_format)
+    return stream.getvalue()
+
+
+def get_image_size(data):
+    with PIL.Image.open(io.BytesIO(data)) as image:
+        return image.format, image.size
+
+
+@pytest.mark.parametrize('image_format', ('PNG', 'JPEG', 'WEBP'))
+def test_optimize_image_should_downscale_large_image(image_format):
+    data = make_image((400, 200), image_format)
+    result = optimize_image(data=data, max_size=100, quality=80)
+    assert result is not None
+    assert len(result) < len(data)
+    assert get_image_size(result) == (image_format, (100, 50))
+
+
+def test_optimize_image_should_keep_image_when_result_is_not_smaller():
+    data = make_image((16, 16), 'PNG')
+    assert optimize_image(data=data, max_size=100, quality=80) is None
+
+
+def test_optimize_image_should_skip_unsupported_formats():
+    assert optimize_image(data=make_image((400, 200), 'BMP'), max_size=100, quality=80) is None
+    assert optimize_image(data=b'not an image', max_size=100, quality=80) is None
+
+
+def test_media_optimizer_should_reuse_cached_result(tmp_path):
+    data = make_image((400, 200), 'PNG')
+    with MediaOptimizer(cache_dir=str(tmp_path), max_size=100, quality=80, jobs=1) as optimizer:
+        optimized = optimizer.submit(data).result()
+    with MediaOptimizer(cache_dir=str(tmp_path), max_size=100, quality=80, jobs=1) as optimizer:
+        assert optimizer.submit(data).result() == optimized
+        assert optimizer.cache_hits == 1
+        assert optimizer.original_bytes == len(data)
+        assert optimizer.optimized_bytes == len(optimized)
+
+
+def test_media_optimizer_should_return_original_data_when_not_optimized(tmp_path):
+    data = b'not an image'
+    with MediaOptimizer(cache_dir=str(tmp_path), max_size=100, quality=80, jobs=1) as optimizer:
+        assert optimizer.submit(data).result() == data
+    with MediaOptimizer(cache_dir=str(tmp_path), max_size=100, quality=80, jobs=1) as optimizer:
+        assert optimizer.submit(data).result() == data
+        assert optimizer.cache_hits == 1
+
+
+def test_media_optimizer_should_optimize_same_data_once(tmp_path):
+    data = make_image((400, 200), 'PNG')
+    with MediaOptimizer(cache_dir=str(tmp_path), max_size=100, quality=80, jobs=1) as optimizer:
+        futures = [optimizer.submit(data) for _ in range(3)]
+        results = [v.result() for v in futures]
+    assert results[0] == results[1] == results[2]
+    assert len(results[0]) < len(data)
+    assert len(list(tmp_path.glob('*/*'))) == 1
+
+
+class ImmediateExecutor:
+    def __init__(self, max_workers=None):
+        pass
+
+    def submit(self, f, **kwargs):
+        future = concurrent.futures.Future()
+        future.set_result(f(**kwargs))
+        return future
+
+    def shutdown(self):
+        pass
+
+
+def test_media_optimizer_should_handle_already_done_optimization(tmp_path, monkeypatch):
+    monkeypatch.setattr(concurrent.futures, 'ProcessPoolExecutor', ImmediateExecutor)
+    data = make_image((400, 200), 'PNG')
+    with MediaOptimizer(cache_dir=str(tmp_path), max_size=100, quality=80, jobs=1) as optimizer:
+        assert len(optimizer.submit(data).result(timeout=10)) < len(data)
+        assert len(optimizer.submit(data).result(timeout=10)) < len(data)
+        assert optimizer.cache_hits == 1
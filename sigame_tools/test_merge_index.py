@@ -0,0 +1,134 @@
+import click.testing
+import io
+import json
+import pytest
+
+import merge_index
+import split_index
+
+from sigame_tools.common import (
+    ThemeMetadata,
+    get_theme_position,
+    open_index,
+    read_index,
+    write_index,
+)
+
+from sigame_tools.json_stream import (
+    JsonStreamReader,
+)
+
+
+def make_theme(id, path, theme_number, name='Theme', media_ok=True):
+    return ThemeMetadata(
+        id=id,
+        round_number=1,
+        theme_number=theme_number,
+        path=path,
+        package_name='Package',
+        round_name='Round',
+        theme_name=name,
+        questions_num=1,
+        authors=tuple(),
+        base64_encoded_right_answers=tuple(),
+        round_type=None,
+        file_name='',
+        images_num=0,
+        videos_num=0,
+        voices_num=0,
+        media_bytes=0,
+        media_ok=media_ok,
+    )
+
+
+def invoke(command, *args):
+    result = click.testing.CliRunner().invoke(command, ['--log_level=error', *args])
+    if result.exception is not None and not isinstance(result.exception, SystemExit):
+        raise result.exception
+    assert result.exit_code == 0, result.output
+
+
+@pytest.mark.parametrize('chunk_size', (1, 3, 7, 1024))
+def test_json_stream_reader_should_read_values_split_across_chunks(chunk_size):
+    value = {'version': 12345, 'themes': [{'a': [1, 2.5, None]}, 'строка', True, -70, {}, []], 'tail': 0}
+    reader = JsonStreamReader(io.StringIO(json.dumps(value, ensure_ascii=False)), chunk_size=chunk_size)
+    result = dict()
+    for key in reader.iter_object_keys():
+        result[key] = list(reader.iter_array()) if key == 'themes' else reader.read_value()
+    assert result == value
+    assert reader.peek() == ''
+
+
+def test_open_index_should_stream_same_themes_as_read_index(tmp_path):
+    path = str(tmp_path / 'index.json')
+    write_index(themes=[make_theme(str(v), f'p/{v}.siq', 1) for v in range(10)], output=path)
+    with open_index(path) as index:
+        assert tuple(index.themes) == read_index(path).themes
+
+
+def test_merge_index_should_deduplicate_themes_and_keep_order(tmp_path):
+    first = [make_theme('1', 'a.siq', 1), make_theme('2', 'b.siq', 1), make_theme('3', 'b.siq', 2)]
+    second = [make_theme('4', 'a.siq', 1), make_theme('5', 'a.siq', 2), make_theme('6', 'c.siq', 1, media_ok=None)]
+    third = [make_theme('7', 'c.siq', 1)]
+    paths = [str(tmp_path / f'{n}.json') for n in range(3)]
+    for path, themes in zip(paths, (first, second, third)):
+        write_index(themes=themes, output=path)
+    output = str(tmp_path / 'merged.json')
+    invoke(merge_index.main, f'--output={output}', *paths)
+    themes = read_index(output).themes
+    assert [v.id for v in themes] == ['1', '5', '2', '3', '6']
+    assert themes[-1].media_ok is True
+
+
+def test_merge_index_should_resolve_conflicts(tmp_path):
+    paths = [str(tmp_path / f'{n}.json') for n in range(2)]
+    write_index(themes=[make_theme('1', 'a.siq', 1, name='Old')], output=paths[0])
+    write_index(themes=[make_theme('2', 'a.siq', 1, name='New')], output=paths[1])
+    output = str(tmp_path / 'merged.json')
+    with pytest.raises(RuntimeError, match='different content'):
+        invoke(merge_index.main, f'--output={output}', *paths)
+    invoke(merge_index.main, f'--output={output}', '--on_conflict=last', *paths)
+    assert [v.id for v in read_index(output).themes] == ['2']
+    invoke(merge_index.main, f'--output={output}', '--on_conflict=first', *paths)
+    assert [v.id for v in read_index(output).themes] == ['1']
+
+
+def test_merge_index_should_not_write_duplicate_ids(tmp_path):
+    paths = [str(tmp_path / f'{n}.json') for n in range(2)]
+    write_index(themes=[make_theme('X', '/a.siq', 1), make_theme('1', '/c.siq', 1)], output=paths[0])
+    write_index(themes=[make_theme('X', '/b.siq', 1, name='Other')], output=paths[1])
+    output = str(tmp_path / 'merged.json')
+    with pytest.raises(RuntimeError, match='Theme id X at round 1 theme 1 of /b.siq is already used'):
+        invoke(merge_index.main, f'--output={output}', *paths)
+    assert not (tmp_path / 'merged.json').exists()
+    invoke(merge_index.main, f'--output={output}', '--on_duplicate_id=skip', *paths)
+    assert [(v.id, v.path) for v in read_index(output).themes] == [('X', '/a.siq'), ('1', '/c.siq')]
+
+
+def test_merge_index_should_fail_on_unsorted_index(tmp_path):
+    path = str(tmp_path / 'index.json')
+    write_index(themes=[make_theme('1', 'b.siq', 1), make_theme('2', 'a.siq', 1)], output=path)
+    output = str(tmp_path / 'merged.json')
+    with pytest.raises(RuntimeError, match='is not sorted'):
+        invoke(merge_index.main, f'--output={output}', path)
+    assert not (tmp_path / 'merged.json').exists()
+    assert not (tmp_path / 'merged.json.tmp').exists()
+
+
+def test_split_and_merge_index_should_restore_index(tmp_path):
+    themes = sorted(
+        (make_theme(f'{p}-{n}', f'dir/{p}.siq', n) for p in range(20) for n in range(1, 4)),
+        key=get_theme_position,
+    )
+    path = str(tmp_path / 'index.json')
+    write_index(themes=themes, output=path)
+    invoke(split_index.main, f'--index_path={path}', '--shards=3', f'--output={tmp_path}/shard.{{shard}}.json')
+    shards = [read_index(str(tmp_path / f'shard.{n}.json')).themes for n in range(3)]
+    assert all(shards)
+    assert sum(len(v) for v in shards) == len(themes)
+    for shard in shards:
+        assert len({v.path for v in shard}) * 3 == len(shard)
+    output = str(tmp_path / 'merged.json')
+    invoke(merge_index.main, f'--output={output}', *(str(tmp_path / f'shard.{n}.json') for n in range(3)))
+    with open(path) as original, open(output) as merged:
+        assert original.read() == merged.read()
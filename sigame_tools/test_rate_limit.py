@@ -0,0 +1,53 @@
+import pytest
+
+from sigame_tools.rate_limit import TokenBucket
+from sigame_tools.testing import FakeClock
+
+
+def make_bucket(rate, capacity):
+    clock = FakeClock()
+    return TokenBucket(rate=rate, capacity=capacity, clock=clock, sleep=clock.sleep), clock
+
+
+def test_acquire_within_capacity_should_not_wait():
+    bucket, clock = make_bucket(rate=100, capacity=100)
+    assert bucket.acquire(60) == 0
+    assert bucket.acquire(40) == 0
+    assert clock.time == 0
+
+
+def test_acquire_over_capacity_should_wait_for_debt():
+    bucket, clock = make_bucket(rate=100, capacity=100)
+    assert bucket.acquire(300) == pytest.approx(2)
+    assert clock.time == pytest.approx(2)
+
+
+def test_acquire_zero_should_wait_for_previous_debt():
+    bucket, clock = make_bucket(rate=100, capacity=100)
+    bucket.acquire(150)
+    clock.time = 0.25
+    assert bucket.acquire(0) == pytest.approx(0.25)
+
+
+def test_tokens_should_not_exceed_capacity():
+    bucket, clock = make_bucket(rate=100, capacity=100)
+    clock.time = 10
+    assert bucket.acquire(100) == 0
+    assert bucket.acquire(50) == pytest.approx(0.5)
+
+
+def test_reservations_should_accumulate_debt():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=1000, capacity=0, clock=clock, sleep=lambda _: None)
+    assert [bucket.acquire(500) for _ in range(4)] == pytest.approx([0.5, 1, 1.5, 2])
+
+
+def test_try_acquire_should_not_take_tokens_over_available():
+    bucket, clock = make_bucket(rate=10, capacity=2)
+    assert bucket.try_acquire(1)
+    assert bucket.try_acquire(1)
+    assert not bucket.try_acquire(1)
+    clock.time = 0.1
+    assert bucket.try_acquire(1)
+    assert not bucket.try_acquire(1)
+    assert clock.time == 0.1
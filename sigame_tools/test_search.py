@@ -0,0 +1,80 @@
+import pytest
+
+from sigame_tools.common import (
+    ThemeMetadata,
+    encode_answer,
+)
+
+from sigame_tools.search import (
+    SearchIndex,
+    build_search_index,
+)
+
+THEMES = (
+    ('Кошки и собаки', 'Зоопарк', ('Иван Петров',), ('Мейн-кун', 'Сфинкс')),
+    ('Rock music', 'Music pack', ('John Smith',), ('Led Zeppelin', 'Deep Purple')),
+    ('Кино', 'Зоопарк', ('Anna Lee',), ('Бриллиантовая рука', 'Иван Васильевич меняет профессию')),
+)
+
+
+def make_theme(number, theme_name, package_name, authors, right_answers):
+    return ThemeMetadata(
+        id=str(number),
+        round_number=0,
+        theme_number=number,
+        path='package.siq',
+        package_name=package_name,
+        round_name='Round',
+        theme_name=theme_name,
+        questions_num=len(right_answers),
+        authors=authors,
+        base64_encoded_right_answers=tuple(encode_answer(v) for v in right_answers),
+        round_type=None,
+        file_name='package.siq',
+        images_num=0,
+        videos_num=0,
+        voices_num=0,
+        media_bytes=0,
+        media_ok=True,
+    )
+
+
+@pytest.fixture
+def search_index(tmp_path):
+    path = str(tmp_path / 'search.sqlite')
+    build_search_index(themes=[make_theme(n, *v) for n, v in enumerate(THEMES)], output=path)
+    with SearchIndex(path) as index:
+        yield index
+
+
+def test_find_should_match_case_insensitive_substring_of_decoded_answers(search_index):
+    results = search_index.find('ZEPPELIN')
+    assert [v.id for v in results] == ['1']
+    assert results[0].right_answers == ('Led Zeppelin', 'Deep Purple')
+    assert [v.id for v in search_index.find('ВАСИЛЬЕВ')] == ['2']
+
+
+def test_find_should_search_only_given_fields(search_index):
+    assert sorted(v.id for v in search_index.find('Иван')) == ['0', '2']
+    assert [v.id for v in search_index.find('Иван', fields=('authors',))] == ['0']
+    assert [v.id for v in search_index.find('Зоо', fields=('theme_name',))] == []
+
+
+def test_find_should_match_short_queries(search_index):
+    assert [v.id for v in search_index.find('ки', fields=('theme_name',))] == ['0', '2']
+
+
+def test_find_should_not_fail_on_query_syntax(search_index):
+    assert search_index.find('"rock" OR *') == []
+
+
+def test_find_similar_should_match_misspelled_values(search_index):
+    results = search_index.find_similar('Led Zepelin', min_similarity=0.8)
+    assert [v.id for v in results] == ['1']
+    assert 0.8 <= results[0].score < 1
+    assert search_index.find_similar('Led Zepelin', fields=('theme_name',)) == []
+
+
+def test_find_should_reject_unknown_fields(search_index):
+    with pytest.raises(ValueError):
+        search_index.find('rock', fields=('base64_encoded_right_answers',))
@@ -0,0 +1,147 @@
+import concurrent.futures
+import io
+import json
+import os
+import re
+import requests
+import shutil
+import zipfile
+
+from serve_packs import PackServer
+from sigame_tools.common import (
+    build_themes_index,
+    get_content,
+    write_index,
+)
+from sigame_tools.synthetic import (
+    CorpusParameters,
+    generate_corpus,
+)
+from sigame_tools.instrumentation import STATS
+from sigame_tools.testing import run_server
+
+CORPUS_PARAMETERS = CorpusParameters(
+    packages=4,
+    rounds=2,
+    themes_per_round=3,
+    questions_per_theme=5,
+    answers_per_question=1,
+    media_per_theme=2,
+    media_size=100,
+    final_themes=1,
+)
+
+PACK_PARAMETERS = dict(rounds=3, themes_per_round=2, min_questions_per_theme=5, max_questions_per_theme=5,
+                       random_seed=7)
+
+
+def make_index(tmp_path, packages):
+    paths = generate_corpus(output_dir=str(tmp_path / 'corpus'), parameters=CORPUS_PARAMETERS, random_seed=1)
+    index_path = str(tmp_path / 'index.json')
+    write_index(themes=build_themes_index(paths[:packages]), output=index_path)
+    return index_path
+
+
+def make_server(index_path, **kwargs):
+    return PackServer(address=('127.0.0.1', 0), index_path=index_path, **kwargs)
+
+
+def read_pack(data):
+    with zipfile.ZipFile(io.BytesIO(data)) as siq:
+        content = get_content(siq)
+        names = set(siq.namelist())
+    themes = [v.attrib['name'] for v in content.iter('theme')]
+    files = [v.text[1:] for v in content.iter('atom') if v.attrib.get('type') == 'image']
+    return themes, files, names
+
+
+def read_rounds_text(data):
+    with zipfile.ZipFile(io.BytesIO(data)) as siq:
+        content = get_content(siq)
+    return [(v.tag, sorted(v.attrib.items()), None if 'type' in v.attrib else v.text)
+            for v in content.find('{*}rounds').iter()]
+
+
+def test_serve_packs_should_generate_reproducible_packs_from_warm_index(tmp_path):
+    with run_server(make_server(make_index(tmp_path, packages=4))) as url:
+        responses = [requests.post(f'{url}/pack', json=PACK_PARAMETERS) for _ in range(2)]
+        assert [v.status_code for v in responses] == [200, 200]
+        packs = [read_pack(v.content) for v in responses]
+        assert packs[0][0] == packs[1][0]
+        for _, files, names in packs:
+            assert files
+            assert all(f'Images/{v}' in names for v in files)
+
+
+def test_serve_packs_should_generate_same_packs_for_concurrent_requests_with_same_seed(tmp_path):
+    with run_server(make_server(make_index(tmp_path, packages=4))) as url:
+        parameters = [dict(PACK_PARAMETERS, random_seed=v % 2, obfuscate=True) for v in range(8)]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+            responses = list(executor.map(lambda v: requests.post(f'{url}/pack', json=v), parameters))
+        assert [v.status_code for v in responses] == [200] * 8
+        contents = [read_rounds_text(v.content) for v in responses]
+        assert contents[0::2] == [contents[0]] * 4
+        assert contents[1::2] == [contents[1]] * 4
+        assert contents[0] != contents[1]
+
+
+def test_serve_packs_should_reload_replaced_index(tmp_path):
+    index_path = make_index(tmp_path, packages=1)
+    with run_server(make_server(index_path)) as url:
+        assert requests.get(f'{url}/status').json()['themes'] == 7
+        new_index_path = make_index(tmp_path / 'new', packages=4)
+        os.replace(new_index_path, index_path)
+        assert requests.get(f'{url}/status').json()['themes'] == 28
+
+
+def test_serve_packs_should_reject_invalid_parameters(tmp_path):
+    with run_server(make_server(make_index(tmp_path, packages=1))) as url:
+        response = requests.post(f'{url}/pack', json=dict(rounds='three'))
+        assert response.status_code == 400
+        response = requests.post(f'{url}/pack', json=dict(filter=[['include', 'unknown_field', 'x']]))
+        assert response.status_code == 400
+        response = requests.post(f'{url}/pack', json=dict(PACK_PARAMETERS, themes_per_round=100))
+        assert response.status_code == 422
+        assert re.search("Can't get themes", response.json()['error'])
+
+
+def test_serve_packs_should_use_only_named_indexes(tmp_path):
+    index_path = make_index(tmp_path, packages=4)
+    played_path = str(tmp_path / 'played.json')
+    shutil.copy(index_path, played_path)
+    with run_server(make_server(index_path, named_indexes=dict(played=played_path))) as url:
+        response = requests.post(f'{url}/pack', json=dict(exclude_index_path=[index_path]))
+        assert response.status_code == 400
+        response = requests.post(f'{url}/pack', json=dict(PACK_PARAMETERS, exclude_index=['unknown']))
+        assert response.status_code == 400
+        assert response.json()['error'] == 'Unknown indexes: unknown'
+        response = requests.post(f'{url}/pack', json=dict(PACK_PARAMETERS, prefer_index=['played']))
+        assert response.status_code == 200
+        response = requests.post(f'{url}/pack', json=dict(PACK_PARAMETERS, exclude_index=['played']))
+        assert response.status_code == 422
+
+
+def test_serve_packs_should_reload_named_index_only_when_replaced(tmp_path):
+    index_path = make_index(tmp_path, packages=4)
+    played_path = str(tmp_path / 'played.json')
+    shutil.copy(index_path, played_path)
+    STATS.reset()
+    with run_server(make_server(index_path, named_indexes=dict(played=played_path))) as url:
+        for _ in range(3):
+            response = requests.post(f'{url}/pack', json=dict(PACK_PARAMETERS, exclude_index=['played']))
+            assert response.status_code == 422
+        assert STATS.report()['counters']['named_index_loads'] == 1
+        os.replace(make_index(tmp_path / 'new', packages=1), played_path)
+        response = requests.post(f'{url}/pack', json=dict(PACK_PARAMETERS, exclude_index=['played']))
+        assert response.status_code == 200
+        assert STATS.report()['counters']['named_index_loads'] == 2
+
+
+def test_serve_packs_should_respond_with_error_on_failure(tmp_path):
+    index_path = make_index(tmp_path, packages=1)
+    named_indexes = dict(played=str(tmp_path / 'missing.json'))
+    with run_server(make_server(index_path, named_indexes=named_indexes)) as url:
+        response = requests.post(f'{url}/pack', json=dict(PACK_PARAMETERS, rounds=1, exclude_index=['played']))
+        assert response.status_code == 500
+        assert response.json() == dict(error='Failed to generate pack')
+        assert requests.get(f'{url}/status').status_code == 200
@@ -0,0 +1,67 @@
+import concurrent.futures
+import http.server
+import threading
+import time
+
+from sigame_tools.session import make_session
+from sigame_tools.testing import run_server
+
+
+class Server(http.server.ThreadingHTTPServer):
+    def __init__(self, delay):
+        super().__init__(('127.0.0.1', 0), Handler)
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.active_connections = 0
+        self.max_active_connections = 0
+        self.user_agents = set()
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+            self.server.active_connections += 1
+            self.server.max_active_connections = max(self.server.max_active_connections,
+                                                     self.server.active_connections)
+
+    def finish(self):
+        super().finish()
+        with self.server.lock:
+            self.server.active_connections -= 1
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.user_agents.add(self.headers['User-Agent'])
+        time.sleep(self.server.delay)
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def log_message(self, *args):
+        pass
+
+
+def test_session_should_reuse_connection():
+    server = Server(delay=0)
+    with run_server(server) as url:
+        with make_session(user_agent='test') as session:
+            for _ in range(5):
+                assert session.get(url).content == b'ok'
+        assert server.connections == 1
+        assert server.user_agents == {'test'}
+
+
+def test_session_should_limit_connections_per_host():
+    server = Server(delay=0.05)
+    with run_server(server) as url:
+        with make_session(user_agent='test', max_connections_per_host=2) as session:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=6) as executor:
+                results = list(executor.map(lambda _: session.get(url).content, range(12)))
+        assert results == [b'ok'] * 12
+        assert server.max_active_connections <= 2
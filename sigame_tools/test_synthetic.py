@@ -0,0 +1,34 @@
+from sigame_tools.common import build_themes_index
+from sigame_tools.synthetic import (
+    CorpusParameters,
+    generate_corpus,
+)
+
+
+def test_generate_corpus_should_write_indexable_packages(tmp_path):
+    parameters = CorpusParameters(
+        packages=3,
+        rounds=2,
+        themes_per_round=4,
+        questions_per_theme=5,
+        answers_per_question=2,
+        media_per_theme=2,
+        media_size=100,
+        final_themes=1,
+    )
+    paths = generate_corpus(output_dir=str(tmp_path), parameters=parameters, random_seed=1)
+    themes = tuple(build_themes_index(paths))
+    assert len(themes) == 3 * (2 * 4 + 1)
+    normal_themes = [v for v in themes if v.round_type is None]
+    assert all(v.questions_num == 5 for v in normal_themes)
+    assert all(v.images_num == 2 and v.media_bytes == 200 for v in normal_themes)
+    assert all(len(v.base64_encoded_right_answers) == 10 for v in normal_themes)
+    assert [v.questions_num for v in themes if v.round_type == 'final'] == [1, 1, 1]
+
+
+def test_generate_corpus_should_be_reproducible(tmp_path):
+    first = generate_corpus(output_dir=str(tmp_path / 'first'), random_seed=1)
+    second = generate_corpus(output_dir=str(tmp_path / 'second'), random_seed=1)
+    first_themes = [v.theme_name for v in build_themes_index(first)]
+    second_themes = [v.theme_name for v in build_themes_index(second)]
+    assert first_themes == second_themes
@@ -0,0 +1,177 @@
+import click.testing
+import json
+import os
+import pytest
+import shutil
+import threading
+import time
+
+import update_index
+
+from sigame_tools.common import (
+    build_themes_index,
+    read_index,
+    write_index,
+)
+
+from sigame_tools.incremental_index import (
+    IncrementalIndex,
+)
+
+from sigame_tools.manifest import (
+    Manifest,
+)
+
+from sigame_tools.testing import (
+    write_package,
+)
+
+from sigame_tools.watch import (
+    scan_package_files,
+)
+
+
+def run_update(index_path, output, paths, *args):
+    result = click.testing.CliRunner().invoke(update_index.main, [
+        f'--index_path={index_path}', f'--output={output}', '--jobs=1', '--log_level=error', *args, *paths,
+    ])
+    if result.exception is not None and not isinstance(result.exception, SystemExit):
+        raise result.exception
+    assert result.exit_code == 0, result.output
+    return read_index(output).themes
+
+
+@pytest.fixture
+def index(tmp_path):
+    paths = [
+        write_package(tmp_path / 'a.siq', name='A', themes=[('A1', 'a1'), ('A2', 'a2')]),
+        write_package(tmp_path / 'b.siq', name='B', themes=[('B1', 'b1')]),
+    ]
+    index_path = str(tmp_path / 'index.json')
+    write_index(themes=build_themes_index(paths=paths), output=index_path)
+    return index_path, paths
+
+
+def test_update_index_should_preserve_ids_and_add_new_themes_once(index, tmp_path):
+    index_path, paths = index
+    old_themes = read_index(index_path).themes
+    write_package(paths[1], name='B', themes=[('B1', 'b1'), ('B2', 'b2')])
+    c_path = write_package(tmp_path / 'c.siq', name='C', themes=[('C1', 'c1')])
+    themes = run_update(index_path, str(tmp_path / 'new.json'), [str(tmp_path)])
+    assert [v.theme_name for v in themes] == ['A1', 'A2', 'B1', 'B2', 'C1']
+    assert [v.id for v in themes[:3]] == [v.id for v in old_themes]
+    assert len({v.id for v in themes}) == 5
+    assert themes[-1].path == c_path
+
+
+def test_update_index_should_skip_new_duplicates_of_indexed_packages(index, tmp_path):
+    index_path, paths = index
+    (tmp_path / 'new').mkdir()
+    shutil.copyfile(paths[1], tmp_path / 'new' / 'b.siq')
+    c_path = write_package(tmp_path / 'new' / 'c.siq', name='C', themes=[('C1', 'c1')])
+    themes = run_update(index_path, str(tmp_path / 'new.json'), [str(tmp_path)])
+    assert [(v.theme_name, v.path) for v in themes] == [
+        ('A1', paths[0]), ('A2', paths[0]), ('B1', paths[1]), ('C1', c_path),
+    ]
+
+
+def test_update_index_should_fail_on_changed_theme_unless_forced(index, tmp_path):
+    index_path, paths = index
+    old_themes = read_index(index_path).themes
+    write_package(paths[0], name='A', themes=[('A1', 'a1'), ('A2', 'changed')])
+    with pytest.raises(RuntimeError, match='base64_encoded_right_answers'):
+        run_update(index_path, str(tmp_path / 'new.json'), paths)
+    themes = run_update(index_path, str(tmp_path / 'new.json'), paths, f'--force={old_themes[1].id}')
+    assert sorted(v.theme_name for v in themes) == ['A1', 'A2', 'B1']
+    ids = {v.theme_name: v.id for v in themes}
+    assert ids['A1'] == old_themes[0].id
+    assert ids['A2'] != old_themes[1].id
+
+
+def test_update_index_should_not_diff_fields_missing_in_old_version(index, tmp_path, monkeypatch):
+    index_path, paths = index
+    with open(index_path) as stream:
+        data = json.load(stream)
+    data['version'] = 4
+    for theme in data['themes']:
+        del theme['media_ok']
+    with open(index_path, 'w') as stream:
+        json.dump(data, stream)
+    monkeypatch.setattr(update_index, 'get_diff', lambda **_: pytest.fail('Unexpected diff'))
+    themes = run_update(index_path, str(tmp_path / 'new.json'), paths)
+    assert [v.media_ok for v in themes] == [True, True, True]
+
+
+def test_update_index_should_skip_broken_and_missing_packages(index, tmp_path):
+    index_path, paths = index
+    with open(paths[0], 'wb') as stream:
+        stream.write(b'not a zip')
+    (tmp_path / 'b.siq').unlink()
+    assert run_update(index_path, str(tmp_path / 'new.json'), [str(tmp_path)]) == tuple()
+
+
+def test_update_changed_packages_should_reindex_only_changed_packages(index, tmp_path):
+    index_path, paths = index
+    old_themes = read_index(index_path).themes
+    incremental_index = IncrementalIndex(index_path)
+    write_package(paths[0], name='A', themes=[('A1', 'a1'), ('A2', 'changed')])
+    write_package(paths[1], name='B', themes=[('B1', 'b1'), ('B2', 'b2')])
+    c_path = write_package(tmp_path / 'c.siq', name='C', themes=[('C1', 'c1')])
+    changed = {paths[0], paths[1], c_path}
+    assert update_index.update_changed_packages(index=incremental_index, changed=changed, force=tuple())
+    themes = tuple(incremental_index.themes())
+    assert [v.theme_name for v in themes] == ['A1', 'A2', 'B1', 'B2', 'C1']
+    assert [v.id for v in themes[:3]] == [v.id for v in old_themes]
+    os.remove(c_path)
+    assert update_index.update_changed_packages(index=incremental_index, changed={c_path}, force=tuple())
+    assert c_path not in incremental_index
+
+
+def test_update_changed_packages_should_add_package_dropped_into_manifest_cache(tmp_path):
+    cache_dir = tmp_path / 'cache'
+    Manifest(str(cache_dir)).close()
+    path = write_package(cache_dir / 'dropped.siq', name='D', themes=[('D1', 'd1')])
+    incremental_index = IncrementalIndex(str(tmp_path / 'index.json'))
+    assert update_index.update_changed_packages(index=incremental_index, changed={path}, force=tuple())
+    assert [(v.theme_name, v.file_name) for v in incremental_index.get(path)] == [('D1', 'dropped.siq')]
+
+
+def test_update_changed_packages_should_keep_watching_after_package_failure(index, tmp_path, monkeypatch):
+    index_path, paths = index
+    incremental_index = IncrementalIndex(index_path)
+    old_themes = incremental_index.get(paths[0])
+    c_path = write_package(tmp_path / 'c.siq', name='C', themes=[('C1', 'c1')])
+    read_package_themes = update_index.read_package_themes
+
+    def read_package_themes_or_fail(path, file_name):
+        if path == paths[0]:
+            raise FileNotFoundError(path)
+        return read_package_themes(path=path, file_name=file_name)
+
+    monkeypatch.setattr(update_index, 'read_package_themes', read_package_themes_or_fail)
+    assert update_index.update_changed_packages(index=incremental_index, changed={paths[0], c_path},
+                                                force=tuple())
+    assert incremental_index.get(paths[0]) == old_themes
+    assert [v.theme_name for v in incremental_index.get(c_path)] == ['C1']
+
+
+def test_update_index_should_watch_paths_and_rewrite_index(index, tmp_path):
+    index_path, paths = index
+    output = str(tmp_path / 'new.json')
+    write_index(themes=read_index(index_path).themes, output=output)
+    stop = threading.Event()
+    thread = threading.Thread(target=update_index.watch_index, kwargs=dict(
+        output=output, paths=[str(tmp_path)], force=tuple(), search_index=None, interval=0.01, debounce=0.05,
+        snapshot=scan_package_files([str(tmp_path)]), stop=stop,
+    ))
+    thread.start()
+    try:
+        write_package(tmp_path / 'c.siq', name='C', themes=[('C1', 'c1')])
+        deadline = time.monotonic() + 10
+        while len(read_index(output).themes) != 4:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+    finally:
+        stop.set()
+        thread.join()
+    assert [v.theme_name for v in read_index(output).themes] == ['A1', 'A2', 'B1', 'C1']
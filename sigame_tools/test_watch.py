@@ -0,0 +1,58 @@
+import os
+import queue
+import threading
+
+from sigame_tools.watch import (
+    get_changed_packages,
+    scan_package_files,
+    watch_packages,
+)
+
+
+def touch(path, content='data', mtime_ns=None):
+    with open(path, 'w') as stream:
+        stream.write(content)
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+    return str(path)
+
+
+def test_scan_package_files_should_find_packages_and_meta_recursively(tmp_path):
+    (tmp_path / 'dir').mkdir()
+    package = touch(tmp_path / 'dir' / 'a.siq')
+    meta = touch(tmp_path / 'dir' / 'a.siq.meta.json')
+    touch(tmp_path / 'dir' / 'a.txt')
+    single = touch(tmp_path / 'b.siq')
+    files = scan_package_files([str(tmp_path / 'dir'), single, str(tmp_path / 'missing')])
+    assert sorted(files) == sorted([package, meta, single])
+
+
+def test_get_changed_packages_should_map_meta_changes_to_packages(tmp_path):
+    a = touch(tmp_path / 'a.siq', mtime_ns=10 ** 18)
+    touch(tmp_path / 'a.siq.meta.json', mtime_ns=10 ** 18)
+    b = touch(tmp_path / 'b.siq', mtime_ns=10 ** 18)
+    old = scan_package_files([str(tmp_path)])
+    assert get_changed_packages(old=old, new=old) == set()
+    touch(tmp_path / 'a.siq.meta.json', content='changed', mtime_ns=10 ** 18)
+    os.remove(b)
+    c = touch(tmp_path / 'c.siq')
+    assert get_changed_packages(old=old, new=scan_package_files([str(tmp_path)])) == {a, b, c}
+
+
+def test_watch_packages_should_report_changes_after_debounce(tmp_path):
+    changes = queue.Queue()
+    stop = threading.Event()
+    thread = threading.Thread(target=watch_packages, kwargs=dict(
+        paths=[str(tmp_path)], interval=0.01, debounce=0.1, on_change=changes.put, stop=stop,
+        snapshot=scan_package_files([str(tmp_path)]),
+    ))
+    thread.start()
+    try:
+        a = touch(tmp_path / 'a.siq')
+        touch(tmp_path / 'a.siq.meta.json')
+        b = touch(tmp_path / 'b.siq')
+        assert changes.get(timeout=10) == {a, b}
+        assert changes.empty()
+    finally:
+        stop.set()
+        thread.join()
@@ -0,0 +1,53 @@
+import contextlib
+import threading
+import zipfile
+
+CONTENT_XML = (
+    '<?xml version="1.0" encoding="utf-8"?>'
+    + '<package name="{name}" version="4" xmlns="http://vladimirkhil.com/ygpackage3.0.xsd">'
+    + '<rounds><round name="Round"><themes>{themes}</themes></round></rounds>'
+    + '</package>'
+)
+
+THEME_XML = (
+    '<theme name="{name}"><questions><question price="100">'
+    + '<scenario><atom>Question</atom></scenario><right><answer>{answer}</answer></right>'
+    + '</question></questions></theme>'
+)
+
+DEFAULT_THEMES = (('Theme', 'Answer'),)
+
+
+def make_content_xml(name, themes=DEFAULT_THEMES):
+    return CONTENT_XML.format(
+        name=name,
+        themes=''.join(THEME_XML.format(name=v, answer=a) for v, a in themes),
+    )
+
+
+def write_package(path, name, themes=DEFAULT_THEMES):
+    with zipfile.ZipFile(path, 'w') as siq:
+        siq.writestr('content.xml', make_content_xml(name=name, themes=themes))
+    return str(path)
+
+
+class FakeClock:
+    def __init__(self):
+        self.time = 0
+
+    def __call__(self):
+        return self.time
+
+    def sleep(self, duration):
+        self.time += duration
+
+
+@contextlib.contextmanager
+def run_server(server):
+    thread = threading.Thread(target=server.serve_forever, kwargs=dict(poll_interval=0.01), daemon=True)
+    thread.start()
+    try:
+        yield f'http://127.0.0.1:{server.server_port}'
+    finally:
+        server.shutdown()
+        server.server_close()
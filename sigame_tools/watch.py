@@ -0,0 +1,73 @@
+import logging
+import os
+import time
+
+PACKAGE_SUFFIX = '.siq'
+
+META_SUFFIX = '.meta.json'
+
+WATCHED_SUFFIXES = (PACKAGE_SUFFIX, PACKAGE_SUFFIX + META_SUFFIX)
+
+log = logging.getLogger(__name__)
+
+
+def watch_packages(paths, interval, debounce, on_change, stop, snapshot=None):
+    if snapshot is None:
+        snapshot = scan_package_files(paths)
+    pending = set()
+    changed_at = None
+    while not stop.wait(interval):
+        new_snapshot = scan_package_files(paths)
+        changed = get_changed_packages(old=snapshot, new=new_snapshot)
+        snapshot = new_snapshot
+        if changed:
+            log.debug('Found %s changed packages', len(changed))
+            pending |= changed
+            changed_at = time.monotonic()
+            continue
+        if pending and time.monotonic() - changed_at >= debounce:
+            log.info('Update %s changed packages...', len(pending))
+            on_change(pending)
+            pending = set()
+
+
+def scan_package_files(paths):
+    files = dict()
+    for path in paths:
+        if os.path.isdir(path):
+            scan_dir(path=path, files=files)
+        elif path.endswith(PACKAGE_SUFFIX):
+            add_file(path=path, files=files)
+            add_file(path=path + META_SUFFIX, files=files)
+    return files
+
+
+def scan_dir(path, files):
+    try:
+        entries = os.scandir(path)
+    except FileNotFoundError:
+        return
+    with entries:
+        for entry in entries:
+            if entry.is_dir():
+                scan_dir(path=entry.path, files=files)
+            elif entry.name.endswith(WATCHED_SUFFIXES):
+                add_file(path=entry.path, files=files, stat=entry.stat)
+
+
+def add_file(path, files, stat=None):
+    try:
+        result = os.stat(path) if stat is None else stat()
+    except FileNotFoundError:
+        return
+    files[path] = (result.st_mtime_ns, result.st_size)
+
+
+def get_changed_packages(old, new):
+    return {get_package_path(v) for v in old.keys() | new.keys() if old.get(v) != new.get(v)}
+
+
+def get_package_path(path):
+    if path.endswith(META_SUFFIX):
+        return path[:-len(META_SUFFIX)]
+    return path
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+
+import click
+import contextlib
+import hashlib
+import logging
+
+from sigame_tools.common import (
+    IndexWriter,
+    open_index,
+)
+
+from sigame_tools.instrumentation import (
+    instrumented,
+    span,
+)
+
+log = logging.getLogger('split_index')
+
+
+@click.command()
+@click.option('--index_path', type=click.Path(exists=True, dir_okay=False), required=True)
+@click.option('--shards', type=int, required=True)
+@click.option('--output', type=str, required=True,
+              help='Path of a shard with {shard} placeholder for its number, for example index.{shard}.json.')
+@instrumented
+def main(index_path, shards, output):
+    assert shards > 0
+    assert '{shard}' in output, 'Output should contain {shard} placeholder'
+    with open_index(index_path) as index, contextlib.ExitStack() as stack:
+        writers = [stack.enter_context(IndexWriter(output.format(shard=v))) for v in range(shards)]
+        with span('split'):
+            for theme in index.themes:
+                writers[get_shard(path=theme.path, shards=shards)].write(theme)
+    for number, writer in enumerate(writers):
+        log.info('Write %s themes to %s', writer.themes, output.format(shard=number))
+
+
+def get_shard(path, shards):
+    return int.from_bytes(hashlib.sha256(path.encode('utf-8')).digest()[:8], 'big') % shards
+
+
+if __name__ == "__main__":
+    main()
@@ -1,86 +1,217 @@
 #!/usr/bin/env python3
 
 import click
-import deepdiff
+import logging
 import os.path
-import zipfile
+import threading
 
 from sigame_tools.common import (
-    NoContentXml,
+    PackageFile,
     ThemeMetadata,
     build_themes_index,
     get_file_name,
-    get_themes_metadata,
-    read_content,
+    get_theme_position,
     read_index,
+    read_package_themes,
+    read_packages_themes,
     write_index,
 )
 
+from sigame_tools.incremental_index import (
+    IncrementalIndex,
+)
+
+from sigame_tools.instrumentation import (
+    count,
+    instrumented,
+    span,
+)
+
+from sigame_tools.search import (
+    build_search_index,
+)
+
+from sigame_tools.watch import (
+    scan_package_files,
+    watch_packages,
+)
+
+NEW_FIELDS = (
+    (2, ('file_name',)),
+    (3, ('images_num', 'videos_num', 'voices_num')),
+    (4, ('media_bytes',)),
+    (5, ('media_ok',)),
+)
+
+log = logging.getLogger('update_index')
+
 
 @click.command()
 @click.option('--index_path', type=str, required=True)
 @click.option('--output', type=str, required=True)
 @click.option('--force', type=str, multiple=True)
+@click.option('--search_index', type=click.Path(dir_okay=False), default=None,
+              help='Also build search index for search_index.py at a given path.')
+@click.option('--jobs', type=int, default=None,
+              help='Number of processes to read packages. Number of CPUs is used by default.')
+@click.option('--watch', type=click.Choice(('true', 'false')), default='false', show_default=True,
+              help='Keep running and update the output index when .siq or .siq.meta.json files in paths change.')
+@click.option('--watch_interval', type=float, default=5, show_default=True,
+              help='Seconds between scans of paths in watch mode.')
+@click.option('--watch_debounce', type=float, default=10, show_default=True,
+              help='Seconds without new changes to wait before updating the index in watch mode.')
 @click.argument('paths', nargs=-1, type=str, required=True)
-def main(index_path, output, force, paths):
+@instrumented
+def main(index_path, output, force, search_index, jobs, watch, watch_interval, watch_debounce, paths):
+    snapshot = scan_package_files(paths) if watch == 'true' else None
     old_index = read_index(index_path)
-    processed_paths = set()
-    themes = list(update_themes(index=old_index, processed_paths=processed_paths, force=force))
-    themes.extend(list(build_themes_index(paths=paths, ignore_paths=processed_paths)))
+    with span('read_packages'):
+        packages = read_known_packages(index=old_index, jobs=jobs)
+    with span('update_themes'):
+        themes = list(update_themes(index=old_index, packages=packages, force=force))
+    themes.extend(get_new_themes(packages))
+    with span('build_index'):
+        themes.extend(build_themes_index(paths=paths, ignore_paths=set(packages), known_paths=tuple(packages),
+                                         jobs=jobs))
+    themes.sort(key=get_theme_position)
     write_index(themes=themes, output=output)
+    if search_index is not None:
+        build_search_index(themes=themes, output=search_index)
+    if watch == 'true':
+        watch_index(output=output, paths=paths, force=force, search_index=search_index, interval=watch_interval,
+                    debounce=watch_debounce, snapshot=snapshot, stop=threading.Event())
+
+
+def watch_index(output, paths, force, search_index, interval, debounce, snapshot, stop):
+    index = IncrementalIndex(output)
+
+    def on_change(changed):
+        with span('watch_update'):
+            if not update_changed_packages(index=index, changed=changed, force=force):
+                return
+            try:
+                index.flush()
+                if search_index is not None:
+                    build_search_index(themes=index.themes(), output=search_index)
+            except Exception as e:
+                log.error('Failed to write index %s, will retry on next change: %s', output, e)
+
+    log.info('Watch %s for changes...', ', '.join(paths))
+    try:
+        watch_packages(paths=paths, interval=interval, debounce=debounce, on_change=on_change, stop=stop,
+                       snapshot=snapshot)
+    except KeyboardInterrupt:
+        log.info('Stop watching')
+
+
+def update_changed_packages(index, changed, force):
+    updated = False
+    for path in sorted(changed):
+        try:
+            updated |= update_changed_package(index=index, path=path, force=force)
+        except Exception as e:
+            log.error('Keep old themes of %s: %s', path, e)
+            count('failed_packages')
+    return updated
+
+
+def update_changed_package(index, path, force):
+    if not os.path.exists(path):
+        if path not in index:
+            return False
+        log.info('Remove themes of %s: file is missing', path)
+        count('removed_packages')
+        index.remove(path)
+        return True
+    content_themes = read_package_themes(path=path, file_name=get_file_name(path))
+    if not content_themes and index.get(path):
+        log.warning('Keep old themes of %s: no themes are read', path)
+        return False
+    themes = reindex_package(old_themes=index.get(path), content_themes=content_themes, force=force)
+    if not index.get(path):
+        log.info('Add %s new themes from %s', len(themes), path)
+        count('new_themes', len(themes))
+    index.put(path=path, themes=themes)
+    return True
 
 
-def update_themes(index, processed_paths, force):
-    contents = dict()
+def reindex_package(old_themes, content_themes, force):
+    content_themes = {(v.round_number, v.theme_number): v for v in content_themes}
+    for theme in old_themes:
+        key = (theme.round_number, theme.theme_number)
+        content_theme = content_themes.get(key)
+        if content_theme is None:
+            log.warning('Theme with round_number=%s and theme_number=%s is missing, remove old id=%s from %s',
+                        theme.round_number, theme.theme_number, theme.id, theme.path)
+            continue
+        new_theme = content_theme._replace(id=theme.id)
+        if get_changed_fields(old=theme, new=new_theme, ignored_fields=set()):
+            diff = get_diff(old=theme, new=new_theme, ignored_fields=set())
+            if theme.id not in force:
+                raise RuntimeError(f'New theme is not equal to old, remove theme from the index or run with --force={theme.id}: {diff}')
+            log.warning('New theme is not equal to old, this will invalidate theme with id %s due to reindexing: %s',
+                        theme.id, diff)
+            continue
+        content_themes[key] = new_theme
+    return tuple(content_themes.values())
+
+
+def read_known_packages(index, jobs):
+    package_files = list()
+    for path in dict.fromkeys(v.path for v in index.themes):
+        if not os.path.exists(path):
+            log.warning('Ignore %s: file is missing', path)
+            continue
+        package_files.append(PackageFile(path=path, file_name=get_file_name(path), size=None, sha256=None))
+    packages = dict()
+    for package, themes in read_packages_themes(packages=package_files, jobs=jobs):
+        packages[package.path] = {(v.round_number, v.theme_number): v for v in themes}
+    return packages
+
+
+def update_themes(index, packages, force):
+    ignored_fields = get_ignored_fields(index.version)
     for theme in index.themes:
-        content_themes = contents.get(theme.path)
+        content_themes = packages.get(theme.path)
         if content_themes is None:
-            if not os.path.exists(theme.path):
-                print(f'Ignore {theme.path}: file is missing')
-                continue
-            try:
-                content_themes = make_content_themes(theme.path)
-            except (zipfile.BadZipFile, NoContentXml) as e:
-                print(f'Ignore {path}: {str(e)}')
-                continue
-            contents[theme.path] = content_themes
-        new_theme = content_themes.get((theme.round_number, theme.theme_number))
-        if new_theme is None:
-            print(f'Theme with round_number={theme.round_number} and theme_number={theme.theme_number} is missing,'
-                  f' old id={theme.id}, will reindex {theme.path}')
             continue
-        new_theme = theme_with_id(new_theme, theme.id)
-        if theme != new_theme:
-            exclude_paths = []
-            if index.version < 3:
-                exclude_paths.extend(['root.images_num', 'root.video_num', 'root.voice_num'])
-            if index.version < 2:
-                exclude_paths.add('root.file_name')
-            diff = deepdiff.DeepDiff(theme, new_theme, exclude_paths=exclude_paths)
-            if diff and theme.id not in force:
+        key = (theme.round_number, theme.theme_number)
+        content_theme = content_themes.pop(key, None)
+        if content_theme is None:
+            log.warning('Theme with round_number=%s and theme_number=%s is missing, old id=%s, will reindex %s',
+                        theme.round_number, theme.theme_number, theme.id, theme.path)
+            continue
+        new_theme = content_theme._replace(id=theme.id)
+        if get_changed_fields(old=theme, new=new_theme, ignored_fields=ignored_fields):
+            diff = get_diff(old=theme, new=new_theme, ignored_fields=ignored_fields)
+            if theme.id not in force:
                 raise RuntimeError(f'New theme is not equal to old, remove theme from the index or run with --force={theme.id}: {diff}')
-            elif diff:
-                print(f'New theme is not equal to old, this will invalidate theme with id {theme.id} due to reindexing: {diff}')
-                continue
-        yield theme_with_id(new_theme, theme.id)
-        del content_themes[(theme.round_number, theme.theme_number)]
-        if not content_themes:
-            processed_paths.add(theme.path)
-
-
-def make_content_themes(path):
-    file_name = get_file_name(path)
-    content = read_content(path)
-    content_themes = dict()
-    for content_theme in get_themes_metadata(path=path, content=content, file_name=file_name):
-        content_themes[(content_theme.round_number, content_theme.theme_number)] = content_theme
-    return content_themes
-
-
-def theme_with_id(theme, value):
-    theme_dict = theme._asdict()
-    theme_dict['id'] = value
-    return ThemeMetadata(**theme_dict)
+            log.warning('New theme is not equal to old, this will invalidate theme with id %s due to reindexing: %s',
+                        theme.id, diff)
+            content_themes[key] = content_theme
+            continue
+        yield new_theme
+
+
+def get_new_themes(packages):
+    for path, content_themes in packages.items():
+        if content_themes:
+            log.info('Add %s new themes from %s', len(content_themes), path)
+            count('new_themes', len(content_themes))
+        yield from content_themes.values()
+
+
+def get_ignored_fields(version):
+    return {field for field_version, fields in NEW_FIELDS if version < field_version for field in fields}
+
+
+def get_changed_fields(old, new, ignored_fields):
+    return [v for v in ThemeMetadata._fields if v not in ignored_fields and getattr(old, v) != getattr(new, v)]
+
+
+def get_diff(old, new, ignored_fields):
+    import deepdiff
+    return deepdiff.DeepDiff(old, new, exclude_paths=[f'root.{v}' for v in sorted(ignored_fields)])
 
 
 if __name__ == "__main__":